@@ -19,8 +19,10 @@ from db.model.facility import (
     FacilityCoveringType,
     FacilityPayingType,
     FacilityAge,
-    FacilityPhoto
+    FacilityPhoto,
+    facility_categories
 )
+from service.data_version import facility_data_version
 
 
 def _encode_token(email: str, password: str):
@@ -52,6 +54,19 @@ class AdminAuth(AuthenticationBackend):
             return RedirectResponse(request.url_for("admin:login"), status_code=302)
 
 
+class FacilityDataModelView(ModelView):
+    """
+    Изменения через админку тоже сбрасывают кеши объектов.
+    """
+    async def after_model_change(self, data: dict, model, is_created: bool) -> None:
+        facility_categories.clear()
+        await facility_data_version.bump(app_context.db.async_session)
+
+    async def after_model_delete(self, model) -> None:
+        facility_categories.clear()
+        await facility_data_version.bump(app_context.db.async_session)
+
+
 def setup_admin(app: FastAPI):
     logger.debug(f"[{os.getpid()}] SETUP ADMIN FOR APP")
 
@@ -79,48 +94,63 @@ def setup_admin(app: FastAPI):
         column_details_exclude_list = [User.password_hash]
     admin.add_view(UserAdmin)
 
-    class FacilityAdmin(ModelView, model=Facility):
+    class FacilityAdmin(FacilityDataModelView, model=Facility):
         icon = "fa-solid fa-file"
         page_size = 50
         column_sortable_list = [Facility.created_at]
         column_searchable_list = [Facility.name, Facility.address, Facility.owner]
         column_list = [Facility.name, Facility.address, Facility.owner, Facility.type, Facility.id, Facility.created_at]
+        # вычисляемые колонки не загружаются ORM и не редактируются
+        column_details_exclude_list = [
+            Facility.search_vector, Facility.location, Facility.grid_column, Facility.grid_row, Facility.open_minutes
+        ]
+        # версию увеличивает ORM при каждом изменении
+        form_excluded_columns = [
+            Facility.search_vector, Facility.location, Facility.grid_column, Facility.grid_row, Facility.open_minutes,
+            Facility.version
+        ]
     admin.add_view(FacilityAdmin)
 
-    class FacilityTypeAdmin(ModelView, model=FacilityType):
+    class FacilityTypeAdmin(FacilityDataModelView, model=FacilityType):
         icon = "fa-solid fa-tag"
         column_details_exclude_list = [FacilityType.facilities]
+        form_excluded_columns = [FacilityType.facilities]
         column_list = [FacilityType.name]
     admin.add_view(FacilityTypeAdmin)
 
-    class FacilityOwningTypeAdmin(ModelView, model=FacilityOwningType):
+    class FacilityOwningTypeAdmin(FacilityDataModelView, model=FacilityOwningType):
         icon = "fa-solid fa-tag"
         column_details_exclude_list = [FacilityOwningType.facilities]
+        form_excluded_columns = [FacilityOwningType.facilities]
         column_list = [FacilityOwningType.name]
     admin.add_view(FacilityOwningTypeAdmin)
 
-    class FacilityCoveringTypeAdmin(ModelView, model=FacilityCoveringType):
+    class FacilityCoveringTypeAdmin(FacilityDataModelView, model=FacilityCoveringType):
         icon = "fa-solid fa-tag"
         column_details_exclude_list = [FacilityCoveringType.facilities]
+        form_excluded_columns = [FacilityCoveringType.facilities]
         column_list = [FacilityCoveringType.name]
     admin.add_view(FacilityCoveringTypeAdmin)
 
-    class FacilityPayingTypeAdmin(ModelView, model=FacilityPayingType):
+    class FacilityPayingTypeAdmin(FacilityDataModelView, model=FacilityPayingType):
         icon = "fa-solid fa-tag"
         column_details_exclude_list = [FacilityPayingType.facilities]
+        form_excluded_columns = [FacilityPayingType.facilities]
         column_list = [FacilityPayingType.name]
     admin.add_view(FacilityPayingTypeAdmin)
 
-    class FacilityAgeAdmin(ModelView, model=FacilityAge):
+    class FacilityAgeAdmin(FacilityDataModelView, model=FacilityAge):
         icon = "fa-solid fa-tag"
         column_details_exclude_list = [FacilityAge.facilities]
+        form_excluded_columns = [FacilityAge.facilities]
         column_list = [FacilityAge.name]
     admin.add_view(FacilityAgeAdmin)
 
-    class FacilityPhotoAdmin(ModelView, model=FacilityPhoto):
+    class FacilityPhotoAdmin(FacilityDataModelView, model=FacilityPhoto):
         icon = "fa-solid fa-tag"
         can_create = False
         column_details_exclude_list = [FacilityPhoto.facilities]
+        form_excluded_columns = [FacilityPhoto.facilities]
         column_list = [FacilityPhoto.url, FacilityPhoto.id]
     admin.add_view(FacilityPhotoAdmin)
 
@@ -66,6 +66,20 @@ def create_app() -> FastAPI:
     for i in range(400, 600):
         app.add_exception_handler(i, exception_handler)
 
+    @app.on_event('startup')
+    async def startup():
+        from api import globals
+        from service.data_version import facility_data_version
+        # записи других воркеров сбрасывают кеши этого воркера не позже, чем через API_DATA_VERSION_INTERVAL
+        facility_data_version.start(globals.app_context.db.async_session, globals.settings.API_DATA_VERSION_INTERVAL)
+
+    @app.on_event('shutdown')
+    def shutdown():
+        from api import globals
+        from service.data_version import facility_data_version
+        facility_data_version.stop()
+        globals.app_context.excel_service.close()
+
     setup_admin(app)
 
     ROUTE_PREFIX = '/v1'
@@ -4,11 +4,14 @@ import uuid
 from loguru import logger
 
 from db.db import DB
+from service.cache import VersionedCache
+from service.data_version import facility_data_version
 from service.email_service import EmailService
 from service.excel_service import ExcelService
 from service.facility_enum_service import FacilityEnumService
 from service.facility_service import FacilityService
 from service.photo_service import PhotoService
+from service.single_flight import SingleFlight
 from service.s3_service import S3Service
 from service.user_service import UserService
 from settings import Settings
@@ -28,6 +31,18 @@ class AppContext:
         self.facility_service: FacilityService = FacilityService(async_session=self.db.async_session)
         self.facility_enum_service = FacilityEnumService(async_session=self.db.async_session)
         self.email_service: EmailService = EmailService(async_session=self.db.async_session, settings=settings)
-        self.excel_service: ExcelService = ExcelService(async_session=self.db.async_session)
+        self.excel_service: ExcelService = ExcelService(
+            async_session=self.db.async_session,
+            workers=settings.API_EXCEL_WORKERS,
+            max_size=settings.API_EXCEL_MAX_SIZE,
+            timeout=settings.API_EXCEL_TIMEOUT
+        )
         self.s3_service: S3Service = S3Service(settings=settings, bucket='sportsmap.spb.ru')
         self.photo_service: PhotoService = PhotoService(async_session=self.db.async_session)
+
+        self.search_cache: VersionedCache = VersionedCache(
+            facility_data_version,
+            max_size=settings.API_SEARCH_CACHE_SIZE,
+            ttl=settings.API_SEARCH_CACHE_TTL
+        )
+        self.single_flight: SingleFlight = SingleFlight()
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, BackgroundTasks
+import uuid
+
+from fastapi import APIRouter, HTTPException, Depends, UploadFile
+from fastapi.encoders import jsonable_encoder
 from loguru import logger
 from starlette.responses import JSONResponse
 
 from api.context import AppContext
 from api.dependencies import get_app_context, admin_user
 
-import pandas as pd
-
+from api.schema.excel import ExcelImportJobResponse
 from api.schema.facility import FacilitySearchRequest
+from service.model.excel_model import ExcelImportJobServiceModel
 
 router = APIRouter(
     prefix='/excel',
@@ -24,54 +27,103 @@ async def validate_excel(
 ):
     excel_file = originFileObj
 
-    xls = pd.read_excel(excel_file.file, sheet_name=None)
-
-    facilities = app_context.excel_service.xls_to_list(xls)
-    errors = app_context.excel_service.validate_excel_facilities(facilities)
+    content = await app_context.excel_service.read_upload(excel_file)
+    # файл читается в отдельном процессе, event loop в это время обрабатывает другие запросы
+    count, errors, duplicates = await app_context.excel_service.validate_excel(content)
 
     logger.debug(
         f'VALIDATE {excel_file.size / 1000 :.3f} KB EXCEL {excel_file.filename}: '
-        f'{len(facilities)} FACILITIES: {len(errors)} ERRORS FOUND'
+        f'{count} FACILITIES: {len(errors)} ERRORS FOUND: {len(duplicates)} DUPLICATES FOUND'
     )
 
+    # дубликаты не ошибка: при импорте они пропускаются
     if len(errors) > 0:
-        return JSONResponse({"errors": errors}, status_code=400)
-
-
-@router.post('/import')
+        return JSONResponse({"errors": errors, "duplicates": jsonable_encoder(duplicates)}, status_code=400)
+    if len(duplicates) > 0:
+        return JSONResponse({"errors": [], "duplicates": jsonable_encoder(duplicates)})
+
+
+def _start_import_job(app_context: AppContext, job: ExcelImportJobServiceModel):
+    def on_done(job: ExcelImportJobServiceModel):
+        logger.debug(
+            f'IMPORT {job.size / 1000:.3f} KB EXCEL {job.filename}: {job.status}: {job.processed} INPUT: '
+            f'{job.inserted} ADDED: {job.duplicated} EXIST: {job.failed} INVALID'
+        )
+        if job.status != 'done':
+            return
+
+        if app_context.settings.YANDEX_GEOCODER_API_KEY is not None:
+            # TODO: в фоне сделать задачу на поход в геокодер для каждого объекта (не более 1000)
+            pass
+        else:
+            logger.warning("FAILED WITH USING Yandex Geocoder")
+
+        app_context.email_service.send_mail_to_self(
+            'Был загружен Excel документ',
+            f'На сайт был загружен Excel документ\n\n'
+            f'Размер файла - {job.size / 1000:.3f} KB\n'
+            f'{job.processed} спортивных объектов содержал документ\n'
+            f'{job.inserted} из них было добавлено в базу данных\n'
+            f'{job.duplicated} уже были в базе данных\n'
+            f'{job.failed} содержали ошибки'
+        )
+
+    app_context.excel_service.start_import_job(job.id, on_done)
+
+
+@router.post('/import', status_code=202)
 async def import_excel(
     originFileObj: UploadFile,
-    background_tasks: BackgroundTasks,
     app_context: AppContext = Depends(get_app_context),
     admin_user_id: str = Depends(admin_user)
-):
+) -> ExcelImportJobResponse:
+    """
+    Импорт выполняется в фоне: ответ - задача импорта, ее состояние возвращает `GET /excel/import/{id}`.
+    """
     excel_file = originFileObj
 
-    xls = pd.read_excel(excel_file.file, sheet_name=None)
+    content = await app_context.excel_service.read_upload(excel_file)
+    job = await app_context.excel_service.create_import_job(excel_file.filename, content)
+    _start_import_job(app_context, job)
 
-    facilities = app_context.excel_service.xls_to_list(xls)
+    return ExcelImportJobResponse.model_validate(job)
 
-    facilities_in_db = await app_context.excel_service.add_excel_facilities_to_db(facilities)
 
-    logger.debug(
-        f'IMPORT {excel_file.size / 1000:.3f} KB EXCEL: {len(facilities)} INPUT: {len(facilities_in_db)} ADDED'
-    )
+@router.get('/import/{id}')
+async def get_import_job(
+    id: uuid.UUID,
+    app_context: AppContext = Depends(get_app_context),
+    admin_user_id: str = Depends(admin_user)
+) -> ExcelImportJobResponse:
+    job = await app_context.excel_service.get_import_job(id)
+    return ExcelImportJobResponse.model_validate(job)
 
-    if app_context.settings.YANDEX_GEOCODER_API_KEY is not None:
-        # TODO: в фоне сделать задачу на поход в геокодер для каждого объекта (не более 1000)
-        pass
-    else:
-        logger.warning("FAILED WITH USING Yandex Geocoder")
-
-    app_context.email_service.send_mail_to_self(
-        'Был загружен Excel документ',
-        f'На сайт был загружен Excel документ\n\n'
-        f'Размер файла - {excel_file.size / 1000:.3f} KB\n'
-        f'{len(facilities)} спортивных объектов содержал документ\n'
-        f'{len(facilities_in_db)} из них было добавлено в базу данных'
-    )
 
-    return JSONResponse([str(f['id']) for f in facilities_in_db], status_code=200)
+@router.post('/import/{id}/cancel')
+async def cancel_import_job(
+    id: uuid.UUID,
+    app_context: AppContext = Depends(get_app_context),
+    admin_user_id: str = Depends(admin_user)
+) -> ExcelImportJobResponse:
+    """
+    Уже записанные строки остаются в бд, импорт можно продолжить через resume.
+    """
+    job = await app_context.excel_service.cancel_import_job(id)
+    return ExcelImportJobResponse.model_validate(job)
+
+
+@router.post('/import/{id}/resume')
+async def resume_import_job(
+    id: uuid.UUID,
+    app_context: AppContext = Depends(get_app_context),
+    admin_user_id: str = Depends(admin_user)
+) -> ExcelImportJobResponse:
+    """
+    Продолжает отмененный, упавший или прерванный импорт с первой незаписанной строки.
+    """
+    job = await app_context.excel_service.resume_import_job(id)
+    _start_import_job(app_context, job)
+    return ExcelImportJobResponse.model_validate(job)
 
 
 @router.post('/export')
@@ -88,7 +140,9 @@ async def export_excel(
     else:
         filters_ = None
 
-    count, facilities = await app_context.facility_service.search(
+    # объекты читаются из бд частями сразу в виде словарей
+    facilities = []
+    async for chunk in app_context.facility_service.search_stream(
         body.all,
         body.q,
         None,
@@ -103,9 +157,12 @@ async def export_excel(
         body.age,
         filters_,
         body.x,
-        body.y
-    )
-    facilities = [f.to_dict() for f in facilities]
+        body.y,
+        radius=body.radius,
+        nearest=body.nearest,
+        open_at=body.open_at_minute(),
+    ):
+        facilities.extend(chunk)
 
     try:
         excel_filename = 'output.xlsx'
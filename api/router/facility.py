@@ -1,12 +1,16 @@
 import uuid
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Response
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
 from api.context import AppContext
 from api.dependencies import get_app_context, admin_user
+from service.data_version import facility_data_version
+from service.exc import FacilityVersionMismatchServiceException
 from api.schema.facility import FacilityRequest, FacilityResponse, FacilityPatchRequest, FacilitySearchRequest, \
-    FacilitySearchResponse
+    FacilitySearchResponse, FacilityClusterRequest, FacilityClusterResponse, FacilityCluster, FacilityFacetsResponse, \
+    FacilityCacheMetricsResponse, FacilityBulkRequest, FacilityBulkResponse, FacilityBulkItemResponse
 
 router = APIRouter(
     prefix='/facility',
@@ -14,14 +18,33 @@ router = APIRouter(
 )
 
 
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _if_match_version(if_match: str | None) -> int | None:
+    """
+    Версия объекта из заголовка If-Match (ETag из ответа), None - изменять без проверки версии.
+    Нечитаемый ETag не совпадает ни с одной версией.
+    """
+    if if_match is None or if_match.strip() == '*':
+        return None
+    try:
+        return int(if_match.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise FacilityVersionMismatchServiceException("Спортивный объект был изменен, получите его заново.")
+
+
 @router.post('', status_code=201)
 async def create_facility(
         body: FacilityRequest,
+        response: Response,
         admin_user_id: str = Depends(admin_user),
         app_context: AppContext = Depends(get_app_context),
 
 ) -> FacilityResponse:
     facility = await app_context.facility_service.create(body)
+    response.headers['ETag'] = _etag(facility.version)
 
     app_context.email_service.send_mail_to_self(
         "Был создан новый спортивный объект",
@@ -35,24 +58,72 @@ async def create_facility(
     return FacilityResponse.from_service_model(facility)
 
 
-@router.put('/{id}')
+@router.post('/bulk')
+async def bulk_facility(
+        body: FacilityBulkRequest,
+        admin_user_id: str = Depends(admin_user),
+        app_context: AppContext = Depends(get_app_context),
+) -> FacilityBulkResponse:
+    """
+    Создание и изменение многих объектов одной транзакцией. Результат возвращается для каждого объекта:
+    объекты, которых нет, и дубликаты не записываются и получают статус error, остальные записываются.
+    """
+    facility_service = app_context.facility_service
+    created, updated = await facility_service.bulk(
+        [facility_service.to_facility_create_service_model(f.model_dump(exclude_none=True)) for f in body.create],
+        [
+            (f.id, facility_service.to_facility_patch_service_model(f.model_dump(exclude={'id'}, exclude_none=True)))
+            for f in body.update
+        ]
+    )
+
+    created_names = [f.name for f, r in zip(body.create, created) if r.status == 'created']
+    updated_count = sum(r.status == 'updated' for r in updated)
+    if created_names or updated_count:
+        app_context.email_service.send_mail_to_self(
+            "Спортивные объекты изменены пакетом",
+            f"Создано объектов - {len(created_names)}\n"
+            f"Изменено объектов - {updated_count}\n\n"
+            + "".join(f"Название - {name}\n" for name in created_names)
+        )
+
+    return FacilityBulkResponse(
+        create=[FacilityBulkItemResponse.model_validate(r) for r in created],
+        update=[FacilityBulkItemResponse.model_validate(r) for r in updated],
+    )
+
+
+@router.put('/{id}', response_model=FacilityResponse)
 async def fully_update_facility(
         id: uuid.UUID,
         body: FacilityRequest,
+        if_match: str | None = Header(None),
         admin_user_id: str = Depends(admin_user),
         app_context: AppContext = Depends(get_app_context),
-) -> FacilityResponse:
-    facility = await app_context.facility_service.put(id, body)
-    return FacilityResponse.from_service_model(facility)
+):
+    """
+    С заголовком `If-Match: <ETag>` объект изменяется, только если он не менялся с момента получения ETag,
+    иначе возвращается 412.
+    """
+    facility = await app_context.facility_service.put(id, body, _if_match_version(if_match))
+    return Response(
+        content=FacilityResponse.dump_json(facility),
+        media_type='application/json',
+        headers={'ETag': _etag(facility['version'])}
+    )
 
 
-@router.patch('/{id}')
+@router.patch('/{id}', response_model=FacilityResponse)
 async def partial_update_facility(
         id: uuid.UUID,
         body: FacilityPatchRequest,
+        if_match: str | None = Header(None),
         admin_user_id: str = Depends(admin_user),
         app_context: AppContext = Depends(get_app_context),
-) -> FacilityResponse:
+):
+    """
+    `If-Match` - как в PUT.
+    """
     body_dict = body.model_dump()
     body_without_none = dict()
     for k, v in body_dict.items():
@@ -60,34 +131,158 @@ async def partial_update_facility(
             body_without_none[k] = v
     facility = await app_context.facility_service.patch(
         id,
-        app_context.facility_service.to_facility_patch_service_model(body_without_none)
+        app_context.facility_service.to_facility_patch_service_model(body_without_none),
+        _if_match_version(if_match)
+    )
+    return Response(
+        content=FacilityResponse.dump_json(facility),
+        media_type='application/json',
+        headers={'ETag': _etag(facility['version'])}
     )
-    return FacilityResponse.from_service_model(facility)
 
 
 @router.delete('/{id}', status_code=204)
 async def delete_facility(
         id: uuid.UUID,
+        if_match: str | None = Header(None),
         admin_user_id: str = Depends(admin_user),
         app_context: AppContext = Depends(get_app_context),
 ):
-    await app_context.facility_service.delete(id)
+    """
+    `If-Match` - как в PUT.
+    """
+    await app_context.facility_service.delete(id, _if_match_version(if_match))
 
 
-@router.get('/{id}')
+@router.get('/markers')
+async def get_facility_markers(
+        if_none_match: str | None = Header(None),
+        app_context: AppContext = Depends(get_app_context),
+):
+    """
+    Маркеры всех видимых объектов для карты в компактном виде:
+    `{"types": [<тип>, ...], "markers": [[<id>, <x>, <y>, <индекс типа в types>], ...]}`.
+    """
+    etag, data = await app_context.facility_service.markers()
+    etag = f'"{etag}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=data, media_type='application/json', headers={"ETag": etag})
+
+
+@router.get('/cache/metrics')
+async def get_facility_cache_metrics(
+        admin_user_id: str = Depends(admin_user),
+        app_context: AppContext = Depends(get_app_context),
+) -> FacilityCacheMetricsResponse:
+    return FacilityCacheMetricsResponse(
+        data_version=facility_data_version.value,
+        search_cache_size=len(app_context.search_cache),
+        search_cache_hits=app_context.search_cache.hits,
+        search_cache_misses=app_context.search_cache.misses,
+        single_flight_calls=app_context.single_flight.calls,
+        single_flight_coalesced=app_context.single_flight.coalesced,
+        single_flight_in_flight=app_context.single_flight.in_flight,
+    )
+
+
+@router.get('/{id}', response_model=FacilityResponse)
 async def get_facility_by_id(
         id: uuid.UUID,
+        fields: str | None = None,
+        if_none_match: str | None = Header(None),
         app_context: AppContext = Depends(get_app_context),
-) -> FacilityResponse:
-    facility = await app_context.facility_service.get_by_id(id)
-    return FacilityResponse.from_service_model(facility)
+):
+    """
+    `fields` - поля ответа через запятую, например `?fields=name,x,y,type` (по умолчанию все).
+
+    ETag ответа - версия объекта, ее можно передать в `If-Match` при изменении и в `If-None-Match` при чтении.
+    """
+    fields_ = None if fields is None else [f.strip() for f in fields.split(',') if f.strip()]
+
+    async def run_get() -> (str, bytes):
+        # версия нужна для ETag, даже если ее нет в fields
+        facility = await app_context.facility_service.get_by_id(
+            id, as_dict=True, fields=None if fields_ is None else [*fields_, 'version']
+        )
+        etag = _etag(facility['version'])
+        if fields_ is not None and 'version' not in fields_:
+            del facility['version']
+        return etag, FacilityResponse.dump_json(facility)
+
+    key = ('facility', facility_data_version.value, id, None if fields_ is None else tuple(fields_))
+    etag, data = await app_context.single_flight.do(key, run_get)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=data, media_type='application/json', headers={"ETag": etag})
 
 
-@router.post('/search')
+@router.post('/search', response_model=FacilitySearchResponse)
 async def search_facility(
         body: FacilitySearchRequest,
         app_context: AppContext = Depends(get_app_context),
-) -> FacilitySearchResponse:
+):
+    cache_key = body.cache_key()
+    cached = app_context.search_cache.get(cache_key)
+    if cached is not None:
+        logger.debug("SEARCH: CACHE HIT")
+        return Response(content=cached, media_type='application/json')
+    version = facility_data_version.value
+
+    async def run_search() -> bytes:
+        filters = body.filters
+        if filters is not None:
+            filters_ = []
+            for f in filters:
+                filters_.append(f.model_dump())
+        else:
+            filters_ = None
+
+        count, facilities, cursor = await app_context.facility_service.search(
+            body.all,
+            body.q,
+            body.limit,
+            body.offset,
+            body.order_by,
+            body.order_desc,
+            body.hidden,
+            body.type,
+            body.owning_type,
+            body.covering_type,
+            body.paying_type,
+            body.age,
+            filters_,
+            body.x,
+            body.y,
+            cursor=body.cursor,
+            radius=body.radius,
+            nearest=body.nearest,
+            open_at=body.open_at_minute(),
+            as_dict=True,
+            fields=body.fields
+        )
+
+        logger.debug(f"SEARCH: {len(facilities)} FACILITIES")
+
+        data = FacilitySearchResponse.dump_json(count, facilities, cursor)
+        app_context.search_cache.set(cache_key, data, version)
+        return data
+
+    # одинаковые параллельные запросы ждут результат одного запроса в бд
+    data = await app_context.single_flight.do(('search', version, cache_key), run_search)
+    return Response(content=data, media_type='application/json')
+
+
+@router.post('/search/stream')
+async def stream_search_facility(
+        body: FacilitySearchRequest,
+        app_context: AppContext = Depends(get_app_context),
+) -> StreamingResponse:
+    """
+    Поиск с потоковой выдачей в формате NDJSON (`application/x-ndjson`): по одному объекту
+    в формате FacilityResponse в строке. Объекты читаются из бд частями и отправляются сразу,
+    общее количество и курсор следующей страницы не возвращаются.
+    """
     filters = body.filters
     if filters is not None:
         filters_ = []
@@ -96,7 +291,7 @@ async def search_facility(
     else:
         filters_ = None
 
-    count, facilities = await app_context.facility_service.search(
+    chunks = app_context.facility_service.search_stream(
         body.all,
         body.q,
         body.limit,
@@ -111,15 +306,76 @@ async def search_facility(
         body.age,
         filters_,
         body.x,
-        body.y
+        body.y,
+        cursor=body.cursor,
+        radius=body.radius,
+        nearest=body.nearest,
+        open_at=body.open_at_minute(),
+        fields=body.fields
+    )
+
+    async def lines():
+        async for chunk in chunks:
+            yield FacilitySearchResponse.dump_ndjson(chunk)
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@router.post('/facets')
+async def facet_facility(
+        body: FacilitySearchRequest,
+        app_context: AppContext = Depends(get_app_context),
+) -> FacilityFacetsResponse:
+    """
+    Количество объектов для каждого значения фильтров type, owning_type, covering_type, paying_type и age
+    с учетом остальных фильтров запроса. Пагинация и сортировка запроса не учитываются.
+    """
+    filters = body.filters
+    if filters is not None:
+        filters_ = []
+        for f in filters:
+            filters_.append(f.model_dump())
+    else:
+        filters_ = None
+
+    facets = await app_context.facility_service.facets(
+        body.q,
+        body.hidden,
+        body.type,
+        body.owning_type,
+        body.covering_type,
+        body.paying_type,
+        body.age,
+        filters_,
+        body.x,
+        body.y,
+        radius=body.radius,
+        open_at=body.open_at_minute()
+    )
+    return FacilityFacetsResponse(**facets)
+
+
+@router.post('/clusters')
+async def cluster_facility(
+        body: FacilityClusterRequest,
+        app_context: AppContext = Depends(get_app_context),
+) -> FacilityClusterResponse:
+    clusters = await app_context.facility_service.clusters(
+        body.x_min,
+        body.y_min,
+        body.x_max,
+        body.y_max,
+        body.zoom,
+        body.hidden,
+        body.type,
+        body.owning_type,
+        body.covering_type,
+        body.paying_type,
+        body.age
     )
-    facilities_resp = []
-    for f in facilities:
-        facilities_resp.append(FacilityResponse.from_service_model(f))
 
-    logger.debug(f"SEARCH: {len(facilities)} FACILITIES")
+    logger.debug(f"CLUSTERS: {len(clusters)} CLUSTERS FOR ZOOM {body.zoom}")
 
-    return FacilitySearchResponse(
-        count=count,
-        facilities=facilities_resp
+    return FacilityClusterResponse(
+        clusters=[FacilityCluster.model_validate(c) for c in clusters]
     )
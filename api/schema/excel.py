@@ -0,0 +1,25 @@
+import datetime
+import uuid
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ExcelImportJobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: uuid.UUID
+    # running, done, failed или cancelled
+    status: str
+    filename: str | None = None
+    size: int
+
+    # обработано строк файла, из них добавлено, уже было в бд и с ошибками
+    processed: int
+    inserted: int
+    duplicated: int
+    failed: int
+    # причина статуса failed
+    error: str | None = None
+
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
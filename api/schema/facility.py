@@ -1,9 +1,16 @@
+import datetime
 import uuid
+from zoneinfo import ZoneInfo
 
-from pydantic import BaseModel, ConfigDict, field_validator
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from service.model.facility_model import FacilityServiceModel
 
+# часовой пояс working_hours и фильтра open_now
+FACILITY_TIMEZONE = ZoneInfo('Europe/Moscow')
+WEEK_DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
 EMPTY_WORKING_HOURS = {
     "monday": {
         "open": False
@@ -29,6 +36,13 @@ EMPTY_WORKING_HOURS = {
 }
 
 
+def _json_default(obj):
+    # asyncpg возвращает собственный подкласс UUID, который orjson не сериализует сам
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError
+
+
 class FacilityWorkingHoursItem(BaseModel):
     open: bool
     all_day: bool | None = None
@@ -127,6 +141,31 @@ class FacilityPatchRequest(BaseModel):
         return v
 
 
+class FacilityBulkPatchRequest(FacilityPatchRequest):
+    id: uuid.UUID
+
+
+class FacilityBulkRequest(BaseModel):
+    # объекты для создания и изменения одной транзакцией
+    create: list[FacilityRequest] = Field([], max_length=1000)
+    update: list[FacilityBulkPatchRequest] = Field([], max_length=1000)
+
+
+class FacilityBulkItemResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    # created, updated или error
+    status: str
+    id: uuid.UUID | None = None
+    message: str | None = None
+
+
+class FacilityBulkResponse(BaseModel):
+    # результаты в порядке объектов запроса
+    create: list[FacilityBulkItemResponse]
+    update: list[FacilityBulkItemResponse]
+
+
 class FilterItem(BaseModel):
     field: str
     eq: str | int
@@ -134,6 +173,36 @@ class FilterItem(BaseModel):
     lt: float
 
 
+class FacilityOpenAt(BaseModel):
+    # день недели как в working_hours и время "HH:MM"
+    day: str
+    time: str
+
+    @field_validator('day')
+    @classmethod
+    def day_validator(cls, v: str) -> str:
+        v = v.lower()
+        if v not in WEEK_DAYS:
+            raise ValueError(f"day должен быть одним из: {', '.join(WEEK_DAYS)}")
+        return v
+
+    @field_validator('time')
+    @classmethod
+    def time_validator(cls, v: str) -> str:
+        datetime.time.fromisoformat(v)
+        return v
+
+    def minute_of_week(self) -> int:
+        """Минута недели от понедельника 00:00."""
+        t = datetime.time.fromisoformat(self.time)
+        return (WEEK_DAYS.index(self.day) * 24 + t.hour) * 60 + t.minute
+
+    @staticmethod
+    def now() -> 'FacilityOpenAt':
+        now = datetime.datetime.now(FACILITY_TIMEZONE)
+        return FacilityOpenAt(day=WEEK_DAYS[now.weekday()], time=now.strftime('%H:%M'))
+
+
 class FacilitySearchRequest(BaseModel):
     all: bool | None = None
 
@@ -143,9 +212,17 @@ class FacilitySearchRequest(BaseModel):
     q: str | None = None
     x: float | None = None
     y: float | None = None
+    # радиус поиска вокруг (x, y) в метрах
+    radius: float | None = Field(None, gt=0)
+    # количество ближайших к (x, y) объектов, сортирует по расстоянию
+    nearest: int | None = Field(None, gt=0, le=1000)
 
     limit: int | None = None
     offset: int | None = None
+    # курсор из предыдущего FacilitySearchResponse, при нем offset игнорируется
+    cursor: str | None = None
+    # поля FacilityResponse, которые нужно вернуть (по умолчанию все)
+    fields: list[str] | None = None
 
     hidden: bool | None = None
 
@@ -157,6 +234,34 @@ class FacilitySearchRequest(BaseModel):
     paying_type: list[str] | None = None
     age: list[str] | None = None
 
+    # объекты, работающие в заданное время (open_at) или сейчас (open_now, по московскому времени)
+    open_at: FacilityOpenAt | None = None
+    open_now: bool | None = None
+
+    def open_at_minute(self) -> int | None:
+        """Минута недели для фильтра по времени работы, open_at важнее open_now."""
+        if self.open_at is not None:
+            return self.open_at.minute_of_week()
+        if self.open_now:
+            return FacilityOpenAt.now().minute_of_week()
+        return None
+
+    def cache_key(self) -> str:
+        """
+        Ключ кеша поиска: одинаковые по смыслу запросы (с разным порядком значений в фильтрах) дают один ключ.
+        """
+        normalized = self.model_copy(update={
+            k: sorted(set(v))
+            for k in ('type', 'owning_type', 'covering_type', 'paying_type', 'age')
+            if (v := getattr(self, k)) is not None
+        })
+        if normalized.q is not None:
+            normalized.q = ' '.join(normalized.q.lower().split())
+        if normalized.open_now and normalized.open_at is None:
+            # результат open_now зависит от текущей минуты
+            normalized.open_at = FacilityOpenAt.now()
+        return normalized.model_dump_json()
+
 
 class FacilityPhoto(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -169,6 +274,8 @@ class FacilityResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     id: uuid.UUID
+    # версия объекта, она же ETag для условных изменений (If-Match)
+    version: int
 
     name: str
     owner: str
@@ -209,6 +316,14 @@ class FacilityResponse(BaseModel):
         FacilityWorkingHours.model_validate(v)
         return v
 
+    @staticmethod
+    def dump_json(facility: dict) -> bytes:
+        """
+        JSON объекта без построения и валидации модели, facility - словарь в формате FacilityResponse
+        (см. `FacilityService.get_by_id(as_dict=True)`).
+        """
+        return orjson.dumps(facility, default=_json_default)
+
     @staticmethod
     def from_service_model(f: FacilityServiceModel):
         facility = f.model_dump()
@@ -233,5 +348,79 @@ class FacilityResponse(BaseModel):
 
 
 class FacilitySearchResponse(BaseModel):
-    count: int
+    # при поиске по курсору общее количество не считается
+    count: int | None = None
     facilities: list[FacilityResponse]
+    # курсор следующей страницы, None если страница последняя
+    cursor: str | None = None
+
+    @staticmethod
+    def dump_json(count: int | None, facilities: list[dict], cursor: str | None) -> bytes:
+        """
+        JSON ответа без построения и валидации моделей, facilities - словари в формате FacilityResponse
+        (см. `FacilityService.search(as_dict=True)`).
+        """
+        return orjson.dumps({
+            'count': count,
+            'facilities': facilities,
+            'cursor': cursor,
+        }, default=_json_default)
+
+    @staticmethod
+    def dump_ndjson(facilities: list[dict]) -> bytes:
+        """
+        Объекты в формате NDJSON: по одному FacilityResponse в строке.
+        """
+        return b''.join(orjson.dumps(f, default=_json_default, option=orjson.OPT_APPEND_NEWLINE) for f in facilities)
+
+
+class FacilityFacetsResponse(BaseModel):
+    # значение фильтра -> количество объектов
+    type: dict[str, int]
+    owning_type: dict[str, int]
+    covering_type: dict[str, int]
+    paying_type: dict[str, int]
+    age: dict[str, int]
+
+
+class FacilityCacheMetricsResponse(BaseModel):
+    # метрики текущего воркера
+    data_version: int
+    search_cache_size: int
+    search_cache_hits: int
+    search_cache_misses: int
+    single_flight_calls: int
+    # запросы, дождавшиеся результата уже выполняющегося одинакового запроса
+    single_flight_coalesced: int
+    single_flight_in_flight: int
+
+
+class FacilityClusterRequest(BaseModel):
+    # видимая область карты: x - широта, y - долгота
+    x_min: float
+    y_min: float
+    x_max: float
+    y_max: float
+    zoom: int
+
+    hidden: bool | None = None
+
+    type: list[str] | None = None
+    owning_type: list[str] | None = None
+    covering_type: list[str] | None = None
+    paying_type: list[str] | None = None
+    age: list[str] | None = None
+
+
+class FacilityCluster(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    x: float
+    y: float
+    count: int
+    # id объекта, если объект в кластере один
+    id: uuid.UUID | None = None
+
+
+class FacilityClusterResponse(BaseModel):
+    clusters: list[FacilityCluster]
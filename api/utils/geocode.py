@@ -11,6 +11,7 @@ from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from db.model.facility import Facility
+from service.data_version import facility_data_version
 
 
 async def _get_coords_from_address(address: str, auth: str):
@@ -89,6 +90,7 @@ async def set_facility_coords(
         facility.x = -1
         facility.y = -1
         await session.commit()
+        await facility_data_version.bump(async_session)
 
         res = await _get_coords_from_address_retry(address, auth)
         if res is None:
@@ -106,6 +108,7 @@ async def set_facility_coords(
         facility.x = x
         facility.y = y
         await session.commit()
+        await facility_data_version.bump(async_session)
 
     return True
 
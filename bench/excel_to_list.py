@@ -0,0 +1,88 @@
+"""
+Сравнение чтения книги Excel в список объектов: pd.read_excel с построчным обходом через df.iloc
+(прежний путь) и построчное чтение `ExcelService.read_excel`.
+
+Запуск: python -m bench.excel_to_list [строк на листе] [листов] [повторы]
+Бд не нужна, книга .xlsx создается в памяти.
+"""
+import io
+import sys
+import timeit
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from service.excel_service import ExcelService
+
+
+def make_xls(rows: int, sheets: int) -> bytes:
+    rng = np.random.default_rng(0)
+    xls = {}
+    for s in range(sheets):
+        area = rng.uniform(10, 1000, rows).round(1)
+        eps = rng.integers(0, 500, rows).astype(float)
+        # часть ячеек пустая
+        eps[rng.random(rows) < 0.3] = np.nan
+        df = pd.DataFrame({
+            '№': np.arange(rows),
+            'Наименование': [f'Объект {i}' for i in range(rows)],
+            'Адрес': [f'ул. Спортивная, д. {i}' for i in range(rows)],
+            'Пользователь': 'ГБУ',
+            'Форма собственности': 'муниципальная',
+            'Площадь': area,
+            'ЕПС': eps,
+            'Покрытие': pd.Series('резина', index=range(rows)).where(rng.random(rows) < 0.5),
+            'Примечания': np.nan,
+            'Лишняя колонка': 1,
+        })
+        # первая строка - пояснения к колонкам
+        df.iloc[0] = ['п/п', 'название', 'адрес', '', '', 'м2', 'чел.', '', '', '']
+        xls[f'Тип {s}'] = df
+    content = io.BytesIO()
+    with pd.ExcelWriter(content) as writer:
+        for name, df in xls.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return content.getvalue()
+
+
+def pandas_path(content: bytes) -> list[dict]:
+    xls = pd.read_excel(io.BytesIO(content), sheet_name=None)
+    facilities = []
+    for f_type, df in xls.items():
+        df_fields = df.keys()
+        for i in range(1, len(df.values)):
+            obj = df.iloc[i]
+            obj_dict = {}
+            for j in range(0, len(df_fields)):
+                try:
+                    if str(obj.iloc[j]) == 'nan':
+                        continue
+                    obj_dict[ExcelService._db_fields[df_fields[j]]] = obj.iloc[j]
+                except KeyError:
+                    pass
+            obj_dict['type'] = f_type
+            facilities.append(obj_dict)
+    return facilities
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    sheets = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    warnings.simplefilter('ignore')
+    content = make_xls(rows, sheets)
+    excel_service = ExcelService(async_session=None)
+
+    def read_excel_path(content: bytes) -> list[dict]:
+        return [f for batch in excel_service.read_excel(content, ExcelService.READ_BATCH_SIZE) for f in batch]
+
+    assert pandas_path(content) == read_excel_path(content)
+
+    for name, path in (('pandas', pandas_path), ('read_excel', read_excel_path)):
+        best = min(timeit.repeat(lambda: path(content), number=1, repeat=repeat))
+        print(f'{name:>10}: {best * 1000:10.2f} ms / {sheets} x {rows} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Сравнение сериализации страницы поиска объектов:
+ORM -> FacilityServiceModel -> FacilityResponse -> JSON (прежний путь) и ORM -> dict -> orjson.
+
+Запуск: python -m bench.facility_serialization [количество объектов] [повторы]
+Бд не нужна, объекты создаются в памяти.
+"""
+import sys
+import timeit
+import uuid
+
+import orjson
+
+from api.schema.facility import FacilityResponse, FacilitySearchResponse, EMPTY_WORKING_HOURS
+from db.model.facility import Facility, FacilityType, FacilityOwningType, FacilityCoveringType, FacilityPayingType, \
+    FacilityAge, FacilityPhoto
+from service.facility_service import FacilityService
+from service.model.facility_model import FacilityServiceModel
+
+
+def make_facilities(n: int) -> list[Facility]:
+    type = FacilityType(name='спортивные залы')
+    owning_type = FacilityOwningType(name='муниципальная')
+    covering_type = FacilityCoveringType(name='спортивный паркет')
+    paying_type = [FacilityPayingType(name='бюджетные'), FacilityPayingType(name='платные')]
+    age = [FacilityAge(name='дети'), FacilityAge(name='взрослые')]
+    facilities = []
+    for i in range(n):
+        facilities.append(Facility(
+            id=uuid.uuid4(),
+            version=1,
+            name=f'Спортивный зал {i}',
+            owner='СПб ГБУ "Центр физической культуры"',
+            address=f'г. Санкт-Петербург, ул. Спортивная, д. {i}',
+            x=59.9 + i / 10000,
+            y=30.3 + i / 10000,
+            hidden=False,
+            length=40.,
+            width=20.,
+            height=8.,
+            area=800.,
+            eps=120,
+            actual_workload=100,
+            annual_capacity=36000,
+            accessibility=True,
+            site='https://example.com',
+            phone_number='+7 (812) 000-00-00',
+            document=str(i),
+            working_hours=EMPTY_WORKING_HOURS,
+            type=type,
+            type_name=type.name,
+            owning_type=owning_type,
+            owning_type_name=owning_type.name,
+            covering_type=covering_type,
+            covering_type_name=covering_type.name,
+            paying_type=paying_type,
+            paying_type_names=[pt.name for pt in paying_type],
+            age=age,
+            age_names=[a.name for a in age],
+            photo=[FacilityPhoto(id=uuid.uuid4(), url=f'https://example.com/{i}.png', filename=f'{i}.png')],
+        ))
+    return facilities
+
+
+def models_path(facilities: list[Facility]) -> bytes:
+    service_models = [FacilityServiceModel.model_validate(f) for f in facilities]
+    return FacilitySearchResponse(
+        count=len(service_models),
+        facilities=[FacilityResponse.from_service_model(f) for f in service_models],
+        cursor=None
+    ).model_dump_json().encode()
+
+
+def dict_path(facilities: list[Facility]) -> bytes:
+    return FacilitySearchResponse.dump_json(
+        len(facilities),
+        [FacilityService.facility_to_dict(f) for f in facilities],
+        None
+    )
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    facilities = make_facilities(n)
+
+    assert orjson.loads(models_path(facilities)) == orjson.loads(dict_path(facilities))
+
+    for name, path in (('models', models_path), ('dict + orjson', dict_path)):
+        best = min(timeit.repeat(lambda: path(facilities), number=1, repeat=repeat))
+        print(f'{name:>15}: {best * 1000:8.2f} ms / {n} facilities')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""add facility grid
+
+Revision ID: 5d90be37f1a8
+Revises: e2a7d5b9c310
+Create Date: 2026-10-18 13:41:22.918305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d90be37f1a8'
+down_revision = 'e2a7d5b9c310'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'facility',
+        sa.Column(
+            'grid_column', sa.Integer(),
+            sa.Computed(
+                'CASE WHEN y BETWEEN -180 AND 180 THEN floor((y + 180) / 360 * 16777216)::integer END',
+                persisted=True
+            ),
+            nullable=True
+        )
+    )
+    op.add_column(
+        'facility',
+        sa.Column(
+            'grid_row', sa.Integer(),
+            sa.Computed(
+                'CASE WHEN x BETWEEN -85 AND 85 '
+                'THEN floor((1 - ln(tan(radians(x)) + 1 / cos(radians(x))) / pi()) / 2 * 16777216)::integer END',
+                persisted=True
+            ),
+            nullable=True
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('facility', 'grid_row')
+    op.drop_column('facility', 'grid_column')
@@ -0,0 +1,42 @@
+"""add facility keyset indexes
+
+Revision ID: 7b1f3c9a2d45
+Revises: 3dab2c0c708b
+Create Date: 2026-10-18 10:12:31.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1f3c9a2d45'
+down_revision = '3dab2c0c708b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix__facility__created_at_id', 'facility', ['created_at', 'id'], unique=False)
+    op.create_index('ix__facility__type_name_id', 'facility', ['type_name', 'id'], unique=False)
+    op.create_index('ix__facility__area_id', 'facility', ['area', 'id'], unique=False)
+    op.create_index('ix__facility__name_id', 'facility', ['name', 'id'], unique=False)
+    op.create_index(
+        'ix__facility__actual_workload_id', 'facility',
+        [sa.text('(actual_workload IS NULL)'), 'actual_workload', 'id'], unique=False
+    )
+    op.create_index('ix__facility__eps_id', 'facility', [sa.text('(eps IS NULL)'), 'eps', 'id'], unique=False)
+    op.create_index(
+        'ix__facility__annual_capacity_id', 'facility',
+        [sa.text('(annual_capacity IS NULL)'), 'annual_capacity', 'id'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__annual_capacity_id', table_name='facility')
+    op.drop_index('ix__facility__eps_id', table_name='facility')
+    op.drop_index('ix__facility__actual_workload_id', table_name='facility')
+    op.drop_index('ix__facility__name_id', table_name='facility')
+    op.drop_index('ix__facility__area_id', table_name='facility')
+    op.drop_index('ix__facility__type_name_id', table_name='facility')
+    op.drop_index('ix__facility__created_at_id', table_name='facility')
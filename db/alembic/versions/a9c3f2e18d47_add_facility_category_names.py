@@ -0,0 +1,51 @@
+"""add facility category names
+
+Revision ID: a9c3f2e18d47
+Revises: 5d90be37f1a8
+Create Date: 2026-10-18 16:05:37.204911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c3f2e18d47'
+down_revision = '5d90be37f1a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'facility',
+        sa.Column('paying_type_names', postgresql.ARRAY(sa.String()), server_default='{}', nullable=False)
+    )
+    op.add_column(
+        'facility',
+        sa.Column('age_names', postgresql.ARRAY(sa.String()), server_default='{}', nullable=False)
+    )
+    op.execute(
+        'UPDATE facility SET paying_type_names = a.names '
+        'FROM (SELECT facility, array_agg(facility_paying_type) AS names '
+        'FROM facility_facility_paying_type_association_table GROUP BY facility) AS a '
+        'WHERE facility.id = a.facility'
+    )
+    op.execute(
+        'UPDATE facility SET age_names = a.names '
+        'FROM (SELECT facility, array_agg(facility_age) AS names '
+        'FROM facility_facility_age_association_table GROUP BY facility) AS a '
+        'WHERE facility.id = a.facility'
+    )
+    op.create_index(
+        'ix__facility__paying_type_names', 'facility', ['paying_type_names'], unique=False, postgresql_using='gin'
+    )
+    op.create_index('ix__facility__age_names', 'facility', ['age_names'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__age_names', table_name='facility', postgresql_using='gin')
+    op.drop_index('ix__facility__paying_type_names', table_name='facility', postgresql_using='gin')
+    op.drop_column('facility', 'age_names')
+    op.drop_column('facility', 'paying_type_names')
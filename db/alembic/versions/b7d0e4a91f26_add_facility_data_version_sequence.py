@@ -0,0 +1,24 @@
+"""add facility data version sequence
+
+Revision ID: b7d0e4a91f26
+Revises: e5a2c7f31b09
+Create Date: 2026-10-19 01:07:33.264718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d0e4a91f26'
+down_revision = 'e5a2c7f31b09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('facility_data_version')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('facility_data_version')))
@@ -0,0 +1,37 @@
+"""add facility search vector
+
+Revision ID: c4e8a1f06b72
+Revises: 7b1f3c9a2d45
+Create Date: 2026-10-18 11:03:54.106274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f06b72'
+down_revision = '7b1f3c9a2d45'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(type_name, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(address, '') || ' ' || coalesce(owner, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    op.add_column(
+        'facility',
+        sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True)
+    )
+    op.create_index('ix__facility__search_vector', 'facility', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__search_vector', table_name='facility', postgresql_using='gin')
+    op.drop_column('facility', 'search_vector')
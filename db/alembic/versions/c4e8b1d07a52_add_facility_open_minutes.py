@@ -0,0 +1,86 @@
+"""add facility open minutes
+
+Revision ID: c4e8b1d07a52
+Revises: a9c3f2e18d47
+Create Date: 2026-10-18 17:12:48.530162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import Range
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8b1d07a52'
+down_revision = 'a9c3f2e18d47'
+branch_labels = None
+depends_on = None
+
+# Копия db.model.facility.working_hours_to_week_minutes на момент миграции:
+# миграция не должна меняться вместе с моделью.
+WEEK_DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = len(WEEK_DAYS) * MINUTES_PER_DAY
+
+
+def _day_minutes(t):
+    try:
+        hours, minutes = (int(v) for v in t.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    if not (0 <= hours and 0 <= minutes < 60 and hours * 60 + minutes <= MINUTES_PER_DAY):
+        return None
+    return hours * 60 + minutes
+
+
+def working_hours_to_week_minutes(working_hours):
+    if working_hours is None:
+        return None
+    ranges = []
+    for i, day in enumerate(WEEK_DAYS):
+        item = working_hours.get(day)
+        if not item or not item.get('open'):
+            continue
+        start = i * MINUTES_PER_DAY
+        if item.get('all_day'):
+            since, to = 0, MINUTES_PER_DAY
+        else:
+            since, to = _day_minutes(item.get('since')), _day_minutes(item.get('to'))
+            if since is None or to is None:
+                continue
+            if to <= since:
+                to += MINUTES_PER_DAY
+        lower, upper = start + since, start + to
+        if upper > MINUTES_PER_WEEK:
+            ranges.append(Range(0, upper - MINUTES_PER_WEEK))
+            upper = MINUTES_PER_WEEK
+        ranges.append(Range(lower, upper))
+    return sorted(ranges, key=lambda r: r.lower)
+
+
+def upgrade() -> None:
+    op.add_column('facility', sa.Column('open_minutes', postgresql.INT4MULTIRANGE(), nullable=True))
+
+    facility = sa.table(
+        'facility',
+        sa.column('id', sa.Uuid()),
+        sa.column('working_hours', sa.JSON()),
+        sa.column('open_minutes', postgresql.INT4MULTIRANGE()),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(facility.c.id, facility.c.working_hours).where(facility.c.working_hours.is_not(None))
+    ).all()
+    if rows:
+        connection.execute(
+            facility.update().where(facility.c.id == sa.bindparam('facility_id')),
+            [{'facility_id': id, 'open_minutes': working_hours_to_week_minutes(wh)} for id, wh in rows]
+        )
+
+    op.create_index('ix__facility__open_minutes', 'facility', ['open_minutes'], unique=False, postgresql_using='gist')
+
+
+def downgrade() -> None:
+    op.drop_index('ix__facility__open_minutes', table_name='facility', postgresql_using='gist')
+    op.drop_column('facility', 'open_minutes')
@@ -0,0 +1,38 @@
+"""add excel import job
+
+Revision ID: d81e4c7a9b36
+Revises: f3b9d6a2c815
+Create Date: 2026-10-18 21:12:47.305861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81e4c7a9b36'
+down_revision = 'f3b9d6a2c815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('excel_import_job',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('content', sa.LargeBinary(), nullable=True),
+    sa.Column('processed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('inserted', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('duplicated', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__excel_import_job'))
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('excel_import_job')
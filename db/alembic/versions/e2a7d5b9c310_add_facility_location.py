@@ -0,0 +1,40 @@
+"""add facility location
+
+Revision ID: e2a7d5b9c310
+Revises: c4e8a1f06b72
+Create Date: 2026-10-18 12:20:07.731540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7d5b9c310'
+down_revision = 'c4e8a1f06b72'
+branch_labels = None
+depends_on = None
+
+
+class Point(sa.types.UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return 'POINT'
+
+
+def upgrade() -> None:
+    op.add_column(
+        'facility',
+        sa.Column('location', Point(), sa.Computed('point(y * 55761, x * 111320)', persisted=True), nullable=True)
+    )
+    op.create_index('ix__facility__location', 'facility', ['location'], unique=False, postgresql_using='gist')
+    op.drop_index('ix__facility__y', table_name='facility', postgresql_using='btree')
+    op.drop_index('ix__facility__x', table_name='facility', postgresql_using='btree')
+
+
+def downgrade() -> None:
+    op.create_index('ix__facility__x', 'facility', ['x'], unique=False, postgresql_using='btree')
+    op.create_index('ix__facility__y', 'facility', ['y'], unique=False, postgresql_using='btree')
+    op.drop_index('ix__facility__location', table_name='facility', postgresql_using='gist')
+    op.drop_column('facility', 'location')
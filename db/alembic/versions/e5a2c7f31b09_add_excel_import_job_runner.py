@@ -0,0 +1,28 @@
+"""add excel import job runner
+
+Revision ID: e5a2c7f31b09
+Revises: d81e4c7a9b36
+Create Date: 2026-10-18 23:41:05.918243
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a2c7f31b09'
+down_revision = 'd81e4c7a9b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('excel_import_job', sa.Column('runner', sa.UUID(), nullable=True))
+    op.add_column('excel_import_job', sa.Column(
+        'heartbeat_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True
+    ))
+
+
+def downgrade() -> None:
+    op.drop_column('excel_import_job', 'heartbeat_at')
+    op.drop_column('excel_import_job', 'runner')
@@ -0,0 +1,37 @@
+"""add facility version
+
+Revision ID: f3b9d6a2c815
+Revises: c4e8b1d07a52
+Create Date: 2026-10-18 18:03:21.774519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9d6a2c815'
+down_revision = 'c4e8b1d07a52'
+branch_labels = None
+depends_on = None
+
+# внешние ключи связей на facility: таблица -> название
+FACILITY_ASSOCIATION_FKS = {
+    'facility_facility_paying_type_association_table': 'fk__facility_facility_paying_type_association_table__fa_39ef',
+    'facility_facility_age_association_table': 'fk__facility_facility_age_association_table__facility__facility',
+    'facility_facility_photo_association_table': 'fk__facility_facility_photo_association_table__facility_7268',
+}
+
+
+def upgrade() -> None:
+    op.add_column('facility', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    for table, fk in FACILITY_ASSOCIATION_FKS.items():
+        op.drop_constraint(fk, table, type_='foreignkey')
+        op.create_foreign_key(fk, table, 'facility', ['facility'], ['id'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    for table, fk in FACILITY_ASSOCIATION_FKS.items():
+        op.drop_constraint(fk, table, type_='foreignkey')
+        op.create_foreign_key(fk, table, 'facility', ['facility'], ['id'])
+    op.drop_column('facility', 'version')
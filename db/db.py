@@ -98,30 +98,15 @@ class DB:
         ]
         async with self.async_session() as session:
             try:
-                from db.model.facility import FacilityType
-                for f in facility_types:
-                    f = f.lower()
-                    await FacilityType.get_or_create(session, f)
-
-                from db.model.facility import FacilityOwningType
-                for f in facility_owning_types:
-                    f = f.lower()
-                    await FacilityOwningType.get_or_create(session, f)
-
-                from db.model.facility import FacilityCoveringType
-                for f in facility_covering_types:
-                    f = f.lower()
-                    await FacilityCoveringType.get_or_create(session, f)
-
-                from db.model.facility import FacilityPayingType
-                for f in facility_paying_types:
-                    f = f.lower()
-                    await FacilityPayingType.get_or_create(session, f)
-
-                from db.model.facility import FacilityAge
-                for f in facility_ages:
-                    f = f.lower()
-                    await FacilityAge.get_or_create(session, f)
+                from db.model.facility import FacilityType, FacilityOwningType, FacilityCoveringType, \
+                    FacilityPayingType, FacilityAge, facility_categories
+                await facility_categories.resolve(session, {
+                    FacilityType: [f.lower() for f in facility_types],
+                    FacilityOwningType: [f.lower() for f in facility_owning_types],
+                    FacilityCoveringType: [f.lower() for f in facility_covering_types],
+                    FacilityPayingType: [f.lower() for f in facility_paying_types],
+                    FacilityAge: [f.lower() for f in facility_ages],
+                })
 
                 await session.commit()
             except Exception as err:
@@ -132,3 +117,9 @@ class DB:
         async with self.engine.begin() as conn:
             await conn.run_sync(metadata.drop_all)
             await conn.run_sync(metadata.create_all)
+        # типы объектов удалены вместе с таблицами
+        from db.model.facility import facility_categories
+        facility_categories.clear()
+        # последовательность версии данных тоже создана заново
+        from service.data_version import facility_data_version
+        facility_data_version.value = 0
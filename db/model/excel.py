@@ -0,0 +1,38 @@
+import datetime
+import uuid
+
+from db.schema import Base
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.sql import func
+
+
+class ExcelImportJob(Base):
+    """
+    Импорт Excel файла в фоне. Файл хранится до завершения импорта, чтобы прерванный или отмененный
+    импорт можно было продолжить с processed - количества уже обработанных строк файла.
+    """
+    __tablename__ = 'excel_import_job'
+
+    id: so.Mapped[uuid.UUID] = so.mapped_column(sa.UUID(), primary_key=True, default=uuid.uuid4, nullable=False)
+    # running, done, failed или cancelled
+    status: so.Mapped[str] = so.mapped_column(sa.String(), nullable=False)
+    filename: so.Mapped[str] = so.mapped_column(sa.String(), nullable=True)
+    size: so.Mapped[int] = so.mapped_column(sa.Integer(), nullable=False)
+    content: so.Mapped[bytes] = so.mapped_column(sa.LargeBinary(), nullable=True, deferred=True)
+
+    processed: so.Mapped[int] = so.mapped_column(sa.Integer(), nullable=False, server_default='0')
+    inserted: so.Mapped[int] = so.mapped_column(sa.Integer(), nullable=False, server_default='0')
+    duplicated: so.Mapped[int] = so.mapped_column(sa.Integer(), nullable=False, server_default='0')
+    failed: so.Mapped[int] = so.mapped_column(sa.Integer(), nullable=False, server_default='0')
+    error: so.Mapped[str] = so.mapped_column(sa.String(), nullable=True)
+
+    # кто выполняет импорт: записывать пачки и обновлять heartbeat_at может только он
+    runner: so.Mapped[uuid.UUID] = so.mapped_column(sa.UUID(), nullable=True)
+    # обновляется выполняющим импорт в фоне, по нему определяется, что импорт прервался вместе с процессом
+    heartbeat_at: so.Mapped[datetime.datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), server_default=func.now()
+    )
+
+    created_at: so.Mapped[datetime.datetime] = so.mapped_column(sa.DateTime(timezone=True), server_default=func.now())
+    updated_at: so.Mapped[datetime.datetime] = so.mapped_column(sa.DateTime(timezone=True), server_default=func.now())
@@ -1,33 +1,134 @@
 import datetime
+import functools
+import math
+import time
 import uuid
+from typing import Iterable
 from loguru import logger
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.exc import DataError
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
 
 from db.schema import Base
 import sqlalchemy as sa
 import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import Range
 from sqlalchemy.sql import func
 
+# конфигурация полнотекстового поиска (русский стемминг)
+FACILITY_SEARCH_CONFIG = 'russian'
+
+# поисковый вектор объекта: название важнее типа, тип важнее адреса и пользователя
+FACILITY_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{FACILITY_SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+    f"setweight(to_tsvector('{FACILITY_SEARCH_CONFIG}', coalesce(type_name, '')), 'B') || "
+    f"setweight(to_tsvector('{FACILITY_SEARCH_CONFIG}', coalesce(address, '') || ' ' || coalesce(owner, '')), 'C')"
+)
+
+# x - широта, y - долгота. Для гео-поиска координаты проецируются в метры равнопромежуточной
+# проекцией относительно широты Санкт-Петербурга, поэтому расстояния в индексе считаются в метрах.
+FACILITY_REFERENCE_LATITUDE = 59.94
+FACILITY_METRES_PER_DEGREE_LAT = 111_320
+FACILITY_METRES_PER_DEGREE_LON = round(111_320 * math.cos(math.radians(FACILITY_REFERENCE_LATITUDE)))
+FACILITY_LOCATION = f"point(y * {FACILITY_METRES_PER_DEGREE_LON}, x * {FACILITY_METRES_PER_DEGREE_LAT})"
+
+# Сетка для кластеризации маркеров: номера тайлов web mercator на самом мелком уровне.
+# Ячейка уровня L < FACILITY_GRID_MAX_LEVEL получается сдвигом номера на (FACILITY_GRID_MAX_LEVEL - L) бит.
+FACILITY_GRID_MAX_LEVEL = 24
+FACILITY_GRID_COLUMN = (
+    f"CASE WHEN y BETWEEN -180 AND 180 "
+    f"THEN floor((y + 180) / 360 * {2 ** FACILITY_GRID_MAX_LEVEL})::integer END"
+)
+FACILITY_GRID_ROW = (
+    f"CASE WHEN x BETWEEN -85 AND 85 "
+    f"THEN floor((1 - ln(tan(radians(x)) + 1 / cos(radians(x))) / pi()) / 2 * {2 ** FACILITY_GRID_MAX_LEVEL})"
+    f"::integer END"
+)
+
+# версия данных об объектах, общая для всех воркеров (см. service.data_version)
+facility_data_version_sequence = sa.Sequence('facility_data_version', metadata=Base.metadata)
+
+# уникальный ключ объекта: (name, address, owner, area, type_name)
+FACILITY_UNIQUE_CONSTRAINT = 'uq__facility__name_address_owner_area_type_name'
+
+# paying_type и age импортированных объектов, для которых они не указаны
+FACILITY_DEFAULT_PAYING_TYPE = ('бюджетные',)
+FACILITY_DEFAULT_AGE = ("взрослые", "дети", "молодёжь", "пенсионеры")
+
+# Часы работы для фильтра по времени хранятся интервалами минут от начала недели (понедельник 00:00).
+FACILITY_WEEK_DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+FACILITY_MINUTES_PER_DAY = 24 * 60
+FACILITY_MINUTES_PER_WEEK = len(FACILITY_WEEK_DAYS) * FACILITY_MINUTES_PER_DAY
+
+
+def _day_minutes(t: str | None) -> int | None:
+    # "HH:MM" -> минуты от начала дня, "24:00" - конец дня
+    try:
+        hours, minutes = (int(v) for v in t.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    if not (0 <= hours and 0 <= minutes < 60 and hours * 60 + minutes <= FACILITY_MINUTES_PER_DAY):
+        return None
+    return hours * 60 + minutes
+
+
+def working_hours_to_week_minutes(working_hours: dict | None) -> list[Range] | None:
+    """
+    Часы работы (в формате FacilityWorkingHours) в виде интервалов [начало, конец) в минутах от начала недели.
+    Если время закрытия не больше времени открытия, объект работает после полуночи, ночь с воскресенья
+    переносится на понедельник. Дни без корректного времени работы пропускаются.
+    """
+    if working_hours is None:
+        return None
+    ranges = []
+    for i, day in enumerate(FACILITY_WEEK_DAYS):
+        item = working_hours.get(day)
+        if not item or not item.get('open'):
+            continue
+        start = i * FACILITY_MINUTES_PER_DAY
+        if item.get('all_day'):
+            since, to = 0, FACILITY_MINUTES_PER_DAY
+        else:
+            since, to = _day_minutes(item.get('since')), _day_minutes(item.get('to'))
+            if since is None or to is None:
+                continue
+            if to <= since:
+                to += FACILITY_MINUTES_PER_DAY
+        lower, upper = start + since, start + to
+        if upper > FACILITY_MINUTES_PER_WEEK:
+            ranges.append(Range(0, upper - FACILITY_MINUTES_PER_WEEK))
+            upper = FACILITY_MINUTES_PER_WEEK
+        ranges.append(Range(lower, upper))
+    return sorted(ranges, key=lambda r: r.lower)
+
+
+class Point(sa.types.UserDefinedType):
+    """Встроенный в postgres тип `point`."""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return 'POINT'
+
+
 facility_facility_paying_type_association_table = sa.Table(
     "facility_facility_paying_type_association_table",
     Base.metadata,
-    sa.Column("facility", sa.ForeignKey("facility.id")),
+    sa.Column("facility", sa.ForeignKey("facility.id", ondelete="CASCADE")),
     sa.Column("facility_paying_type", sa.ForeignKey("facility_paying_type.name")),
 )
 
 facility_facility_age_association_table = sa.Table(
     "facility_facility_age_association_table",
     Base.metadata,
-    sa.Column("facility", sa.ForeignKey("facility.id")),
+    sa.Column("facility", sa.ForeignKey("facility.id", ondelete="CASCADE")),
     sa.Column("facility_age", sa.ForeignKey("facility_age.name")),
 )
 
 facility_facility_photo_association_table = sa.Table(
     "facility_facility_photo_association_table",
     Base.metadata,
-    sa.Column("facility", sa.ForeignKey("facility.id")),
+    sa.Column("facility", sa.ForeignKey("facility.id", ondelete="CASCADE")),
     sa.Column("facility_photo", sa.ForeignKey("facility_photo.id")),
 )
 
@@ -38,7 +139,7 @@ class FacilityPayingType(Base):
     facilities = so.relationship(
         "Facility",
         secondary=facility_facility_paying_type_association_table,
-        back_populates='paying_type', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -47,32 +148,6 @@ class FacilityPayingType(Base):
     def __repr__(self):
         return self.name
 
-    @staticmethod
-    async def get(session: AsyncSession, name: str):
-        facility_paying_type = (
-            await session.execute(
-                sa.select(FacilityPayingType)
-                .where(FacilityPayingType.name == name)
-            )
-        ).scalars().first()
-        return facility_paying_type
-
-    @staticmethod
-    async def create(session: AsyncSession, name: str):
-        facility_paying_type = FacilityPayingType(name=name)
-        session.add(facility_paying_type)
-        await session.flush()
-        return facility_paying_type
-
-    @staticmethod
-    async def get_or_create(session: AsyncSession, name: str):
-        facility_paying_type = await FacilityPayingType.get(session, name)
-        if facility_paying_type is not None:
-            return facility_paying_type
-        else:
-            facility_paying_type = await FacilityPayingType.create(session, name)
-            return facility_paying_type
-
 
 class FacilityAge(Base):
     __tablename__ = 'facility_age'
@@ -80,7 +155,7 @@ class FacilityAge(Base):
     facilities = so.relationship(
         "Facility",
         secondary=facility_facility_age_association_table,
-        back_populates='age', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -89,39 +164,13 @@ class FacilityAge(Base):
     def __repr__(self):
         return self.name
 
-    @staticmethod
-    async def get(session: AsyncSession, name: str):
-        facility_age = (
-            await session.execute(
-                sa.select(FacilityAge)
-                .where(FacilityAge.name == name)
-            )
-        ).scalars().first()
-        return facility_age
-
-    @staticmethod
-    async def create(session: AsyncSession, name: str):
-        facility_age = FacilityAge(name=name)
-        session.add(facility_age)
-        await session.flush()
-        return facility_age
-
-    @staticmethod
-    async def get_or_create(session: AsyncSession, name: str):
-        facility_age = await FacilityAge.get(session, name)
-        if facility_age is not None:
-            return facility_age
-        else:
-            facility_age = await FacilityAge.create(session, name)
-            return facility_age
-
 
 class FacilityType(Base):
     __tablename__ = 'facility_type'
     name: so.Mapped[str] = so.mapped_column(sa.String, primary_key=True, nullable=False)
     facilities = so.relationship(
         "Facility",
-        back_populates='type', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -130,39 +179,13 @@ class FacilityType(Base):
     def __repr__(self):
         return self.name
 
-    @staticmethod
-    async def get(session: AsyncSession, name: str):
-        obj = (
-            await session.execute(
-                sa.select(FacilityType)
-                .where(FacilityType.name == name)
-            )
-        ).scalars().first()
-        return obj
-
-    @staticmethod
-    async def create(session: AsyncSession, name: str):
-        obj = FacilityType(name=name)
-        session.add(obj)
-        await session.flush()
-        return obj
-
-    @staticmethod
-    async def get_or_create(session: AsyncSession, name: str):
-        obj = await FacilityType.get(session, name)
-        if obj is not None:
-            return obj
-        else:
-            obj = await FacilityType.create(session, name)
-            return obj
-
 
 class FacilityOwningType(Base):
     __tablename__ = 'facility_owning_type'
     name: so.Mapped[str] = so.mapped_column(sa.String, primary_key=True, nullable=False)
     facilities = so.relationship(
         "Facility",
-        back_populates='owning_type', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -171,39 +194,13 @@ class FacilityOwningType(Base):
     def __repr__(self):
         return self.name
 
-    @staticmethod
-    async def get(session: AsyncSession, name: str):
-        obj = (
-            await session.execute(
-                sa.select(FacilityOwningType)
-                .where(FacilityOwningType.name == name)
-            )
-        ).scalars().first()
-        return obj
-
-    @staticmethod
-    async def create(session: AsyncSession, name: str):
-        obj = FacilityOwningType(name=name)
-        session.add(obj)
-        await session.flush()
-        return obj
-
-    @staticmethod
-    async def get_or_create(session: AsyncSession, name: str):
-        obj = await FacilityOwningType.get(session, name)
-        if obj is not None:
-            return obj
-        else:
-            obj = await FacilityOwningType.create(session, name)
-            return obj
-
 
 class FacilityCoveringType(Base):
     __tablename__ = 'facility_covering_type'
     name: so.Mapped[str] = so.mapped_column(sa.String, primary_key=True, nullable=False)
     facilities = so.relationship(
         "Facility",
-        back_populates='covering_type', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -212,32 +209,6 @@ class FacilityCoveringType(Base):
     def __repr__(self):
         return self.name
 
-    @staticmethod
-    async def get(session: AsyncSession, name: str):
-        obj = (
-            await session.execute(
-                sa.select(FacilityCoveringType)
-                .where(FacilityCoveringType.name == name)
-            )
-        ).scalars().first()
-        return obj
-
-    @staticmethod
-    async def create(session: AsyncSession, name: str):
-        obj = FacilityCoveringType(name=name)
-        session.add(obj)
-        await session.flush()
-        return obj
-
-    @staticmethod
-    async def get_or_create(session: AsyncSession, name: str):
-        obj = await FacilityCoveringType.get(session, name)
-        if obj is not None:
-            return obj
-        else:
-            obj = await FacilityCoveringType.create(session, name)
-            return obj
-
 
 class FacilityPhoto(Base):
     __tablename__ = 'facility_photo'
@@ -247,7 +218,7 @@ class FacilityPhoto(Base):
     facilities = so.relationship(
         "Facility",
         secondary=facility_facility_photo_association_table,
-        back_populates='photo', lazy='selectin'
+        viewonly=True, lazy='raise'
     )
 
     def __str__(self):
@@ -297,6 +268,120 @@ class FacilityPhoto(Base):
             return obj
 
 
+FacilityCategory = FacilityType | FacilityOwningType | FacilityCoveringType | FacilityPayingType | FacilityAge
+
+
+class FacilityCategoryResolver:
+    """
+    Находит или создает типы объектов (FacilityType, FacilityOwningType, FacilityCoveringType,
+    FacilityPayingType, FacilityAge) для одной записи одним запросом:
+    недостающие названия вставляются через INSERT ... ON CONFLICT DO NOTHING во все таблицы сразу,
+    поэтому параллельная вставка того же названия другим воркером не приводит к IntegrityError.
+
+    Названия, которые точно есть в бд, кешируются в воркере (после commit транзакции, в которой они были созданы),
+    для них запросов не делается совсем. Кеш сбрасывается при изменении типов через админку и по истечении TTL.
+    Если тип удалили через другой воркер, запись с ним нарушает внешний ключ: такие записи повторяются
+    со сброшенным кешем (см. `retry_missing`).
+    """
+    CATEGORIES = (FacilityType, FacilityOwningType, FacilityCoveringType, FacilityPayingType, FacilityAge)
+    TTL = 300
+    FOREIGN_KEY_VIOLATION = '23503'
+
+    def __init__(self):
+        self._known: dict[type, set[str]] = {cls: set() for cls in self.CATEGORIES}
+        self._expires_at = 0.
+
+    def clear(self):
+        for names in self._known.values():
+            names.clear()
+
+    def is_missing(self, err: DBAPIError) -> bool:
+        """Запись нарушила внешний ключ: тип, который считался известным, в бд уже удален."""
+        return getattr(err.orig, 'sqlstate', None) == self.FOREIGN_KEY_VIOLATION
+
+    def retry_missing(self, write):
+        """
+        Декоратор записи в собственной сессии: если запись нарушила внешний ключ, кеш сбрасывается
+        и запись повторяется один раз, недостающие типы при этом создаются заново.
+        """
+        @functools.wraps(write)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await write(*args, **kwargs)
+            except IntegrityError as err:
+                if not self.is_missing(err):
+                    raise
+                logger.info(f'FACILITY CATEGORY MISSING, RETRYING: {err.orig}')
+                self.clear()
+                return await write(*args, **kwargs)
+        return wrapper
+
+    def _known_names(self, cls: type) -> set[str]:
+        if self._expires_at < time.monotonic():
+            self.clear()
+            self._expires_at = time.monotonic() + self.TTL
+        return self._known[cls]
+
+    @staticmethod
+    def _pending(session: so.Session) -> dict[type, set[str]]:
+        # созданные в текущей транзакции названия, попадают в кеш только после commit
+        return session.info.setdefault('facility_categories_pending', {})
+
+    def _commit(self, session: so.Session):
+        for cls, names in session.info.pop('facility_categories_pending', {}).items():
+            self._known[cls].update(names)
+
+    async def resolve(
+            self, session: AsyncSession, names: dict[type, Iterable[str]]
+    ) -> dict[type, dict[str, FacilityCategory]]:
+        """
+        :param names: класс типа -> названия
+        :return: класс типа -> название -> объект в сессии
+        """
+        names = {cls: set(ns) for cls, ns in names.items()}
+        pending = self._pending(session.sync_session)
+
+        stmt = sa.select(sa.literal(1))
+        missing = False
+        for cls, ns in names.items():
+            unknown = ns - self._known_names(cls) - pending.get(cls, set())
+            if not unknown:
+                continue
+            missing = True
+            insert = postgresql.insert(cls).from_select(
+                ['name'], sa.select(sa.func.unnest(sa.literal(sorted(unknown), postgresql.ARRAY(sa.String))))
+            ).on_conflict_do_nothing()
+            stmt = stmt.add_cte(insert.cte(f'insert_{cls.__tablename__}'))
+            pending.setdefault(cls, set()).update(unknown)
+        if missing:
+            await session.execute(stmt)
+
+        resolved = {}
+        for cls, ns in names.items():
+            resolved[cls] = {}
+            for n in ns:
+                # объект уже есть в бд, поэтому он добавляется в сессию без SELECT
+                obj = cls(name=n)
+                so.make_transient_to_detached(obj)
+                resolved[cls][n] = await session.merge(obj, load=False)
+        return resolved
+
+
+# типы объектов, известные текущему воркеру
+facility_categories = FacilityCategoryResolver()
+
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _facility_categories_after_commit(session: so.Session):
+    facility_categories._commit(session)
+
+
+@sa.event.listens_for(so.Session, 'after_soft_rollback')
+def _facility_categories_after_rollback(session: so.Session, previous_transaction: so.SessionTransaction):
+    # созданные названия могли откатиться, при следующем обращении они будут вставлены снова
+    session.info.pop('facility_categories_pending', None)
+
+
 class Facility(Base):
     __tablename__ = 'facility'
 
@@ -329,29 +414,57 @@ class Facility(Base):
     working_hours: so.Mapped[dict] = so.mapped_column(sa.JSON, nullable=True)
 
     type_name = so.mapped_column(sa.ForeignKey('facility_type.name'), nullable=False)
-    type: so.Mapped[FacilityType] = so.relationship(back_populates='facilities', lazy='selectin')
+    type: so.Mapped[FacilityType] = so.relationship(lazy='raise')
     owning_type_name = so.mapped_column(sa.ForeignKey("facility_owning_type.name"), nullable=True)
-    owning_type: so.Mapped[FacilityOwningType] = so.relationship(back_populates='facilities', lazy='selectin')
+    owning_type: so.Mapped[FacilityOwningType] = so.relationship(lazy='raise')
     covering_type_name = so.mapped_column(sa.ForeignKey("facility_covering_type.name"), nullable=True)
-    covering_type: so.Mapped[FacilityCoveringType] = so.relationship(back_populates='facilities', lazy='selectin')
+    covering_type: so.Mapped[FacilityCoveringType] = so.relationship(lazy='raise')
     paying_type: so.Mapped[list[FacilityPayingType]] = so.relationship(
         "FacilityPayingType",
         secondary=facility_facility_paying_type_association_table,
-        back_populates='facilities', lazy='selectin'
+        lazy='raise'
     )
     age: so.Mapped[list[FacilityAge]] = so.relationship(
         "FacilityAge",
         secondary=facility_facility_age_association_table,
-        back_populates='facilities', lazy='selectin'
+        lazy='raise'
     )
     photo: so.Mapped[list[FacilityPhoto]] = so.relationship(
         "FacilityPhoto",
         secondary=facility_facility_photo_association_table,
-        back_populates='facilities', lazy='selectin'
+        lazy='raise'
+    )
+
+    # копии названий paying_type и age для фильтров по gin индексу,
+    # заполняются при flush из связей (см. _facility_sync_derived_columns)
+    paying_type_names: so.Mapped[list[str]] = so.mapped_column(
+        postgresql.ARRAY(sa.String), nullable=False, default=list, server_default='{}'
+    )
+    age_names: so.Mapped[list[str]] = so.mapped_column(
+        postgresql.ARRAY(sa.String), nullable=False, default=list, server_default='{}'
     )
 
+    # часы работы в минутах от начала недели (см. working_hours_to_week_minutes) для фильтра по времени работы,
+    # заполняются при flush из working_hours, в ORM не загружаются
+    open_minutes = so.mapped_column(postgresql.INT4MULTIRANGE, nullable=True, deferred=True)
+
     created_at: so.Mapped[datetime.datetime] = so.mapped_column(sa.DateTime(timezone=True), server_default=func.now())
 
+    # версия для оптимистичной блокировки (ETag): ORM увеличивает ее при каждом изменении объекта
+    # и не записывает изменения поверх чужих, запросы UPDATE без ORM увеличивают ее сами
+    version: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+
+    # генерируется postgres-ом при каждой записи, в ORM не загружается
+    search_vector = so.mapped_column(
+        postgresql.TSVECTOR, sa.Computed(FACILITY_SEARCH_VECTOR, persisted=True), deferred=True
+    )
+    # координаты в метрах (см. FACILITY_LOCATION), генерируются postgres-ом, в ORM не загружаются
+    location = so.mapped_column(Point, sa.Computed(FACILITY_LOCATION, persisted=True), deferred=True)
+    # ячейка сетки кластеризации (см. FACILITY_GRID_MAX_LEVEL), генерируется postgres-ом, в ORM не загружается
+    grid_column = so.mapped_column(sa.Integer, sa.Computed(FACILITY_GRID_COLUMN, persisted=True), deferred=True)
+    grid_row = so.mapped_column(sa.Integer, sa.Computed(FACILITY_GRID_ROW, persisted=True), deferred=True)
+
     sa.UniqueConstraint(
         name,
         address,
@@ -364,134 +477,39 @@ class Facility(Base):
     ix_name = sa.Index('ix__facility__name', name, postgresql_using='hash')
     ix_owner = sa.Index('ix__facility__owner', owner, postgresql_using='hash')
     ix_address = sa.Index('ix__facility__address', address, postgresql_using='hash')
-    ix_x = sa.Index('ix__facility__x', x, postgresql_using='btree')
-    ix_y = sa.Index('ix__facility__y', y, postgresql_using='btree')
+    ix_location = sa.Index('ix__facility__location', location, postgresql_using='gist')
+    ix_search_vector = sa.Index('ix__facility__search_vector', search_vector, postgresql_using='gin')
+    ix_paying_type_names = sa.Index('ix__facility__paying_type_names', paying_type_names, postgresql_using='gin')
+    ix_age_names = sa.Index('ix__facility__age_names', age_names, postgresql_using='gin')
+    ix_open_minutes = sa.Index('ix__facility__open_minutes', open_minutes, postgresql_using='gist')
+
+    # индексы для keyset-пагинации поиска: (поле сортировки, id),
+    # для nullable полей первым ключом идет (поле IS NULL)
+    ix_created_at_id = sa.Index('ix__facility__created_at_id', created_at, id)
+    ix_type_name_id = sa.Index('ix__facility__type_name_id', type_name, id)
+    ix_area_id = sa.Index('ix__facility__area_id', area, id)
+    ix_name_id = sa.Index('ix__facility__name_id', name, id)
+    ix_actual_workload_id = sa.Index(
+        'ix__facility__actual_workload_id', sa.text('(actual_workload IS NULL)'), actual_workload, id
+    )
+    ix_eps_id = sa.Index('ix__facility__eps_id', sa.text('(eps IS NULL)'), eps, id)
+    ix_annual_capacity_id = sa.Index(
+        'ix__facility__annual_capacity_id', sa.text('(annual_capacity IS NULL)'), annual_capacity, id
+    )
 
     def __repr__(self):
         return f'Facility(' \
                f'id={self.id} ' \
-               f'paying_type={self.paying_type} ' \
                f'type={self.type_name})'
 
     @staticmethod
-    async def create(session: AsyncSession, facility_data: dict):
-        try:
-            facility_paying_type = facility_data.pop('paying_type')
-            if facility_paying_type is None:
-                facility_paying_type = []
-        except KeyError:
-            facility_paying_type = []
-        paying_type = []
-        for fpt in facility_paying_type:
-            fpt = fpt.lower()
-            f = await FacilityPayingType.get_or_create(session, fpt)
-            paying_type.append(f)
-        facility_data['paying_type'] = paying_type
-
-        try:
-            facility_age = facility_data.pop('age')
-            if facility_age is None:
-                facility_age = []
-        except KeyError:
-            facility_age = []
-        age = []
-        for fa in facility_age:
-            fa = fa.lower()
-            f = await FacilityAge.get_or_create(session, fa)
-            age.append(f)
-        facility_data['age'] = age
-
-        facility_type = facility_data.pop('type')
-        facility_type = facility_type.lower()
-        type = await FacilityType.get_or_create(session, facility_type)
-        facility_data['type'] = type
-
-        if facility_data.get('owning_type') is not None:
-            facility_owning_type = facility_data.pop('owning_type')
-            facility_owning_type = facility_owning_type.lower()
-            owning_type = await FacilityOwningType.get_or_create(session, facility_owning_type)
-            facility_data['owning_type'] = owning_type
-        else:
-            facility_owning_type = 'другая'
-            owning_type = await FacilityOwningType.get_or_create(session, facility_owning_type)
-            facility_data['owning_type'] = owning_type
-
-        if facility_data.get('covering_type') is not None:
-            facility_covering_type = facility_data.pop('covering_type')
-            facility_covering_type = facility_covering_type.lower()
-            covering_type = await FacilityCoveringType.get_or_create(session, facility_covering_type)
-            facility_data['covering_type'] = covering_type
-
-        facility = Facility(**facility_data)
-        session.add(facility)
-        await session.flush()
-        return facility
-
-    @staticmethod
-    async def construct(session: AsyncSession, facility_data: dict):
-        facility_data['hidden'] = False
-        try:
-            facility_paying_type = facility_data.pop('paying_type')
-        except KeyError:
-            facility_paying_type = []
-        if facility_paying_type == []:
-            facility_paying_type = ['бюджетные']
-        paying_type = []
-        for fpt in facility_paying_type:
-            fpt = fpt.lower()
-            f = await FacilityPayingType.get_or_create(session, fpt)
-            paying_type.append(f)
-        facility_data['paying_type'] = paying_type
-
-        try:
-            facility_age = facility_data.pop('age')
-        except KeyError:
-            facility_age = []
-        if facility_age == []:
-            facility_age = [
-                "взрослые",
-                "дети",
-                "молодёжь",
-                "пенсионеры"
-            ]
-        age = []
-        for fa in facility_age:
-            fa = fa.lower()
-            f = await FacilityAge.get_or_create(session, fa)
-            age.append(f)
-        facility_data['age'] = age
-
-        facility_type = facility_data.pop('type')
-        facility_type = facility_type.lower()
-        type = await FacilityType.get_or_create(session, facility_type)
-        facility_data['type'] = type
-
-        if facility_data.get('owning_type') is not None:
-            facility_owning_type = facility_data.pop('owning_type')
-            facility_owning_type = facility_owning_type.lower()
-            owning_type = await FacilityOwningType.get_or_create(session, facility_owning_type)
-            facility_data['owning_type'] = owning_type
-        else:
-            facility_owning_type = 'другая'
-            owning_type = await FacilityOwningType.get_or_create(session, facility_owning_type)
-            facility_data['owning_type'] = owning_type
-
-        if facility_data.get('covering_type') is not None:
-            facility_covering_type = facility_data.pop('covering_type')
-            facility_covering_type = facility_covering_type.lower()
-            covering_type = await FacilityCoveringType.get_or_create(session, facility_covering_type)
-            facility_data['covering_type'] = covering_type
-
-        facility = Facility(**facility_data)
-        return facility
-
-    @staticmethod
-    async def get_by_id(session: AsyncSession, id: str):
+    async def get_by_id(session: AsyncSession, id: str, *options):
         try:
             facility = (
                 await session.execute(
                     sa.select(Facility)
                     .where(Facility.id == id)
+                    .options(*options)
                 )
             ).scalars().first()
             return facility
@@ -512,3 +530,37 @@ class Facility(Base):
             await session.execute(sa.func.count(Facility.id))
         ).scalar()
         return count
+
+
+@sa.event.listens_for(so.Session, 'before_flush')
+def _facility_sync_derived_columns(session: so.Session, flush_context, instances):
+    # связи с paying_type и age и working_hours остаются источником истины, копии обновляются в том же flush
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, Facility):
+            continue
+        state = sa.inspect(obj)
+        if 'paying_type' in state.dict and state.attrs.paying_type.history.has_changes():
+            obj.paying_type_names = [pt.name for pt in obj.paying_type]
+        if 'age' in state.dict and state.attrs.age.history.has_changes():
+            obj.age_names = [a.name for a in obj.age]
+        if 'working_hours' in state.dict and state.attrs.working_hours.history.has_changes():
+            obj.open_minutes = working_hours_to_week_minutes(obj.working_hours)
+        if obj not in session.new and 'photo' in state.dict and state.attrs.photo.history.has_changes():
+            # фото меняются только в таблице связи, без явного изменения версии ORM не выполнит UPDATE объекта
+            obj.version += 1
+
+
+# Связи объекта не загружаются неявно (lazy='raise'), каждый запрос явно указывает, что ему нужно.
+# FACILITY_FULL_LOAD загружает все связи, нужные для FacilityServiceModel.
+FACILITY_FULL_LOAD = (
+    so.joinedload(Facility.type),
+    so.joinedload(Facility.owning_type),
+    so.joinedload(Facility.covering_type),
+    so.selectinload(Facility.paying_type),
+    so.selectinload(Facility.age),
+    so.selectinload(Facility.photo),
+)
+# связи, нужные для FacilityService.facility_to_dict: типы берутся из внешних ключей и массивов названий
+FACILITY_DICT_LOAD = (
+    so.selectinload(Facility.photo),
+)
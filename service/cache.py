@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from service.data_version import DataVersion
+
+
+class VersionedCache:
+    """
+    LRU кеш с ограничением времени жизни записей, привязанный к версии данных.
+
+    Версия входит в ключ, поэтому после записи в бд старые записи больше не находятся
+    и постепенно вытесняются новыми.
+    """
+    def __init__(self, version: DataVersion, max_size: int, ttl: float):
+        self.version = version
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[Hashable, tuple[float, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: Hashable) -> bytes | None:
+        key = (self.version.value, key)
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: bytes, version: int | None = None):
+        """
+        version - версия данных, на которой было посчитано значение. Ее нужно запоминать до запроса в бд,
+        иначе результат, посчитанный до параллельной записи, попадет в кеш под новой версией.
+        """
+        if self.max_size <= 0:
+            return
+        if version is None:
+            version = self.version.value
+        if version != self.version.value:
+            return
+        key = (version, key)
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,68 @@
+import asyncio
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from db.model.facility import facility_data_version_sequence
+
+
+class DataVersion:
+    """
+    Версия данных, общая для всех воркеров: последовательность в бд.
+
+    Каждый путь записи после commit увеличивает версию (`bump`), а кеши, построенные для старой версии,
+    перестают быть актуальными. `value` - последняя известная воркеру версия, она хранится в памяти:
+    запись в этом воркере меняет ее сразу, а записи других воркеров фоновая задача (`start`) подхватывает
+    не позже, чем через интервал опроса. Чтение кеша в бд не обращается.
+    """
+    def __init__(self, sequence: sa.Sequence):
+        self.sequence = sequence
+        self.value = 0
+        self._poll: asyncio.Task | None = None
+
+    def _update(self, value: int) -> int:
+        self.value = max(self.value, value)
+        return self.value
+
+    async def bump(self, async_session: async_sessionmaker[AsyncSession]) -> int:
+        # вызывается после записи, в том числе неудачной, поэтому ошибка не заменяет исключение записи
+        try:
+            async with async_session() as session:
+                session: AsyncSession
+                return self._update(await session.scalar(sa.select(self.sequence.next_value())))
+        except Exception as err:
+            logger.warning(f'FAILED TO BUMP DATA VERSION: {err!r}')
+            return self.value
+
+    async def refresh(self, async_session: async_sessionmaker[AsyncSession]) -> int:
+        async with async_session() as session:
+            session: AsyncSession
+            # до первого nextval last_value уже равен начальному значению
+            return self._update(await session.scalar(
+                sa.select(
+                    sa.case((sa.literal_column('is_called'), sa.literal_column('last_value')), else_=0)
+                ).select_from(sa.table(self.sequence.name))
+            ))
+
+    def start(self, async_session: async_sessionmaker[AsyncSession], interval: float):
+        """Запускает перечитывание версии из бд раз в `interval` секунд."""
+        async def poll():
+            while True:
+                try:
+                    await self.refresh(async_session)
+                except Exception as err:
+                    logger.warning(f'FAILED TO REFRESH DATA VERSION: {err!r}')
+                await asyncio.sleep(interval)
+
+        self.stop()
+        self._poll = asyncio.create_task(poll())
+
+    def stop(self):
+        if self._poll is not None:
+            self._poll.cancel()
+            self._poll = None
+
+
+# версия данных о спортивных объектах (включая их типы и фотографии)
+facility_data_version = DataVersion(facility_data_version_sequence)
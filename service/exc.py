@@ -71,3 +71,75 @@ class PhotoNotFoundServiceException(HTTPException):
             status_code=400,
             detail={"message": msg}
         )
+
+
+class FacilitySearchCursorServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=400,
+            detail={"message": msg}
+        )
+
+
+class FacilityFieldsServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=400,
+            detail={"message": msg}
+        )
+
+
+class FacilityVersionMismatchServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=412,
+            detail={"message": msg}
+        )
+
+
+class ExcelTooLargeServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=413,
+            detail={"message": msg}
+        )
+
+
+class ExcelTimeoutServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=408,
+            detail={"message": msg}
+        )
+
+
+class ExcelParseServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=400,
+            detail={"message": msg}
+        )
+
+
+class ExcelImportJobNotFoundServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=400,
+            detail={"message": msg}
+        )
+
+
+class ExcelImportJobStateServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=409,
+            detail={"message": msg}
+        )
+
+
+class ExcelImportBusyServiceException(HTTPException):
+    def __init__(self, msg: str):
+        super().__init__(
+            status_code=503,
+            detail={"message": msg}
+        )
@@ -1,20 +1,118 @@
+import asyncio
+import datetime
+import io
+import multiprocessing
 import os
 import time
+import uuid
+from collections import Counter, defaultdict
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import aclosing, asynccontextmanager
 
+import openpyxl
 import pandas as pd
+from fastapi import HTTPException, UploadFile
 from loguru import logger
-from pydantic import ValidationError
-from sqlalchemy.exc import DataError, IntegrityError
+from pydantic import TypeAdapter, ValidationError
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from service.model.excel_model import FacilityExcelItemServiceModel
+from service.data_version import facility_data_version
+from service.exc import ExcelTooLargeServiceException, ExcelTimeoutServiceException, ExcelParseServiceException, \
+    ExcelImportJobNotFoundServiceException, ExcelImportJobStateServiceException, ExcelImportBusyServiceException
+from service.model.excel_model import FacilityExcelItemServiceModel, ExcelImportJobServiceModel
 
-from db.model.facility import Facility
+from db.model.excel import ExcelImportJob
+from db.model.facility import Facility, FacilityType, FacilityOwningType, FacilityCoveringType, FacilityPayingType, \
+    FacilityAge, facility_categories, facility_facility_paying_type_association_table, \
+    facility_facility_age_association_table, working_hours_to_week_minutes, FACILITY_UNIQUE_CONSTRAINT, \
+    FACILITY_DEFAULT_PAYING_TYPE, FACILITY_DEFAULT_AGE
+
+# колонки задачи импорта без содержимого файла
+_IMPORT_JOB_COLUMNS = [c for c in ExcelImportJob.__table__.c if c.key not in ('content', 'runner', 'heartbeat_at')]
+# проверка пачки строк Excel одним вызовом валидатора
+_excel_items_adapter = TypeAdapter(list[FacilityExcelItemServiceModel])
+
+
+def _validate_excel(content: bytes, conn):
+    """
+    Проверка строк книги Excel в отдельном процессе. Книга читается пачками, в памяти остаются только
+    ошибки и уникальные ключи строк. В pipe отправляется количество строк, ошибки проверки и строки
+    по уникальным ключам (см. `validate_excel_facilities`), при ошибке - ее текст.
+    """
+    try:
+        excel_service = ExcelService(async_session=None)
+        count, errors, keys = 0, [], {}
+        for batch in excel_service.read_excel(content, ExcelService.READ_BATCH_SIZE):
+            count += len(batch)
+            errors.extend(excel_service.validate_excel_facilities(batch, keys))
+        conn.send((count, errors, keys))
+    except Exception as err:
+        conn.send(repr(err))
+    finally:
+        conn.close()
+
+
+def _send_excel(content: bytes, conn):
+    """
+    Чтение книги Excel в отдельном процессе для импорта: пачки строк отправляются в pipe по мере чтения.
+    Пока импорт не заберет пачку, отправка блокируется, поэтому процесс не читает книгу дальше.
+    В конце отправляется None, при ошибке - ее текст.
+    """
+    try:
+        for batch in ExcelService(async_session=None).read_excel(content, ExcelService.READ_BATCH_SIZE):
+            conn.send(batch)
+        conn.send(None)
+    except Exception as err:
+        conn.send(repr(err))
+    finally:
+        conn.close()
+
+
+async def _readable(fd):
+    """
+    Ждет, пока из fd (или объекта с fileno(), например, конца pipe) можно читать, не занимая поток executor.
+    Конец pipe и sentinel процесса становятся читаемыми и при завершении процесса.
+    """
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fd)
 
 
 class ExcelService:
-    def __init__(self, async_session):
+    # сколько строк вставляется одним INSERT при импорте
+    IMPORT_CHUNK_SIZE = 500
+    # сколько строк книги читается и передается из процесса чтения за раз
+    READ_BATCH_SIZE = 500
+    # как часто выполняющий импорт обновляет heartbeat_at, в том числе пока читает книгу или пропускает
+    # уже записанные строки
+    IMPORT_JOB_HEARTBEAT = datetime.timedelta(seconds=30)
+    # импорт, heartbeat_at которого не обновлялся дольше, считается прерванным (например, вместе с процессом)
+    IMPORT_JOB_STALE_AFTER = datetime.timedelta(minutes=5)
+
+    def __init__(self, async_session, workers: int = 1, max_size: int | None = None, timeout: float | None = None):
+        """
+        Книги Excel проверяются в отдельных процессах, не больше `workers` одновременно, чтобы разбор
+        больших файлов не блокировал event loop, и импортируются не более чем `workers` одновременно.
+        `max_size` - максимальный размер файла в байтах, `timeout` - максимальное время разбора в секундах
+        (None - без ограничений).
+        """
         self.async_session = async_session
+        self.workers = workers
+        self.max_size = max_size
+        self.timeout = timeout
+        # процессы проверки книг, не больше workers одновременно
+        self._validators = asyncio.Semaphore(workers)
+        # процессы чтения импортируемых книг, не больше workers одновременно
+        self._readers = asyncio.Semaphore(workers)
+        # выполняющиеся в этом процессе импорты
+        self._import_tasks: set[asyncio.Task] = set()
 
     _db_fields = {
         'Наименование': 'name',
@@ -63,51 +161,290 @@ class ExcelService:
         'note': 'Примечания',
     }
 
-    def xls_to_list(self, xls) -> list[dict]:
+    @staticmethod
+    @asynccontextmanager
+    async def _excel_process(target, content: bytes):
+        """
+        Запускает target(content, conn) в отдельном процессе и возвращает процесс и конец pipe для чтения.
+        spawn, а не fork, чтобы не копировать в процесс соединения с бд и состояние event loop.
+        При выходе процесс, если он еще работает (ошибка, таймаут), завершается.
+        """
+        context = multiprocessing.get_context('spawn')
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=target, args=(content, writer), daemon=True)
+        process.start()
+        writer.close()
+        try:
+            yield process, reader
+        finally:
+            if process.is_alive():
+                process.kill()
+            await _readable(process.sentinel)
+            process.join()
+            reader.close()
+
+    def close(self):
+        # прерванные импорты остаются в статусе running и продолжаются через resume_import_job
+        for task in self._import_tasks:
+            task.cancel()
+
+    def _check_size(self, size: int):
+        if self.max_size is not None and size > self.max_size:
+            raise ExcelTooLargeServiceException(
+                f"Файл больше {self.max_size / 1024 / 1024:.1f} МБ, разделите его на несколько файлов."
+            )
+
+    async def read_upload(self, file: UploadFile) -> bytes:
+        """
+        Читает загруженный файл, но не больше `max_size` байт: больший файл отклоняется по размеру
+        из заголовков загрузки, а если его нет - после чтения лишнего байта.
+
+        :raise ExcelTooLargeServiceException:
+        """
+        if file.size is not None:
+            self._check_size(file.size)
+        content = await file.read(-1 if self.max_size is None else self.max_size + 1)
+        self._check_size(len(content))
+        return content
+
+    def _check_import_slots(self):
+        # новый импорт не встает в очередь за уже выполняющимися, а отклоняется
+        if len(self._import_tasks) >= self.workers:
+            raise ExcelImportBusyServiceException("Сервер занят импортом других файлов, повторите позже.")
+
+    def _timeout_exception(self) -> ExcelTimeoutServiceException:
+        return ExcelTimeoutServiceException(
+            f"Файл не удалось обработать за {self.timeout:.0f} с, разделите его на несколько файлов."
+        )
+
+    async def validate_excel(self, content: bytes) -> (int, list[dict], list[dict]):
+        """
+        Проверяет строки книги Excel в отдельном процессе (см. `read_excel`, `validate_excel_facilities`)
+        и ищет дубликаты (см. `find_excel_duplicates`). Возвращает количество строк, ошибки проверки и дубликаты.
+        Зависший разбор по таймауту завершается вместе с процессом.
+
+        :raise ExcelTooLargeServiceException:
+        :raise ExcelTimeoutServiceException:
+        :raise ExcelParseServiceException:
+        """
+        self._check_size(len(content))
+        async with self._validators, self._excel_process(_validate_excel, content) as (process, reader):
+            try:
+                await asyncio.wait_for(_readable(reader), self.timeout)
+                result = reader.recv()
+            except asyncio.TimeoutError:
+                raise self._timeout_exception()
+            except EOFError:
+                logger.warning(f'EXCEL VALIDATOR EXITED WITH CODE {process.exitcode}')
+                raise ExcelParseServiceException("Не удалось прочитать Excel файл.")
+        if isinstance(result, str):
+            logger.warning(f'FAILED TO PARSE EXCEL: {result}')
+            raise ExcelParseServiceException("Не удалось прочитать Excel файл.")
+        count, errors, keys = result
+        return count, errors, await self.find_excel_duplicates(keys)
+
+    async def find_excel_duplicates(self, keys: dict[tuple, list[dict]]) -> list[dict]:
+        """
+        Дубликаты по уникальному ключу facility среди строк файла и в бд, keys - строки по уникальным ключам
+        (см. `validate_excel_facilities`). Все ключи ищутся в бд одним запросом.
+
+        Для каждой строки-дубликата возвращает `{"n", "type", "name", "duplicate_of", "facility_id"}`:
+        duplicate_of - номер первой строки файла с тем же ключом, facility_id - объект с тем же ключом в бд.
+        Импорт такие строки не записывает.
+        """
+        existing = {}
+        if keys:
+            key_columns = (Facility.name, Facility.address, Facility.owner, Facility.area, Facility.type_name)
+            values = list(zip(*keys))
+            file_keys = sa.func.unnest(*(
+                sa.literal(list(v), postgresql.ARRAY(column.type)) for v, column in zip(values, key_columns)
+            )).table_valued(*(column.key for column in key_columns)).render_derived('file_keys')
+            stmt = sa.select(Facility.id, *key_columns).join(
+                file_keys, sa.and_(*(column == file_keys.c[column.key] for column in key_columns))
+            )
+            async with self.async_session() as session:
+                session: AsyncSession
+                existing = {tuple(row[1:]): row.id for row in await session.execute(stmt)}
+
+        duplicates = []
+        for key, rows in keys.items():
+            facility_id = existing.get(key)
+            for i, row in enumerate(rows):
+                if i > 0 or facility_id is not None:
+                    duplicates.append({
+                        **row,
+                        'duplicate_of': None if i == 0 else rows[0]['n'],
+                        'facility_id': facility_id,
+                    })
+        return duplicates
+
+    async def stream_excel(self, content: bytes) -> AsyncIterator[list[dict]]:
+        """
+        Пачки строк книги Excel (см. `read_excel`) для импорта. Книга читается в отдельном процессе
+        не дальше, чем импорт успевает забирать пачки, поэтому память ограничена размером пачки.
+        Процессов чтения не больше `workers`, остальные импорты ждут свободного.
+        `timeout` ограничивает суммарное время ожидания пачек, а не время импорта.
+
+        :raise ExcelTooLargeServiceException:
+        :raise ExcelTimeoutServiceException:
+        :raise ExcelParseServiceException:
+        """
+        self._check_size(len(content))
+        async with self._readers, self._excel_process(_send_excel, content) as (process, reader):
+            waited = 0.
+            loop = asyncio.get_running_loop()
+            while True:
+                start = loop.time()
+                try:
+                    await asyncio.wait_for(
+                        _readable(reader), None if self.timeout is None else max(self.timeout - waited, 0)
+                    )
+                    batch = reader.recv()
+                except asyncio.TimeoutError:
+                    raise self._timeout_exception()
+                except EOFError:
+                    # процесс чтения завершился, не отправив конец книги
+                    logger.warning(f'EXCEL READER EXITED WITH CODE {process.exitcode}')
+                    raise ExcelParseServiceException("Не удалось прочитать Excel файл.")
+                waited += loop.time() - start
+                if batch is None:
+                    return
+                if isinstance(batch, str):
+                    logger.warning(f'FAILED TO PARSE EXCEL: {batch}')
+                    raise ExcelParseServiceException("Не удалось прочитать Excel файл.")
+                yield batch
+
+    def read_excel(self, content: bytes, batch_size: int) -> Iterator[list[dict]]:
         """
-        Makes list of facility dicts from pandas xls object.
+        Читает книгу Excel построчно (openpyxl read-only, .xls - через xlrd) и возвращает строки объектов
+        пачками по batch_size в том же виде, что и прежнее чтение через pd.read_excel: первая строка листа -
+        названия колонок, следующая (пояснения к колонкам) пропускается, колонки не из `_db_fields`
+        отбрасываются, пустые ячейки в объект не попадают.
         """
-        facilities = []
-        f_types = xls.keys()
-        for f_type in f_types:
-            df = xls[f_type]
-            df_size = len(df.values)
-            df_fields = df.keys()
-            for i in range(1, df_size):
-                obj = df.iloc[i]
+        batch = []
+        for f_type, rows in self._excel_sheets(content):
+            columns = None
+            skipped = False
+            # пустые строки, как и в pandas, отбрасываются только в конце листа
+            blank = 0
+            for row in rows:
+                if all(v is None or v == '' for v in row):
+                    if columns is not None:
+                        blank += 1
+                    continue
+                if columns is None:
+                    # колонки с одинаковым названием: как и в pandas, берется первая
+                    columns = {}
+                    for j, name in enumerate(row):
+                        if name in self._db_fields and self._db_fields[name] not in columns:
+                            columns[self._db_fields[name]] = j
+                    continue
+                objs = [{} for _ in range(blank)]
+                blank = 0
                 obj_dict = {}
-                for j in range(0, len(df_fields)):
-                    try:
-                        if str(obj[j]) == 'nan':  # костыль, проверка числа на пандасовский NaN
-                            continue
-                        obj_dict[self._db_fields[df_fields[j]]] = obj[j]
-                    except KeyError:
-                        pass
-                obj_dict['type'] = f_type
-                facilities.append(obj_dict)
-        return facilities
+                for field, j in columns.items():
+                    if j < len(row) and row[j] is not None and row[j] != '':
+                        obj_dict[field] = row[j]
+                objs.append(obj_dict)
+                if not skipped:
+                    skipped = True
+                    objs.pop(0)
+                for obj_dict in objs:
+                    obj_dict['type'] = f_type
+                    batch.append(obj_dict)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _excel_sheets(content: bytes) -> Iterator[tuple[str, Iterator[tuple]]]:
+        """
+        Листы книги: (название, итератор значений строк). Листы .xlsx не загружаются в память целиком.
+        """
+        if content[:2] == b'PK':
+            wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            try:
+                for ws in wb.worksheets:
+                    yield ws.title, ws.iter_rows(values_only=True)
+            finally:
+                wb.close()
+            return
+
+        # старый формат .xls (zip-архив - это .xlsx)
+        import xlrd
+        book = xlrd.open_workbook(file_contents=content, on_demand=True)
+        for i, name in enumerate(book.sheet_names()):
+            sheet = book.sheet_by_index(i)
+            yield name, (
+                tuple(
+                    # числа в .xls всегда float, целые приводятся к int, как в pandas
+                    int(c.value) if c.ctype == xlrd.XL_CELL_NUMBER and c.value.is_integer() else c.value
+                    for c in cells
+                )
+                for cells in sheet.get_rows()
+            )
+            book.unload_sheet(i)
+
+    @staticmethod
+    def validate_excel_items(
+            facilities: list[dict]
+    ) -> (list[FacilityExcelItemServiceModel | None], dict[int, ValidationError]):
+        """
+        Проверяет пачку строк Excel одним вызовом валидатора. Возвращает проверенные объекты (None для строк
+        с ошибками) и ошибки по индексам строк в том же виде, что и при проверке одной строки.
+        """
+        try:
+            return _excel_items_adapter.validate_python(facilities), {}
+        except ValidationError as err:
+            line_errors = defaultdict(list)
+            for e in err.errors(include_url=False):
+                line_error = {'type': e['type'], 'loc': e['loc'][1:], 'input': e['input']}
+                if 'ctx' in e:
+                    line_error['ctx'] = e['ctx']
+                line_errors[e['loc'][0]].append(line_error)
+        errors = {
+            i: ValidationError.from_exception_data(FacilityExcelItemServiceModel.__name__, es)
+            for i, es in line_errors.items()
+        }
 
-    def validate_excel_facilities(self, facilities: list[dict]) -> list[dict]:
+        # объекты из неудачной проверки не возвращаются, поэтому строки без ошибок проверяются еще раз
+        items = [None] * len(facilities)
+        valid = [i for i in range(len(facilities)) if i not in errors]
+        for i, item in zip(valid, _excel_items_adapter.validate_python([facilities[i] for i in valid])):
+            items[i] = item
+        return items, errors
+
+    def validate_excel_facilities(
+            self, facilities: list[dict], keys: dict[tuple, list[dict]] | None = None
+    ) -> list[dict]:
         """
         Validate facilities and return list of ValidationErrors
+
+        В keys (если передан) добавляются проверенные строки по уникальному ключу facility
+        (name, address, owner, area, type_name) в виде `{"n", "type", "name"}`.
         """
-        errors = []
+        ns = []
         for facility in facilities:
-            try:
-                n = int(facility.pop('n'))
-            except KeyError:
-                n = None
-            try:
-                FacilityExcelItemServiceModel.model_validate(facility)
-            except ValidationError as err:
-                err: ValidationError
-                errors.append({
-                    'n': n,
-                    'type': str(facility.get('type')),
-                    'name': str(facility.get('name')),
-                    'detail': err.json(),
-                })
-        return errors
+            n = facility.pop('n', None)
+            ns.append(None if n is None else int(n))
+        items, errors = self.validate_excel_items(facilities)
+        if keys is not None:
+            for n, item in zip(ns, items):
+                if item is not None:
+                    keys.setdefault(
+                        (item.name, item.address, item.owner, item.area, item.type.lower()), []
+                    ).append({'n': n, 'type': item.type, 'name': item.name})
+        return [
+            {
+                'n': ns[i],
+                'type': str(facilities[i].get('type')),
+                'name': str(facilities[i].get('name')),
+                'detail': err.json(),
+            }
+            for i, err in sorted(errors.items())
+        ]
 
     def _facility_to_human_readable(self, facility: dict):
         """
@@ -124,49 +461,317 @@ class ExcelService:
 
         return readable_facility
 
-    async def _add_excel_facility_to_db(self, session: AsyncSession, facility: dict):
-        f = FacilityExcelItemServiceModel.model_validate(facility).model_dump()
+    @staticmethod
+    def _prepare_excel_facility(facility: FacilityExcelItemServiceModel) -> dict:
+        """
+        Значения колонок facility для проверенной строки Excel, как их записал бы `Facility.construct`:
+        объект сразу виден, названия типов в нижнем регистре, пустые paying_type и age заполняются по умолчанию.
+        """
+        f = facility.model_dump()
         if f.get('document') is not None:
             f['document'] = str(f['document'])
-        await session.begin_nested()
-        f_db = await Facility.construct(session, f)
-        session.add(f_db)
-        await session.commit()
-        return {
-            "id": f_db.id,
-            "address": f_db.address
+        f['id'] = uuid.uuid4()
+        f['hidden'] = False
+        f['type_name'] = f.pop('type').lower()
+        f['owning_type_name'] = f.pop('owning_type').lower()
+        covering_type = f.pop('covering_type')
+        f['covering_type_name'] = None if covering_type is None else covering_type.lower()
+        f['paying_type_names'] = [n.lower() for n in f.pop('paying_type')] or list(FACILITY_DEFAULT_PAYING_TYPE)
+        f['age_names'] = [n.lower() for n in f.pop('age')] or list(FACILITY_DEFAULT_AGE)
+        f['open_minutes'] = working_hours_to_week_minutes(f['working_hours'])
+        return f
+
+    @staticmethod
+    async def _insert_facilities(session: AsyncSession, rows: list[dict]) -> set[uuid.UUID]:
+        """
+        Вставляет объекты многострочными INSERT, дубликаты по уникальному ключу (в бд или в самой пачке) пропускаются.
+        Связи с paying_type и age вставляются для созданных объектов. Возвращает id созданных объектов.
+        """
+        table = Facility.__table__
+        stmt = postgresql.insert(table).on_conflict_do_nothing(
+            constraint=FACILITY_UNIQUE_CONSTRAINT
+        ).returning(table.c.id)
+        # executemany: SQLAlchemy собирает из одного закешированного запроса многострочные INSERT (insertmanyvalues)
+        created = {uuid.UUID(str(id)) for id in (await session.execute(stmt, rows)).scalars()}
+
+        for association, column, names_column in (
+            (facility_facility_paying_type_association_table, 'facility_paying_type', 'paying_type_names'),
+            (facility_facility_age_association_table, 'facility_age', 'age_names'),
+        ):
+            links = [
+                {'facility': row['id'], column: name}
+                for row in rows if row['id'] in created for name in row[names_column]
+            ]
+            if links:
+                await session.execute(sa.insert(association), links)
+        return created
+
+    async def _add_excel_chunk(self, session: AsyncSession, facilities: list[dict]) -> list[dict]:
+        """
+        Записывает пачку строк импорта в транзакции session, не фиксируя ее (фиксирует вызывающий код):
+        строки проверяются, недостающие типы создаются одним запросом, а объекты вставляются одним
+        INSERT ... ON CONFLICT DO NOTHING по (name, address, owner, area, type_name). Если пачка не записалась
+        из-за некорректных значений, ее строки записываются по одной в savepoint-ах.
+
+        Возвращает результат для каждой строки в исходном порядке:
+        `{"n", "status": "created" | "exists" | "invalid", "id", "address", "detail"}`.
+        """
+        facilities = [dict(facility) for facility in facilities]
+        results = [
+            {
+                'n': facility.pop('n', None),
+                'status': 'invalid',
+                'id': None,
+                'address': facility.get('address'),
+                'detail': None,
+            }
+            for facility in facilities
+        ]
+        items, errors = self.validate_excel_items(facilities)
+        for i, err in errors.items():
+            results[i]['detail'] = err.json()
+        # (результат, значения колонок) проверенных строк
+        chunk = [
+            (result, self._prepare_excel_facility(item))
+            for result, item in zip(results, items) if item is not None
+        ]
+        if not chunk:
+            return results
+
+        start = time.time()
+        categories = {
+            FacilityType: {row['type_name'] for _, row in chunk},
+            FacilityOwningType: {row['owning_type_name'] for _, row in chunk},
+            FacilityCoveringType: {row['covering_type_name'] for _, row in chunk} - {None},
+            FacilityPayingType: {n for _, row in chunk for n in row['paying_type_names']},
+            FacilityAge: {n for _, row in chunk for n in row['age_names']},
         }
+        await facility_categories.resolve(session, categories)
+        await session.commit()
 
-    async def add_excel_facilities_to_db(self, facilities: list[dict]):
-        # logger.debug(f'TRY TO IMPORT {len(facilities)} FACILITIES FROM EXCEL TO DB')
-        async_session = self.async_session
-        async with async_session() as session:
-            session: AsyncSession
-            facilities_in_db = []
-            i = 0
-            all = len(facilities)
-            for facility in facilities:
-                try:
-                    _ = facility.pop('n')
-                except KeyError:
-                    pass
-                start = time.time()
+        try:
+            async with session.begin_nested():
+                created = await self._insert_facilities(session, [row for _, row in chunk])
+        except DBAPIError as err:
+            # некорректные значения (например, число вне диапазона integer) отклоняются драйвером
+            # или postgres-ом, а ошибки соединения пробрасываются
+            if err.connection_invalidated:
+                raise
+            if facility_categories.is_missing(err):
+                # тип из кеша удален через другой воркер: типы создаются заново, строки записываются по одной
+                facility_categories.clear()
+                await facility_categories.resolve(session, categories)
+                await session.commit()
+            created = set()
+            for result, row in chunk:
                 try:
-                    f_db = await self._add_excel_facility_to_db(session, facility)
-                    logger.debug(
-                        f'{i} / {all} | SUCCESS: ADD FACILITY: {time.time() - start : 0.3f}MS: f{f_db.get("id")}'
-                    )
-                    facilities_in_db.append(f_db)
-                except DataError:
-                    logger.debug(f'{i} / {all} | ERROR: {time.time() - start : 0.3f}MS: DataError')
-                    await session.rollback()
-                except IntegrityError:
-                    logger.debug(f'{i} / {all} | ERROR: {time.time() - start : 0.3f}MS: IntegrityError')
-                    await session.rollback()
-                finally:
-                    i += 1
+                    async with session.begin_nested():
+                        created |= await self._insert_facilities(session, [row])
+                except DBAPIError as row_err:
+                    if row_err.connection_invalidated:
+                        raise
+                    result['detail'] = str(row_err.orig)
+        for result, row in chunk:
+            if row['id'] in created:
+                result['status'] = 'created'
+                result['id'] = row['id']
+            elif result['detail'] is None:
+                result['status'] = 'exists'
+        logger.debug(f'ADD {len(created)} / {len(facilities)} FACILITIES: {time.time() - start:0.3f}S')
+        return results
+
+    async def create_import_job(self, filename: str | None, content: bytes) -> ExcelImportJobServiceModel:
+        """
+        Сохраняет файл как задачу импорта в статусе running, запускается она через `start_import_job`.
+
+        :raise ExcelTooLargeServiceException:
+        :raise ExcelImportBusyServiceException:
+        """
+        self._check_size(len(content))
+        self._check_import_slots()
+        async with self.async_session() as session:
+            session: AsyncSession
+            job = (await session.execute(
+                sa.insert(ExcelImportJob.__table__).values(
+                    id=uuid.uuid4(), status='running', filename=filename, size=len(content), content=content
+                ).returning(*_IMPORT_JOB_COLUMNS)
+            )).one()
             await session.commit()
-            return facilities_in_db
+        return ExcelImportJobServiceModel.model_validate(job)
+
+    async def get_import_job(self, job_id: uuid.UUID) -> ExcelImportJobServiceModel:
+        """
+        :raise ExcelImportJobNotFoundServiceException:
+        """
+        async with self.async_session() as session:
+            session: AsyncSession
+            job = (await session.execute(
+                sa.select(*_IMPORT_JOB_COLUMNS).where(ExcelImportJob.id == job_id)
+            )).first()
+        if job is None:
+            raise ExcelImportJobNotFoundServiceException("Импорт не найден.")
+        return ExcelImportJobServiceModel.model_validate(job)
+
+    async def _update_import_job(self, job_id: uuid.UUID, where, **values) -> ExcelImportJobServiceModel:
+        """
+        Меняет задачу, если она удовлетворяет условию where, иначе сообщает, в каком она статусе.
+
+        :raise ExcelImportJobNotFoundServiceException:
+        :raise ExcelImportJobStateServiceException:
+        """
+        async with self.async_session() as session:
+            session: AsyncSession
+            job = (await session.execute(
+                sa.update(ExcelImportJob.__table__).where(ExcelImportJob.id == job_id, where).values(
+                    updated_at=sa.func.now(), **values
+                ).returning(*_IMPORT_JOB_COLUMNS)
+            )).first()
+            await session.commit()
+        if job is None:
+            job = await self.get_import_job(job_id)
+            raise ExcelImportJobStateServiceException(f"Импорт в статусе {job.status}.")
+        return ExcelImportJobServiceModel.model_validate(job)
+
+    async def cancel_import_job(self, job_id: uuid.UUID) -> ExcelImportJobServiceModel:
+        """
+        Отменяет выполняющийся импорт. Импорт останавливается перед записью следующей пачки,
+        уже записанные пачки остаются в бд.
+
+        :raise ExcelImportJobNotFoundServiceException:
+        :raise ExcelImportJobStateServiceException:
+        """
+        return await self._update_import_job(job_id, ExcelImportJob.status == 'running', status='cancelled')
+
+    async def resume_import_job(self, job_id: uuid.UUID) -> ExcelImportJobServiceModel:
+        """
+        Возвращает в статус running отмененный, упавший или прерванный импорт (running, но без heartbeat
+        дольше IMPORT_JOB_STALE_AFTER), запускается он через `start_import_job`. Прежний исполнитель
+        теряет задачу и больше ничего в нее не записывает.
+
+        :raise ExcelImportJobNotFoundServiceException:
+        :raise ExcelImportJobStateServiceException:
+        :raise ExcelImportBusyServiceException:
+        """
+        self._check_import_slots()
+        return await self._update_import_job(
+            job_id,
+            sa.or_(
+                ExcelImportJob.status.in_(('cancelled', 'failed')),
+                sa.and_(
+                    ExcelImportJob.status == 'running',
+                    ExcelImportJob.heartbeat_at < sa.func.now() - self.IMPORT_JOB_STALE_AFTER
+                )
+            ),
+            status='running',
+            error=None,
+            runner=None,
+            heartbeat_at=sa.func.now()
+        )
+
+    def start_import_job(
+            self, job_id: uuid.UUID, on_done: Callable[[ExcelImportJobServiceModel], None] | None = None
+    ):
+        """
+        Запускает `run_import_job` в фоне, on_done вызывается с задачей после ее остановки.
+        """
+        async def run():
+            job = await self.run_import_job(job_id)
+            if on_done is not None:
+                on_done(job)
+
+        task = asyncio.create_task(run())
+        self._import_tasks.add(task)
+        task.add_done_callback(self._import_tasks.discard)
+
+    async def run_import_job(self, job_id: uuid.UUID) -> ExcelImportJobServiceModel:
+        """
+        Импортирует файл задачи в статусе running, начиная с processed строки. Задача сначала занимается
+        (runner), пока импорт идет, heartbeat_at обновляется в фоне; занятую другим исполнителем задачу
+        импорт не трогает. Каждая пачка фиксируется вместе с processed и счетчиками, поэтому после прерывания
+        импорт продолжается с первой незаписанной пачки. Если задачу отменили или ее продолжил другой
+        исполнитель (см. `resume_import_job`), пачка не фиксируется и импорт останавливается. В конце задача
+        получает статус done (файл удаляется) или failed.
+        """
+        job = ExcelImportJob.__table__
+        runner = uuid.uuid4()
+        owned = sa.and_(job.c.id == job_id, job.c.status == 'running', job.c.runner == runner)
+        async with self.async_session() as session:
+            session: AsyncSession
+            row = (await session.execute(
+                sa.update(job).where(job.c.id == job_id, job.c.status == 'running', job.c.runner.is_(None)).values(
+                    runner=runner, heartbeat_at=sa.func.now()
+                ).returning(job.c.content, job.c.processed)
+            )).first()
+            await session.commit()
+            if row is None:
+                return await self.get_import_job(job_id)
+            content, skip = row
+
+            heartbeat = asyncio.create_task(self._import_job_heartbeat(job_id, runner))
+            try:
+                async with aclosing(self.stream_excel(content)) as batches:
+                    async for batch in batches:
+                        # строки до processed уже записаны
+                        if skip >= len(batch):
+                            skip -= len(batch)
+                            continue
+                        batch, skip = batch[skip:], 0
+
+                        for i in range(0, len(batch), self.IMPORT_CHUNK_SIZE):
+                            chunk = batch[i:i + self.IMPORT_CHUNK_SIZE]
+                            counts = Counter(r['status'] for r in await self._add_excel_chunk(session, chunk))
+                            running = (await session.execute(
+                                sa.update(job).where(owned).values(
+                                    processed=job.c.processed + len(chunk),
+                                    inserted=job.c.inserted + counts['created'],
+                                    duplicated=job.c.duplicated + counts['exists'],
+                                    failed=job.c.failed + counts['invalid'],
+                                    updated_at=sa.func.now()
+                                ).returning(job.c.processed)
+                            )).first()
+                            if running is None:
+                                await session.rollback()
+                                logger.info(f'IMPORT JOB {job_id} CANCELLED OR TAKEN OVER')
+                                return await self.get_import_job(job_id)
+                            await session.commit()
+                            await facility_data_version.bump(self.async_session)
+                            logger.debug(f'IMPORT JOB {job_id}: {running.processed} ROWS PROCESSED')
+
+                await session.execute(
+                    sa.update(job).where(owned).values(status='done', content=None, updated_at=sa.func.now())
+                )
+                await session.commit()
+            except Exception as err:
+                logger.error(f'IMPORT JOB {job_id} FAILED: {err!r}')
+                await session.rollback()
+                await session.execute(
+                    sa.update(job).where(owned).values(
+                        status='failed',
+                        error=err.detail['message'] if isinstance(err, HTTPException) else repr(err),
+                        updated_at=sa.func.now()
+                    )
+                )
+                await session.commit()
+            finally:
+                heartbeat.cancel()
+        return await self.get_import_job(job_id)
+
+    async def _import_job_heartbeat(self, job_id: uuid.UUID, runner: uuid.UUID):
+        # отдельная сессия: сессия импорта может быть посреди транзакции пачки
+        job = ExcelImportJob.__table__
+        while True:
+            await asyncio.sleep(self.IMPORT_JOB_HEARTBEAT.total_seconds())
+            try:
+                async with self.async_session() as session:
+                    session: AsyncSession
+                    await session.execute(
+                        sa.update(job).where(job.c.id == job_id, job.c.runner == runner).values(
+                            heartbeat_at=sa.func.now()
+                        )
+                    )
+                    await session.commit()
+            except Exception as err:
+                logger.warning(f'IMPORT JOB {job_id} HEARTBEAT FAILED: {err!r}')
 
     def _facilities_to_df_by_type(self, facilities: list):
         facility_by_types = {}
@@ -1,24 +1,118 @@
-from typing import Any
+import base64
+import datetime
+import hashlib
+import json
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator
 
 import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
 from db.model.facility import Facility, FacilityPayingType, FacilityAge, FacilityType, FacilityOwningType, \
-    FacilityCoveringType
+    FacilityCoveringType, FacilityPhoto, facility_categories, working_hours_to_week_minutes, \
+    facility_facility_paying_type_association_table, facility_facility_age_association_table, \
+    facility_facility_photo_association_table, FACILITY_FULL_LOAD, FACILITY_DICT_LOAD, FACILITY_SEARCH_CONFIG, \
+    FACILITY_METRES_PER_DEGREE_LAT, FACILITY_METRES_PER_DEGREE_LON, FACILITY_GRID_MAX_LEVEL
+from service.data_version import facility_data_version
 from service.utils import FACILITY_PK_TYPE
-from service.exc import FacilityAlreadyExistsServiceException, FacilityNotFoundServiceException
+from service.exc import FacilityAlreadyExistsServiceException, FacilityNotFoundServiceException, \
+    FacilitySearchCursorServiceException, FacilityFieldsServiceException, FacilityVersionMismatchServiceException
 from service.model.facility_model import (
     FacilityServiceModel,
     FacilityCreateServiceModel,
     FacilityPutServiceModel,
-    FacilityPatchServiceModel
+    FacilityPatchServiceModel,
+    FacilityClusterServiceModel,
+    FacilityBulkItemServiceModel
 )
 
 
 class FacilityService:
+    # поля, по которым можно сортировать поиск (и строить по ним курсор)
+    ORDER_BY_FIELDS = {
+        'created_at': Facility.__table__.c.created_at,
+        'type': Facility.__table__.c.type_name,
+        'area': Facility.__table__.c.area,
+        'actual_workload': Facility.__table__.c.actual_workload,
+        'eps': Facility.__table__.c.eps,
+        'annual_capacity': Facility.__table__.c.annual_capacity,
+        'name': Facility.__table__.c.name,
+    }
+
+    # поля ответа (FacilityResponse), которые берутся из колонок facility: поле -> атрибут Facility
+    RESPONSE_COLUMN_FIELDS = {
+        'id': 'id',
+        'version': 'version',
+        'name': 'name',
+        'owner': 'owner',
+        'address': 'address',
+        'x': 'x',
+        'y': 'y',
+        'hidden': 'hidden',
+        'length': 'length',
+        'width': 'width',
+        'height': 'height',
+        'depth': 'depth',
+        'area': 'area',
+        'eps': 'eps',
+        'actual_workload': 'actual_workload',
+        'annual_capacity': 'annual_capacity',
+        'accessibility': 'accessibility',
+        'site': 'site',
+        'phone_number': 'phone_number',
+        'document': 'document',
+        'note': 'note',
+        'working_hours': 'working_hours',
+        'type': 'type_name',
+        'owning_type': 'owning_type_name',
+        'covering_type': 'covering_type_name',
+        'paying_type': 'paying_type_names',
+        'age': 'age_names',
+    }
+    # поля ответа, для которых загружаются связи
+    RESPONSE_RELATION_FIELDS = ('photo',)
+
+    # поля с типами объекта, которые хранятся в колонках facility: поле -> колонка с названием
+    CATEGORY_COLUMNS = {
+        'type': 'type_name',
+        'owning_type': 'owning_type_name',
+        'covering_type': 'covering_type_name',
+        'paying_type': 'paying_type_names',
+        'age': 'age_names',
+    }
+    # связи многие ко многим, которые меняются вместе с колонками названий: поле -> (таблица, колонка типа)
+    CATEGORY_ASSOCIATIONS = {
+        'paying_type': (facility_facility_paying_type_association_table, 'facility_paying_type'),
+        'age': (facility_facility_age_association_table, 'facility_age'),
+    }
+
+    # поля с типами объекта: поле -> класс типа
+    CATEGORY_FIELDS = {
+        'type': FacilityType,
+        'owning_type': FacilityOwningType,
+        'covering_type': FacilityCoveringType,
+        'paying_type': FacilityPayingType,
+        'age': FacilityAge,
+    }
+
+    # ячейка кластера на карте примерно 64x64 пикселя: 256px тайл зума z делится на 4x4 ячейки
+    CLUSTER_GRID_LEVEL_OFFSET = 2
+
+    # сколько секунд кеш маркеров живет без проверки изменений в других воркерах
+    MARKERS_CACHE_TTL = 60
+
+    # сколько объектов поиска читается из бд за раз при потоковой выдаче
+    SEARCH_STREAM_CHUNK_SIZE = 500
+
     def __init__(self, async_session: async_sessionmaker[AsyncSession]):
         self.async_session = async_session
+        # (версия данных, время протухания, etag, json)
+        self._markers_cache: tuple[int, float, str, bytes] | None = None
 
     @staticmethod
     def to_facility_create_service_model(facility_data: dict):
@@ -34,33 +128,135 @@ class FacilityService:
 
     @staticmethod
     async def _transform_facility_data(facility_data: dict, session: AsyncSession) -> dict:
-        facility_data_type_name = facility_data.pop("type")
-        facility_data["type"] = await FacilityType.get_or_create(session, facility_data_type_name)
+        type = facility_data.pop("type")
+        owning_type = facility_data.pop("owning_type")
+        covering_type = facility_data.pop("covering_type")
+        paying_type: list[str] = facility_data.pop("paying_type")
+        age: list[str] = facility_data.pop("age")
 
-        facility_data_owning_type = facility_data.pop("owning_type")
-        facility_data["owning_type"] = await FacilityOwningType.get_or_create(session, facility_data_owning_type)
+        categories = await facility_categories.resolve(session, {
+            FacilityType: [type],
+            FacilityOwningType: [owning_type],
+            FacilityCoveringType: [] if covering_type is None else [covering_type],
+            FacilityPayingType: paying_type,
+            FacilityAge: age,
+        })
 
-        facility_data_covering_type = facility_data.pop("covering_type")
-        if facility_data_covering_type is not None:
-            facility_data["covering_type"] = await FacilityCoveringType.get_or_create(
-                session, facility_data_covering_type
-            )
+        facility_data["type"] = categories[FacilityType][type]
+        facility_data["owning_type"] = categories[FacilityOwningType][owning_type]
+        if covering_type is not None:
+            facility_data["covering_type"] = categories[FacilityCoveringType][covering_type]
+        facility_data["paying_type"] = [categories[FacilityPayingType][pt] for pt in paying_type]
+        facility_data["age"] = [categories[FacilityAge][a] for a in age]
+        return facility_data
 
-        facility_data_paying_type: list[str] = facility_data.pop("paying_type")
-        paying_types = []
-        for fpt in facility_data_paying_type:
-            pt = await FacilityPayingType.get_or_create(session, fpt)
-            paying_types.append(pt)
-        facility_data["paying_type"] = paying_types
-
-        facility_data_ages: list[str] = facility_data.pop("age")
-        ages = []
-        for fa in facility_data_ages:
-            a = await FacilityAge.get_or_create(session, fa)
-            ages.append(a)
-        facility_data["age"] = ages
+    @staticmethod
+    def _category_names(facilities_data: list[dict]) -> dict[type, list[str]]:
+        """Названия типов всех объектов для одного вызова `facility_categories.resolve`."""
+        names = {cls: [] for cls in FacilityService.CATEGORY_FIELDS.values()}
+        for facility_data in facilities_data:
+            for k, cls in FacilityService.CATEGORY_FIELDS.items():
+                v = facility_data.get(k)
+                if v is not None:
+                    names[cls].extend(v if isinstance(v, list) else [v])
+        return names
+
+    @staticmethod
+    def _with_categories(facility_data: dict, categories: dict) -> dict:
+        """Заменяет названия типов объектами из `facility_categories.resolve`, None не трогает."""
+        for k, cls in FacilityService.CATEGORY_FIELDS.items():
+            v: Any = facility_data.get(k)
+            if v is None:
+                continue
+            if isinstance(v, list):
+                facility_data[k] = [categories[cls][n] for n in v]
+            else:
+                facility_data[k] = categories[cls][v]
         return facility_data
 
+    @staticmethod
+    def _projection_options(fields: list[str] | None) -> tuple:
+        """
+        Опции загрузки объектов для `facility_to_dict` с полями `fields` (None - все поля):
+        из бд читаются только нужные колонки и связи.
+
+        :raise FacilityFieldsServiceException:
+        """
+        if fields is None:
+            return FACILITY_DICT_LOAD
+        unknown = set(fields) - FacilityService.RESPONSE_COLUMN_FIELDS.keys() - \
+            set(FacilityService.RESPONSE_RELATION_FIELDS)
+        if unknown:
+            raise FacilityFieldsServiceException(f"Неизвестные поля: {', '.join(sorted(unknown))}.")
+        columns = [
+            getattr(Facility, FacilityService.RESPONSE_COLUMN_FIELDS[k])
+            for k in fields if k in FacilityService.RESPONSE_COLUMN_FIELDS
+        ]
+        options = [so.load_only(Facility.id, *columns, raiseload=True)]
+        for k in FacilityService.RESPONSE_RELATION_FIELDS:
+            if k in fields:
+                options.append(so.selectinload(getattr(Facility, k)))
+        return tuple(options)
+
+    @staticmethod
+    def _response_field(f: Facility, field: str):
+        if field == 'photo':
+            return [{'id': p.id, 'url': p.url, 'filename': p.filename} for p in f.photo]
+        return getattr(f, FacilityService.RESPONSE_COLUMN_FIELDS[field])
+
+    @staticmethod
+    def facility_to_dict(f: Facility, fields: list[str] | None = None) -> dict:
+        """
+        Объект из бд в формате FacilityResponse (типы - названиями) без валидации:
+        данные проверяются при записи, поэтому при чтении их можно сразу сериализовать.
+        `fields` оставляет только перечисленные поля.
+        Связи должны быть загружены (см. `_projection_options`).
+        """
+        if fields is not None:
+            return {k: FacilityService._response_field(f, k) for k in fields}
+        return {
+            'id': f.id,
+            'version': f.version,
+            'name': f.name,
+            'owner': f.owner,
+            'address': f.address,
+            'x': f.x,
+            'y': f.y,
+            'hidden': f.hidden,
+            'length': f.length,
+            'width': f.width,
+            'height': f.height,
+            'depth': f.depth,
+            'area': f.area,
+            'eps': f.eps,
+            'actual_workload': f.actual_workload,
+            'annual_capacity': f.annual_capacity,
+            'accessibility': f.accessibility,
+            'site': f.site,
+            'phone_number': f.phone_number,
+            'document': f.document,
+            'note': f.note,
+            'working_hours': f.working_hours,
+            'type': f.type_name,
+            'owning_type': f.owning_type_name,
+            'covering_type': f.covering_type_name,
+            'paying_type': f.paying_type_names,
+            'age': f.age_names,
+            'photo': [{'id': p.id, 'url': p.url, 'filename': p.filename} for p in f.photo],
+        }
+
+    @staticmethod
+    async def _select_by_id(session: AsyncSession, pk: FACILITY_PK_TYPE, reload: bool = False) -> Facility | None:
+        """
+        Объект со всеми связями для FacilityServiceModel. reload=True перечитывает объект,
+        уже загруженный в сессию (например, после commit).
+        """
+        stmt = sa.select(Facility).where(Facility.id == pk).options(*FACILITY_FULL_LOAD)
+        if reload:
+            stmt = stmt.execution_options(populate_existing=True)
+        return (await session.execute(stmt)).scalar()
+
+    @facility_categories.retry_missing
     async def create(self, facility_create_data: FacilityCreateServiceModel) -> FacilityServiceModel:
         """
         :raise FacilityAlreadyExistsServiceException:
@@ -79,179 +275,427 @@ class FacilityService:
             try:
                 session.add(created_facility)
                 await session.commit()
-                await session.refresh(created_facility)
-            except IntegrityError:
+                created_facility = await FacilityService._select_by_id(session, created_facility.id, reload=True)
+            except IntegrityError as err:
+                if facility_categories.is_missing(err):
+                    raise
                 raise FacilityAlreadyExistsServiceException("Такой спортивный объект уже существует.")
+            finally:
+                await facility_data_version.bump(self.async_session)
         return FacilityServiceModel.model_validate(created_facility)
 
-    async def put(self, pk: FACILITY_PK_TYPE, facility_put_data: FacilityPutServiceModel) -> FacilityServiceModel:
+    @staticmethod
+    def _photo_json():
+        """Фото объекта JSON-массивом в формате FacilityResponse, для RETURNING без отдельного запроса."""
+        photo = sa.func.json_build_object(
+            'id', FacilityPhoto.id, 'url', FacilityPhoto.url, 'filename', FacilityPhoto.filename
+        )
+        return sa.type_coerce(
+            sa.select(sa.func.coalesce(sa.func.json_agg(photo), sa.text("'[]'::json")))
+            .select_from(FacilityPhoto.__table__.join(facility_facility_photo_association_table))
+            .where(facility_facility_photo_association_table.c.facility == Facility.__table__.c.id)
+            .scalar_subquery(),
+            sa.JSON
+        )
+
+    @staticmethod
+    async def _raise_not_written(session: AsyncSession, pk: FACILITY_PK_TYPE, version: int | None):
         """
+        UPDATE/DELETE с условием на версию не нашел строку: объекта нет или его версия другая.
+
         :raise FacilityNotFoundServiceException:
-        :param pk:
-        :param facility_put_data:
-        :return:
+        :raise FacilityVersionMismatchServiceException:
         """
-        facility_data = facility_put_data.model_dump()
+        if version is not None and (await session.execute(sa.select(Facility.id).where(Facility.id == pk))).first():
+            raise FacilityVersionMismatchServiceException(
+                "Спортивный объект был изменен, получите его заново и повторите изменение."
+            )
+        raise FacilityNotFoundServiceException("Такого спортивного объекта не существует.")
 
-        async with self.async_session() as session:
-            session: AsyncSession
-            selected_facility: Facility = (await session.execute(sa.select(Facility).where(Facility.id == pk))).scalar()
-            if selected_facility is None:
-                raise FacilityNotFoundServiceException("Такого спортивного объекта не существует.")
+    @facility_categories.retry_missing
+    async def _update(self, pk: FACILITY_PK_TYPE, facility_data: dict, version: int | None) -> dict:
+        """
+        Изменяет поля `facility_data` одним UPDATE ... RETURNING, связи paying_type и age переписываются
+        в той же транзакции. Если передана `version`, объект изменяется, только если его версия не менялась.
 
-            facility_data = await FacilityService._transform_facility_data(facility_data, session)
+        :return: объект в формате FacilityResponse
+        """
+        table = Facility.__table__
+        values = {}
+        for k, v in facility_data.items():
+            values[FacilityService.CATEGORY_COLUMNS.get(k, k)] = v
+        if 'working_hours' in facility_data:
+            values['open_minutes'] = working_hours_to_week_minutes(facility_data['working_hours'])
 
-            for k, v in facility_data.items():
-                setattr(selected_facility, k, v)
+        stmt = sa.update(table).where(table.c.id == pk).values(**values, version=table.c.version + 1).returning(
+            *[table.c[c] for c in FacilityService.RESPONSE_COLUMN_FIELDS.values()],
+            FacilityService._photo_json()
+        )
+        if version is not None:
+            stmt = stmt.where(table.c.version == version)
 
+        async with self.async_session() as session:
+            session: AsyncSession
             try:
+                # типы создаются, если их еще нет, иначе запросов в бд нет
+                await facility_categories.resolve(session, FacilityService._category_names([facility_data]))
+                row = (await session.execute(stmt)).first()
+                if row is None:
+                    await FacilityService._raise_not_written(session, pk, version)
+                for k, (association, column) in FacilityService.CATEGORY_ASSOCIATIONS.items():
+                    names = facility_data.get(k)
+                    if names is None:
+                        continue
+                    await session.execute(sa.delete(association).where(association.c.facility == pk))
+                    if names:
+                        await session.execute(
+                            sa.insert(association).values([{'facility': pk, column: n} for n in names])
+                        )
                 await session.commit()
-                await session.refresh(selected_facility)
-            except IntegrityError:
+            except IntegrityError as err:
+                if facility_categories.is_missing(err):
+                    raise
                 raise FacilityAlreadyExistsServiceException("Такой спортивный объект уже существует.")
-        return FacilityServiceModel.model_validate(selected_facility)
+            finally:
+                await facility_data_version.bump(self.async_session)
+
+        facility = dict(zip(FacilityService.RESPONSE_COLUMN_FIELDS, row))
+        facility['photo'] = row[-1]
+        return facility
 
-    async def patch(self, pk: FACILITY_PK_TYPE, facility_patch_data: FacilityPatchServiceModel) -> FacilityServiceModel:
+    async def put(
+            self, pk: FACILITY_PK_TYPE, facility_put_data: FacilityPutServiceModel, version: int | None = None
+    ) -> dict:
         """
+        Заменяет объект целиком одним UPDATE (см. `_update`).
+
         :raise FacilityNotFoundServiceException:
-        :param pk:
-        :param facility_patch_data:
-        :return:
+        :raise FacilityAlreadyExistsServiceException:
+        :raise FacilityVersionMismatchServiceException: если передана `version`, а объект уже изменен
+        :return: объект в формате FacilityResponse
+        """
+        return await self._update(pk, facility_put_data.model_dump(), version)
+
+    async def patch(
+            self, pk: FACILITY_PK_TYPE, facility_patch_data: FacilityPatchServiceModel, version: int | None = None
+    ) -> dict:
         """
+        Изменяет переданные поля одним UPDATE (см. `_update`).
+
+        :raise FacilityNotFoundServiceException:
+        :raise FacilityAlreadyExistsServiceException:
+        :raise FacilityVersionMismatchServiceException: если передана `version`, а объект уже изменен
+        :return: объект в формате FacilityResponse
+        """
+        facility_data = {k: getattr(facility_patch_data, k) for k in facility_patch_data.model_fields_set}
+        return await self._update(pk, facility_data, version)
+
+    @facility_categories.retry_missing
+    async def bulk(
+            self,
+            facilities_create_data: list[FacilityCreateServiceModel],
+            facilities_patch_data: list[tuple[FACILITY_PK_TYPE, FacilityPatchServiceModel]]
+    ) -> (list[FacilityBulkItemServiceModel], list[FacilityBulkItemServiceModel]):
+        """
+        Создает и изменяет объекты одной транзакцией. Изменяемые объекты и уже существующие объекты
+        с такими же названием, адресом, пользователем, площадью и типом выбираются одним запросом, типы
+        разрешаются за один проход, изменения выполняются пакетами (см. `_update_many`), а вставка -
+        при commit.
+
+        Объекты, которых нет, и дубликаты (в бд или внутри запроса) не записываются и возвращаются
+        со статусом error, остальные записываются. В patch, как и в `patch`, None означает "не изменять".
+
+        :raise FacilityAlreadyExistsServiceException: если дубликат не удалось найти заранее (например, он
+            появился параллельно с запросом или объекты запроса меняются ключами), ничего не записывается
+        :return: результаты созданий и изменений в порядке входных списков
+        """
+        created = [FacilityBulkItemServiceModel(status='created') for _ in facilities_create_data]
+        updated = [
+            FacilityBulkItemServiceModel(status='updated', id=pk) for pk, _ in facilities_patch_data
+        ]
+
+        def unique_key(facility_data: dict) -> tuple:
+            return tuple(facility_data[k] for k in ('name', 'address', 'owner', 'area', 'type'))
+
         async with self.async_session() as session:
             session: AsyncSession
-            selected_facility: Facility = (await session.execute(sa.select(Facility).where(Facility.id == pk))).scalar()
-            if selected_facility is None:
-                raise FacilityNotFoundServiceException("Такого спортивного объекта не существует.")
-            for k in facility_patch_data.model_fields_set:
-                v = getattr(facility_patch_data, k)
-                v: Any
-                if k == 'type':
-                    v = await FacilityType.get_or_create(session, v)
-                if k == 'owning_type':
-                    v = await FacilityOwningType.get_or_create(session, v)
-                if k == 'covering_type':
-                    v = await FacilityCoveringType.get_or_create(session, v)
-                if k == 'paying_type':
-                    v: list[str]
-                    pts = []
-                    for pt in v:
-                        ppt = await FacilityPayingType.get_or_create(session, pt)
-                        pts.append(ppt)
-                    v = pts
-                if k == "age":
-                    v: list[str]
-                    pts = []
-                    for pt in v:
-                        ppt = await FacilityAge.get_or_create(session, pt)
-                        pts.append(ppt)
-                    v = pts
-                setattr(selected_facility, k, v)
+            update_ids = {pk for pk, _ in facilities_patch_data}
+            selected_facilities = {}
+            if update_ids:
+                stmt = sa.select(
+                    Facility.id, Facility.version, Facility.name, Facility.address, Facility.owner, Facility.area,
+                    Facility.type_name
+                ).where(Facility.id.in_(update_ids))
+                selected_facilities = {f.id: f for f in await session.execute(stmt)}
+
+            # (результат, изменяемый объект или None, данные, уникальный ключ), изменения проверяются первыми
+            items = []
+            # объекты, у которых меняется уникальный ключ: их прежний ключ освобождается
+            moving_ids = set()
+            for result, (pk, facility_patch_data) in zip(updated, facilities_patch_data):
+                selected_facility = selected_facilities.get(pk)
+                if selected_facility is None:
+                    result.status, result.message = 'error', "Такого спортивного объекта не существует."
+                    continue
+                facility_data = {
+                    k: v for k in facility_patch_data.model_fields_set
+                    if (v := getattr(facility_patch_data, k)) is not None
+                }
+                current_data = {
+                    'name': selected_facility.name,
+                    'address': selected_facility.address,
+                    'owner': selected_facility.owner,
+                    'area': selected_facility.area,
+                    'type': selected_facility.type_name,
+                }
+                key = unique_key({**current_data, **facility_data})
+                if key != unique_key(current_data):
+                    moving_ids.add(pk)
+                items.append((result, selected_facility, facility_data, key))
+            for result, facility_create_data in zip(created, facilities_create_data):
+                facility_data = facility_create_data.model_dump()
+                items.append((result, None, facility_data, unique_key(facility_data)))
+
+            existing = {}
+            if items:
+                key_columns = (Facility.name, Facility.address, Facility.owner, Facility.area, Facility.type_name)
+                stmt = sa.select(Facility.id, *key_columns).where(
+                    sa.tuple_(*key_columns).in_([key for *_, key in items])
+                )
+                existing = {tuple(row[1:]): row.id for row in await session.execute(stmt)}
+
+            seen = set()
+            valid_items = []
+            for result, selected_facility, facility_data, key in items:
+                existing_id = existing.get(key)
+                own_id = None if selected_facility is None else selected_facility.id
+                if key in seen or (existing_id not in (None, own_id) and existing_id not in moving_ids):
+                    result.status, result.message = 'error', "Такой спортивный объект уже существует."
+                    continue
+                seen.add(key)
+                valid_items.append((result, selected_facility, facility_data))
+
+            if not valid_items:
+                return created, updated
             try:
+                categories = await facility_categories.resolve(
+                    session, FacilityService._category_names([facility_data for *_, facility_data in valid_items])
+                )
+                # изменения до добавления новых объектов: UPDATE вызывает flush сессии, а ключи, которые
+                # освобождают изменяемые объекты, должны освободиться до вставки
+                update_data = {}
+                for _, selected_facility, facility_data in valid_items:
+                    if selected_facility is not None:
+                        version, data = update_data.get(selected_facility.id, (selected_facility.version, {}))
+                        update_data[selected_facility.id] = (version, {**data, **facility_data})
+                await FacilityService._update_many(session, [(pk, *v) for pk, v in update_data.items()])
+                for result, selected_facility, facility_data in valid_items:
+                    if selected_facility is None:
+                        created_facility = Facility(
+                            id=uuid.uuid4(), **FacilityService._with_categories(facility_data, categories)
+                        )
+                        session.add(created_facility)
+                        result.id = created_facility.id
                 await session.commit()
-                await session.refresh(selected_facility)
-            except IntegrityError:
+            except IntegrityError as err:
+                if facility_categories.is_missing(err):
+                    raise
                 raise FacilityAlreadyExistsServiceException("Такой спортивный объект уже существует.")
-        return FacilityServiceModel.model_validate(selected_facility)
+            finally:
+                await facility_data_version.bump(self.async_session)
+        return created, updated
 
-    async def delete(self, pk: FACILITY_PK_TYPE):
+    @staticmethod
+    async def _update_many(session: AsyncSession, updates: list[tuple[FACILITY_PK_TYPE, int, dict]]):
         """
+        Изменяет объекты (id, версия, поля как в `_update`) без ORM: объекты с одинаковым набором полей -
+        одним UPDATE ... FROM (VALUES ...) с условием на версию каждого объекта, связи paying_type и age
+        переписываются одним DELETE и одним INSERT на таблицу.
+
+        :raise FacilityVersionMismatchServiceException: если какой-то объект уже изменен
+        """
+        table = Facility.__table__
+        groups = {}
+        for pk, version, facility_data in updates:
+            if not facility_data:
+                continue
+            values = {FacilityService.CATEGORY_COLUMNS.get(k, k): v for k, v in facility_data.items()}
+            if 'working_hours' in facility_data:
+                values['open_minutes'] = working_hours_to_week_minutes(facility_data['working_hours'])
+            columns = ('id', 'version', *sorted(values))
+            groups.setdefault(columns, []).append(tuple({'id': pk, 'version': version, **values}[c] for c in columns))
+
+        for columns, rows in groups.items():
+            data = sa.values(*(sa.column(c, table.c[c].type) for c in columns), name='data').data(rows)
+            stmt = sa.update(table).where(table.c.id == data.c.id, table.c.version == data.c.version).values(
+                {**{c: data.c[c] for c in columns[2:]}, 'version': table.c.version + 1}
+            ).returning(table.c.id)
+            if len((await session.execute(stmt)).all()) != len(rows):
+                raise FacilityVersionMismatchServiceException(
+                    "Спортивный объект был изменен параллельно с запросом, повторите изменение."
+                )
+
+        for k, (association, column) in FacilityService.CATEGORY_ASSOCIATIONS.items():
+            changed = [(pk, facility_data[k]) for pk, _, facility_data in updates if facility_data.get(k) is not None]
+            if not changed:
+                continue
+            await session.execute(sa.delete(association).where(association.c.facility.in_([pk for pk, _ in changed])))
+            links = [{'facility': pk, column: n} for pk, names in changed for n in names]
+            if links:
+                await session.execute(sa.insert(association), links)
+
+    async def delete(self, pk: FACILITY_PK_TYPE, version: int | None = None):
+        """
+        Удаляет объект одним DELETE, связи удаляются каскадом.
+
         :raise FacilityNotFoundServiceException:
+        :raise FacilityVersionMismatchServiceException: если передана `version`, а объект уже изменен
         :param pk:
         :return:
         """
+        table = Facility.__table__
+        stmt = sa.delete(table).where(table.c.id == pk).returning(table.c.id)
+        if version is not None:
+            stmt = stmt.where(table.c.version == version)
         async with self.async_session() as session:
             session: AsyncSession
-            selected_facility = (await session.execute(sa.select(Facility).where(Facility.id == pk))).scalar()
-            if selected_facility is None:
-                raise FacilityNotFoundServiceException("Такого спортивного объекта не существует.")
-            await session.delete(selected_facility)
+            if (await session.execute(stmt)).first() is None:
+                await FacilityService._raise_not_written(session, pk, version)
             await session.commit()
+            await facility_data_version.bump(self.async_session)
 
-    async def get_by_id(self, pk: FACILITY_PK_TYPE) -> FacilityServiceModel:
+    async def get_by_id(
+            self, pk: FACILITY_PK_TYPE, as_dict: bool = False, fields: list[str] | None = None
+    ) -> FacilityServiceModel | dict:
         """
+        `as_dict` и `fields` - как в `search`.
+
         :raise FacilityNotFoundServiceException:
+        :raise FacilityFieldsServiceException:
         :param pk:
         :return:
         """
         async with self.async_session() as session:
             session: AsyncSession
-            selected_facility = (await session.execute(sa.select(Facility).where(Facility.id == pk))).scalar()
+            if as_dict:
+                stmt = sa.select(Facility).where(Facility.id == pk).options(
+                    *FacilityService._projection_options(fields)
+                )
+                selected_facility = (await session.execute(stmt)).scalar()
+            else:
+                selected_facility = await FacilityService._select_by_id(session, pk)
             if selected_facility is None:
                 raise FacilityNotFoundServiceException("Такого спортивного объекта не существует.")
+        if as_dict:
+            return FacilityService.facility_to_dict(selected_facility, fields)
         return FacilityServiceModel.model_validate(selected_facility)
 
-    async def search(
-            self,
-            all: bool,
-            q: str,
-            limit: int,
-            offset: int,
-            order_by: str,
-            order_desc: bool,
+    @staticmethod
+    def _search_tsquery(q: str | None):
+        """
+        Превращает строку поиска в tsquery: каждое слово после стемминга ищется как префикс,
+        слова объединяются через И. Возвращает None, если в строке нет слов.
+        """
+        if q is None:
+            return None
+        words = re.findall(r'[^\W_]+', q)
+        if len(words) == 0:
+            return None
+        return sa.func.to_tsquery(
+            sa.cast(FACILITY_SEARCH_CONFIG, postgresql.REGCONFIG),
+            ' & '.join(f'{w}:*' for w in words)
+        )
 
-            hidden: bool,
+    @staticmethod
+    def _search_substring(q: str):
+        """Поиск подстроки `q` в текстовых полях объекта, как до полнотекстового поиска."""
+        return sa.or_(
+            Facility.name.icontains(q, autoescape=True),
+            Facility.address.icontains(q, autoescape=True),
+            Facility.owner.icontains(q, autoescape=True),
+            Facility.type_name.icontains(q, autoescape=True),
+        )
 
-            type: list[str],
-            owning_type: list[str],
-            covering_type: list[str],
-            paying_type: list[str],
-            age: list[str],
+    @staticmethod
+    def _location(x: float, y: float):
+        """Точка (`x`, `y`) в координатах колонки `Facility.location`."""
+        return sa.func.point(y * FACILITY_METRES_PER_DEGREE_LON, x * FACILITY_METRES_PER_DEGREE_LAT)
 
-            filters: list[dict],
+    @staticmethod
+    def _distance(x: float, y: float):
+        """Расстояние в метрах от объекта до точки (`x`, `y`), считается по gist индексу `location`."""
+        return Facility.location.op('<->', return_type=sa.Float)(FacilityService._location(x, y))
+
+    @staticmethod
+    def _search_conditions(
+            q: str | None,
+            hidden: bool | None,
+            type: list[str] | None,
+            owning_type: list[str] | None,
+            covering_type: list[str] | None,
+            paying_type: list[str] | None,
+            age: list[str] | None,
+            filters: list[dict] | None,
             x: float | None = None,
-            y: float | None = None
-    ) -> (int, list[FacilityServiceModel]):
-        stmt = sa.select(Facility)
-        stmt_count = sa.select(sa.func.count()).select_from(Facility)
+            y: float | None = None,
+            radius: float | None = None,
+            nearest: int | None = None,
+            open_at: int | None = None
+    ) -> list:
+        """
+        Собирает условия WHERE для поиска один раз, чтобы их можно было
+        переиспользовать и в выборке, и в подсчете.
+
+        Если переданы `x` и `y`, ищутся объекты в радиусе `radius` метров от точки,
+        а без `radius` и `nearest` - объекты в точке (с точностью 0.001 градуса).
+
+        `open_at` - минута недели (от понедельника 00:00), в которую объект должен работать.
+        """
+        conditions = []
 
         epsilon = 1 / 1000
 
         if x is not None and y is not None:
-            stmt = stmt \
-                .where(Facility.x >= x - epsilon).where(Facility.x <= x + epsilon) \
-                .where(Facility.y >= y - epsilon).where(Facility.y <= y + epsilon)
-            stmt_count = stmt_count \
-                .where(Facility.x >= x - epsilon).where(Facility.x <= x + epsilon) \
-                .where(Facility.y >= y - epsilon).where(Facility.y <= y + epsilon)
-
-        if q is not None:
-            stmt = stmt.where(sa.or_(
-                Facility.name.icontains(q, autoescape=True),
-                Facility.address.icontains(q, autoescape=True),
-                Facility.owner.icontains(q, autoescape=True),
-                Facility.type_name.icontains(q, autoescape=True),
-            ))
-            stmt_count = stmt_count.where(sa.or_(
-                Facility.name.icontains(q, autoescape=True),
-                Facility.address.icontains(q, autoescape=True),
-                Facility.owner.icontains(q, autoescape=True),
-                Facility.type_name.icontains(q, autoescape=True),
+            if radius is not None:
+                area = sa.func.circle(FacilityService._location(x, y), radius)
+                conditions.append(Facility.location.bool_op('<@')(area))
+            elif nearest is None:
+                area = sa.func.box(
+                    FacilityService._location(x - epsilon, y - epsilon),
+                    FacilityService._location(x + epsilon, y + epsilon)
+                )
+                conditions.append(Facility.location.bool_op('<@')(area))
+
+        tsquery = FacilityService._search_tsquery(q)
+        if tsquery is not None:
+            conditions.append(sa.or_(
+                Facility.search_vector.bool_op('@@')(tsquery),
+                # строка только из стоп-слов дает пустой tsquery, для нее, как раньше, ищется подстрока.
+                # numnode вычисляется при планировании запроса, поэтому обычный поиск идет по индексу
+                sa.and_(sa.func.numnode(tsquery) == 0, FacilityService._search_substring(q))
             ))
+        elif q is not None and q.strip():
+            # в строке нет слов (например, только знаки препинания) - тоже ищется подстрока
+            conditions.append(FacilityService._search_substring(q))
 
         if hidden is not None:
-            stmt = stmt.where(Facility.hidden == hidden)
-            stmt_count = stmt_count.where(Facility.hidden == hidden)
+            conditions.append(Facility.hidden == hidden)
 
         if type is not None and len(type) > 0:
-            stmt = stmt.where(Facility.type_name.in_(type))
-            stmt_count = stmt_count.where(Facility.type_name.in_(type))
+            conditions.append(Facility.type_name.in_(type))
         if owning_type is not None and len(owning_type) > 0:
-            stmt = stmt.where(Facility.owning_type_name.in_(owning_type))
-            stmt_count = stmt_count.where(Facility.owning_type_name.in_(owning_type))
+            conditions.append(Facility.owning_type_name.in_(owning_type))
         if covering_type is not None and len(covering_type) > 0:
-            stmt = stmt.where(Facility.covering_type_name.in_(covering_type))
-            stmt_count = stmt_count.where(Facility.covering_type_name.in_(covering_type))
+            conditions.append(Facility.covering_type_name.in_(covering_type))
 
         if paying_type:
-            if len(paying_type) > 0:
-                stmt = stmt.where(Facility.paying_type.any(FacilityPayingType.name.in_(paying_type)))
-                stmt_count = stmt_count.where(Facility.paying_type.any(FacilityPayingType.name.in_(paying_type)))
+            conditions.append(Facility.paying_type_names.overlap(paying_type))
 
         if age:
-            if len(age) > 0:
-                stmt = stmt.where(Facility.age.any(FacilityAge.name.in_(age)))
-                stmt_count = stmt_count.where(Facility.age.any(FacilityAge.name.in_(age)))
+            conditions.append(Facility.age_names.overlap(age))
+
+        if open_at is not None:
+            conditions.append(Facility.open_minutes.contains(sa.literal(open_at)))
 
         if filters is not None:
             for f in filters:
@@ -259,35 +703,473 @@ class FacilityService:
                 eq = f.get('eq')
                 lt = f.get('lt')
                 gt = f.get('gt')
-                conditions = []
                 if eq is not None:
                     conditions.append(getattr(Facility, field) == eq)
                 if lt is not None:
                     conditions.append(getattr(Facility, field) <= lt)
                 if gt is not None:
                     conditions.append(getattr(Facility, field) >= gt)
-                stmt = stmt.where(sa.and_(*conditions))
-                stmt_count = stmt_count.where(sa.and_(*conditions))
 
-        if order_by in ['created_at', 'type', 'area', 'actual_workload', 'eps', 'annual_capacity']:
-            if order_by == 'type':
-                order_by = f"{order_by}_name"
+        return conditions
+
+    @staticmethod
+    def _sort_expression(
+            order_by: str | None,
+            q: str | None,
+            x: float | None = None,
+            y: float | None = None
+    ) -> (str, Any, bool):
+        """
+        Возвращает (название сортировки, выражение сортировки, может ли выражение быть NULL).
+
+        `relevance` сортирует по рангу полнотекстового поиска (сначала наиболее релевантные)
+        и имеет смысл только вместе с `q`. `distance` сортирует по расстоянию до (`x`, `y`)
+        и имеет смысл только вместе с ними. Неизвестная сортировка, как и раньше, становится сортировкой
+        по названию.
+        """
+        if order_by == 'distance' and x is not None and y is not None:
+            # объекты без координат в сортировку по расстоянию не попадают (см. search)
+            return order_by, FacilityService._distance(x, y), False
+        if order_by == 'relevance':
+            tsquery = FacilityService._search_tsquery(q)
+            if tsquery is not None:
+                return order_by, -sa.func.ts_rank(Facility.search_vector, tsquery, type_=sa.REAL), False
+        if order_by not in FacilityService.ORDER_BY_FIELDS:
+            order_by = 'name'
+        column = FacilityService.ORDER_BY_FIELDS[order_by]
+        return order_by, column, column.nullable
+
+    @staticmethod
+    def _encode_cursor(order_by: str, order_desc: bool, value: Any, pk: FACILITY_PK_TYPE) -> str:
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        data = json.dumps([order_by, order_desc, value, str(pk)]).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str, order_by: str, order_desc: bool, sort_expression) -> (Any, FACILITY_PK_TYPE):
+        """
+        :raise FacilitySearchCursorServiceException:
+        :param cursor:
+        :param order_by:
+        :param order_desc:
+        :param sort_expression:
+        :return:
+        """
+        try:
+            cursor_order_by, cursor_order_desc, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            pk = uuid.UUID(pk)
+            if value is not None:
+                if isinstance(sort_expression.type, sa.DateTime):
+                    value = datetime.datetime.fromisoformat(value)
+                elif isinstance(sort_expression.type, sa.String):
+                    if not isinstance(value, str):
+                        raise ValueError(value)
+                elif not isinstance(value, (int, float)) or isinstance(value, bool):
+                    raise ValueError(value)
+        except (ValueError, TypeError):
+            raise FacilitySearchCursorServiceException("Некорректный курсор.")
+        if cursor_order_by != order_by or cursor_order_desc != order_desc:
+            raise FacilitySearchCursorServiceException("Курсор не соответствует сортировке запроса.")
+        return value, pk
+
+    @staticmethod
+    def _keyset_order_by(sort_expression, nullable: bool, order_desc: bool) -> list:
+        """
+        Сортировка по (`sort_expression`, id). Для nullable полей NULL-ы идут первым ключом, так же,
+        как их упорядочивает postgres по умолчанию (в конце при ASC, в начале при DESC).
+        """
+        keys = [sort_expression.is_(None)] if nullable else []
+        keys += [sort_expression, Facility.id]
+        if order_desc:
+            return [sa.desc(k) for k in keys]
+        return keys
+
+    @staticmethod
+    def _keyset_condition(sort_expression, nullable: bool, order_desc: bool, value: Any, pk: FACILITY_PK_TYPE):
+        """
+        Условие "строго после (`value`, `pk`)" в порядке `_keyset_order_by`,
+        записанное сравнением строк, чтобы postgres мог начать скан индекса с нужного места.
+        """
+        pk = sa.literal(pk, Facility.id.type)
+        if nullable and value is None:
+            left = sa.tuple_(sort_expression.is_(None), Facility.id)
+            right = sa.tuple_(sa.true(), pk)
+        else:
+            value = sa.literal(value, sort_expression.type)
+            if nullable:
+                left = sa.tuple_(sort_expression.is_(None), sort_expression, Facility.id)
+                right = sa.tuple_(sa.false(), value, pk)
+            else:
+                left = sa.tuple_(sort_expression, Facility.id)
+                right = sa.tuple_(value, pk)
+        if order_desc:
+            return left < right
+        return left > right
+
+    @staticmethod
+    def _search_statement(
+            all: bool,
+            q: str,
+            limit: int,
+            offset: int,
+            order_by: str,
+            order_desc: bool,
+            hidden: bool,
+            type: list[str],
+            owning_type: list[str],
+            covering_type: list[str],
+            paying_type: list[str],
+            age: list[str],
+            filters: list[dict],
+            x: float | None,
+            y: float | None,
+            cursor: str | None,
+            radius: float | None,
+            nearest: int | None,
+            open_at: int | None,
+            with_count: bool,
+            options: tuple
+    ) -> tuple:
+        """
+        Запрос поиска (см. `search`). Возвращает запрос, его условия и итоговые
+        (order_by, order_desc, all, limit, nearest) с учетом поиска ближайших.
+
+        :raise FacilitySearchCursorServiceException:
+        """
+        conditions = FacilityService._search_conditions(
+            q, hidden, type, owning_type, covering_type, paying_type, age, filters, x, y, radius, nearest, open_at
+        )
+
+        if nearest is not None and x is not None and y is not None:
+            order_by = 'distance'
+            all = False
+            limit = nearest if limit is None else min(limit, nearest)
         else:
-            order_by = "name"
-        if order_desc is not None and order_desc is True:
-            stmt = stmt.order_by(sa.desc(order_by))
+            nearest = None
+
+        order_by, sort_expression, nullable = FacilityService._sort_expression(order_by, q, x, y)
+        order_desc = order_desc is True
+        if order_by == 'distance':
+            conditions.append(Facility.location.is_not(None))
+
+        if cursor is not None:
+            value, pk = FacilityService._decode_cursor(cursor, order_by, order_desc, sort_expression)
+            conditions.append(FacilityService._keyset_condition(sort_expression, nullable, order_desc, value, pk))
+        if with_count and cursor is None and nearest is None:
+            stmt = sa.select(Facility, sort_expression.label('sort_key'), sa.func.count().over().label('total_count'))
+        else:
+            stmt = sa.select(Facility, sort_expression.label('sort_key'))
+
+        stmt = stmt.where(*conditions).options(*options)
+        if nearest is not None:
+            # без дополнительных ключей сортировки postgres обходит gist индекс по расстоянию (KNN)
+            # и останавливается после `limit` объектов
+            stmt = stmt.order_by(sort_expression)
         else:
-            stmt = stmt.order_by(order_by)
+            stmt = stmt.order_by(*FacilityService._keyset_order_by(sort_expression, nullable, order_desc))
 
         if not all:
             if limit is not None:
                 stmt = stmt.limit(limit)
-            if offset is not None:
+            if offset is not None and cursor is None:
                 stmt = stmt.offset(offset)
 
+        return stmt, conditions, order_by, order_desc, all, limit, nearest
+
+    async def search(
+            self,
+            all: bool,
+            q: str,
+            limit: int,
+            offset: int,
+            order_by: str,
+            order_desc: bool,
+
+            hidden: bool,
+
+            type: list[str],
+            owning_type: list[str],
+            covering_type: list[str],
+            paying_type: list[str],
+            age: list[str],
+
+            filters: list[dict],
+            x: float | None = None,
+            y: float | None = None,
+            cursor: str | None = None,
+            radius: float | None = None,
+            nearest: int | None = None,
+            open_at: int | None = None,
+            as_dict: bool = False,
+            fields: list[str] | None = None
+    ) -> (int | None, list[FacilityServiceModel] | list[dict], str | None):
+        """
+        Возвращает общее количество подходящих объектов, страницу объектов и курсор следующей страницы.
+
+        Общее количество считается оконной функцией в том же запросе, что и страница,
+        поэтому обычно поиск делает один запрос в бд. Отдельный COUNT выполняется, только
+        если страница оказалась пустой из-за `offset` за пределами выборки.
+
+        Если передан `cursor`, страница выбирается по ключу (`order_by`, id) после курсора, `offset`
+        игнорируется, а общее количество не считается (возвращается None), чтобы стоимость
+        глубоких страниц не зависела от их номера. Курсор следующей страницы возвращается,
+        когда страница заполнена целиком.
+
+        `q` ищется полнотекстовым поиском по названию, типу, адресу и пользователю
+        (по префиксам слов, с русским стеммингом), `order_by='relevance'` сортирует по рангу.
+
+        `radius` ограничивает поиск объектами в радиусе `radius` метров от (`x`, `y`),
+        `nearest` возвращает не более `nearest` ближайших к (`x`, `y`) объектов. Для ближайших
+        объектов общее количество не считается оконной функцией (это помешало бы postgres остановить
+        обход gist индекса), а равно количеству найденных.
+
+        `open_at` оставляет объекты, работающие в заданную минуту недели (от понедельника 00:00),
+        по gist индексу часов работы.
+
+        `as_dict=True` возвращает объекты словарями в формате ответа API (см. `facility_to_dict`) без валидации,
+        `fields` оставляет в них только перечисленные поля, из бд при этом читаются только нужные колонки и связи.
+
+        :raise FacilitySearchCursorServiceException:
+        :raise FacilityFieldsServiceException:
+        """
+        stmt, conditions, order_by, order_desc, all, limit, nearest = FacilityService._search_statement(
+            all, q, limit, offset, order_by, order_desc, hidden, type, owning_type, covering_type, paying_type, age,
+            filters, x, y, cursor, radius, nearest, open_at,
+            with_count=True, options=FacilityService._projection_options(fields) if as_dict else FACILITY_FULL_LOAD
+        )
+
+        async with self.async_session() as session:
+            session: AsyncSession
+            rows = (await session.execute(stmt)).all()
+            if cursor is not None:
+                count = None
+            elif nearest is not None:
+                count = len(rows)
+            elif len(rows) > 0:
+                count = rows[0].total_count
+            elif not all and offset:
+                stmt_count = sa.select(sa.func.count()).select_from(Facility).where(*conditions)
+                count = (await session.execute(stmt_count)).scalar()
+            else:
+                count = 0
+
+        next_cursor = None
+        if not all and nearest is None and limit is not None and len(rows) == limit and limit > 0:
+            last = rows[-1]
+            next_cursor = FacilityService._encode_cursor(order_by, order_desc, last.sort_key, last.Facility.id)
+
+        if as_dict:
+            return count, [FacilityService.facility_to_dict(row.Facility, fields) for row in rows], next_cursor
+        return count, [FacilityServiceModel.model_validate(row.Facility) for row in rows], next_cursor
+
+    def search_stream(
+            self,
+            all: bool,
+            q: str,
+            limit: int,
+            offset: int,
+            order_by: str,
+            order_desc: bool,
+
+            hidden: bool,
+
+            type: list[str],
+            owning_type: list[str],
+            covering_type: list[str],
+            paying_type: list[str],
+            age: list[str],
+
+            filters: list[dict],
+            x: float | None = None,
+            y: float | None = None,
+            cursor: str | None = None,
+            radius: float | None = None,
+            nearest: int | None = None,
+            open_at: int | None = None,
+            fields: list[str] | None = None,
+            chunk_size: int = SEARCH_STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Поиск как в `search(as_dict=True)`, но объекты читаются из бд серверным курсором частями
+        по `chunk_size` и отдаются по мере чтения, поэтому память не зависит от размера выборки.
+        Общее количество и курсор следующей страницы не считаются.
+
+        Запрос строится сразу, поэтому ошибки в параметрах выбрасываются при вызове, а не при чтении.
+
+        :raise FacilitySearchCursorServiceException:
+        :raise FacilityFieldsServiceException:
+        """
+        stmt, *_ = FacilityService._search_statement(
+            all, q, limit, offset, order_by, order_desc, hidden, type, owning_type, covering_type, paying_type, age,
+            filters, x, y, cursor, radius, nearest, open_at,
+            with_count=False, options=FacilityService._projection_options(fields)
+        )
+        return self._stream_facility_dicts(stmt.execution_options(yield_per=chunk_size), fields)
+
+    async def _stream_facility_dicts(self, stmt, fields: list[str] | None) -> AsyncIterator[list[dict]]:
+        async with self.async_session() as session:
+            session: AsyncSession
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                # сессия хранит объекты по слабым ссылкам, отданные части освобождаются сразу
+                yield [FacilityService.facility_to_dict(row.Facility, fields) for row in rows]
+
+    async def clusters(
+            self,
+            x_min: float,
+            y_min: float,
+            x_max: float,
+            y_max: float,
+            zoom: int,
+
+            hidden: bool | None,
+
+            type: list[str],
+            owning_type: list[str],
+            covering_type: list[str],
+            paying_type: list[str],
+            age: list[str]
+    ) -> list[FacilityClusterServiceModel]:
+        """
+        Группирует объекты в прямоугольнике (`x_min`, `y_min`) - (`x_max`, `y_max`) по ячейкам
+        предвычисленной сетки (`Facility.grid_column`, `Facility.grid_row`) для зума карты `zoom`
+        и возвращает для каждой ячейки количество объектов и их центр.
+
+        Без `hidden`, как и в `markers`, учитываются только видимые объекты.
+        """
+        if hidden is None:
+            hidden = False
+        level = max(0, min(zoom + FacilityService.CLUSTER_GRID_LEVEL_OFFSET, FACILITY_GRID_MAX_LEVEL))
+        shift = FACILITY_GRID_MAX_LEVEL - level
+
+        conditions = FacilityService._search_conditions(
+            None, hidden, type, owning_type, covering_type, paying_type, age, None
+        )
+        viewport = sa.func.box(FacilityService._location(x_min, y_min), FacilityService._location(x_max, y_max))
+        conditions.append(Facility.location.bool_op('<@')(viewport))
+        conditions.append(Facility.grid_column.is_not(None))
+        conditions.append(Facility.grid_row.is_not(None))
+
+        count = sa.func.count()
+        stmt = sa.select(
+            sa.func.avg(Facility.x).label('x'),
+            sa.func.avg(Facility.y).label('y'),
+            count.label('count'),
+            sa.case((count == 1, sa.func.min(sa.cast(Facility.id, sa.String)))).label('id'),
+        ).where(*conditions).group_by(
+            Facility.grid_column.op('>>')(shift),
+            Facility.grid_row.op('>>')(shift),
+        )
+
+        async with self.async_session() as session:
+            session: AsyncSession
+            rows = (await session.execute(stmt)).all()
+        return [FacilityClusterServiceModel.model_validate(row._asdict()) for row in rows]
+
+    async def markers(self) -> (str, bytes):
+        """
+        Возвращает etag и компактный json со всеми видимыми объектами, у которых есть координаты:
+        `{"types": [<тип>, ...], "markers": [[<id>, <x>, <y>, <индекс типа в types>], ...]}`.
+
+        Json собирается из колонок таблицы facility без ORM объектов и pydantic моделей и
+        перестраивается только после изменения объектов в любом воркере (см. `facility_data_version`),
+        но не реже, чем раз в MARKERS_CACHE_TTL секунд.
+        """
+        version = facility_data_version.value
+        now = time.monotonic()
+        if self._markers_cache is not None:
+            cached_version, expires_at, etag, data = self._markers_cache
+            if cached_version == version and expires_at > now:
+                return etag, data
+
+        stmt = sa.select(Facility.id, Facility.x, Facility.y, Facility.type_name).where(
+            Facility.hidden.is_(False),
+            Facility.x.is_not(None),
+            Facility.y.is_not(None),
+        ).order_by(Facility.type_name)
+
+        async with self.async_session() as session:
+            session: AsyncSession
+            rows = (await session.execute(stmt)).all()
+
+        types = {}
+        markers = []
+        for pk, x, y, type_name in rows:
+            markers.append([str(pk), x, y, types.setdefault(type_name, len(types))])
+        data = json.dumps(
+            {"types": list(types), "markers": markers}, ensure_ascii=False, separators=(',', ':')
+        ).encode()
+        etag = hashlib.md5(data).hexdigest()
+
+        self._markers_cache = (version, now + FacilityService.MARKERS_CACHE_TTL, etag, data)
+        return etag, data
+
+    async def facets(
+            self,
+            q: str,
+
+            hidden: bool,
+
+            type: list[str],
+            owning_type: list[str],
+            covering_type: list[str],
+            paying_type: list[str],
+            age: list[str],
+
+            filters: list[dict],
+            x: float | None = None,
+            y: float | None = None,
+            radius: float | None = None,
+            open_at: int | None = None
+    ) -> dict[str, dict[str, int]]:
+        """
+        Считает количество объектов для каждого значения фильтров type, owning_type, covering_type,
+        paying_type и age одним запросом. Для каждого фильтра учитываются все остальные активные фильтры,
+        кроме него самого, чтобы было видно, сколько объектов добавит выбор еще одного значения.
+        """
+        facet_filters = {
+            'type': type,
+            'owning_type': owning_type,
+            'covering_type': covering_type,
+            'paying_type': paying_type,
+            'age': age,
+        }
+
+        def conditions_without(facet: str) -> list:
+            f = {k: (None if k == facet else v) for k, v in facet_filters.items()}
+            return FacilityService._search_conditions(
+                q, hidden, f['type'], f['owning_type'], f['covering_type'], f['paying_type'], f['age'],
+                filters, x, y, radius, open_at=open_at
+            )
+
+        def by_column(facet: str, column):
+            return sa.select(
+                sa.literal(facet).label('facet'), column.label('value'), sa.func.count().label('count')
+            ).where(column.is_not(None), *conditions_without(facet)).group_by(column)
+
+        def by_array(facet: str, column):
+            names = sa.func.unnest(column).table_valued('value').render_derived()
+            return sa.select(
+                sa.literal(facet).label('facet'),
+                names.c.value.label('value'),
+                sa.func.count(sa.distinct(Facility.id)).label('count')
+            ).select_from(Facility).join(names, sa.true()) \
+                .where(*conditions_without(facet)).group_by(names.c.value)
+
+        stmt = sa.union_all(
+            by_column('type', Facility.type_name),
+            by_column('owning_type', Facility.owning_type_name),
+            by_column('covering_type', Facility.covering_type_name),
+            by_array('paying_type', Facility.paying_type_names),
+            by_array('age', Facility.age_names),
+        )
+
         async with self.async_session() as session:
             session: AsyncSession
-            facilities = (await session.execute(stmt)).scalars().all()
-            count = (await session.execute(stmt_count)).scalar()
+            rows = (await session.execute(stmt)).all()
 
-        return count, [FacilityServiceModel.model_validate(f) for f in facilities]
+        facets = {facet: {} for facet in facet_filters}
+        for facet, value, count in rows:
+            facets[facet][value] = count
+        return facets
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+import datetime
+import uuid
+
+from pydantic import BaseModel, ConfigDict, Field
 
 
 EMPTY_WORKING_HOURS = {
@@ -51,10 +54,29 @@ class FacilityExcelItemServiceModel(BaseModel):
     document: str | int | None = None
     note: str | None = None
 
-    working_hours: dict = EMPTY_WORKING_HOURS
+    # значения по умолчанию создаются фабрикой: изменяемые значения pydantic копирует через deepcopy для каждой строки
+    working_hours: dict = Field(default_factory=lambda: {day: {'open': False} for day in EMPTY_WORKING_HOURS})
 
     type: str
     owning_type: str = 'другая'
     covering_type: str | None = None
-    paying_type: list[str] = []
-    age: list[str] = []
+    paying_type: list[str] = Field(default_factory=list)
+    age: list[str] = Field(default_factory=list)
+
+
+class ExcelImportJobServiceModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: uuid.UUID
+    status: str
+    filename: str | None = None
+    size: int
+
+    processed: int
+    inserted: int
+    duplicated: int
+    failed: int
+    error: str | None = None
+
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
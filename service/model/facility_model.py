@@ -117,6 +117,7 @@ class FacilityServiceModel(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     id: uuid.UUID
+    version: int
 
     name: str
     owner: str
@@ -164,3 +165,19 @@ class FacilityServiceModel(BaseModel):
         f['paying_type'] = paying_type
         f['age'] = age
         return f
+
+
+class FacilityClusterServiceModel(BaseModel):
+    # центр кластера
+    x: float
+    y: float
+    count: int
+    # id объекта, если объект в кластере один
+    id: uuid.UUID | None = None
+
+
+class FacilityBulkItemServiceModel(BaseModel):
+    # результат одного объекта пакетного создания или изменения
+    status: str  # created, updated или error
+    id: uuid.UUID | None = None
+    message: str | None = None
@@ -1,7 +1,9 @@
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
 from db.model.facility import FacilityPhoto, Facility
+from service.data_version import facility_data_version
 from service.exc import FacilityNotFoundServiceException, PhotoNotFoundServiceException
 from service.model.photo_model import PhotoServiceModel
 
@@ -16,13 +18,16 @@ class PhotoService:
 
             photo = await FacilityPhoto.get_or_create(session, url, filename)
 
-            facility: Facility = (await session.execute(sa.select(Facility).where(Facility.id == facility_id))).scalar()
+            facility: Facility = (await session.execute(
+                sa.select(Facility).where(Facility.id == facility_id).options(so.selectinload(Facility.photo))
+            )).scalar()
             if facility is None:
                 raise FacilityNotFoundServiceException('Такого спортивного объекта не существует.')
 
             facility.photo.append(photo)
 
             await session.commit()
+            await facility_data_version.bump(self.async_session)
             await session.refresh(photo)
         return PhotoServiceModel.model_validate(photo)
 
@@ -36,7 +41,9 @@ class PhotoService:
         async with self.async_session() as session:
             session: AsyncSession
 
-            facility: Facility = (await session.execute(sa.select(Facility).where(Facility.id == facility_id))).scalar()
+            facility: Facility = (await session.execute(
+                sa.select(Facility).where(Facility.id == facility_id).options(so.selectinload(Facility.photo))
+            )).scalar()
             if facility is None:
                 raise FacilityNotFoundServiceException('Такого спортивного объекта не существует.')
 
@@ -51,4 +58,5 @@ class PhotoService:
 
             facility.photo.remove(photo)
             await session.commit()
+            await facility_data_version.bump(self.async_session)
         return filename
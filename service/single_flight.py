@@ -0,0 +1,38 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые параллельные запросы внутри воркера: пока запрос с ключом key выполняется,
+    остальные запросы с тем же ключом ждут его результат (или исключение), а не выполняют его заново.
+    """
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # запрос выполняется в отдельной задаче, чтобы отмена первого клиента не отменяла его для остальных
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._flights.pop(key, None)
+        # если все ожидающие отменены, исключение запроса никто не получит и asyncio запишет в лог
+        # "Task exception was never retrieved", поэтому оно считается полученным здесь
+        if not task.cancelled():
+            task.exception()
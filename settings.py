@@ -25,6 +25,14 @@ class Settings(BaseSettings):
 
     API_DEBUG: bool = False
 
+    API_SEARCH_CACHE_SIZE: int = 1024
+    API_SEARCH_CACHE_TTL: float = 60
+    API_DATA_VERSION_INTERVAL: float = 0.5
+
+    API_EXCEL_WORKERS: int = 1
+    API_EXCEL_MAX_SIZE: int = 20 * 1024 * 1024
+    API_EXCEL_TIMEOUT: float = 120
+
     SMTP_HOST: str = 'smtp.yandex.ru'
     SMTP_USER: str | None = None
     SMTP_PASSWORD: str | None = None
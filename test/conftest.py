@@ -1,6 +1,7 @@
 from api.app import create_app
 from db.db import DB
 from service.email_service import EmailService
+from service.excel_service import ExcelService
 from service.facility_enum_service import FacilityEnumService
 from service.facility_service import FacilityService
 from service.user_service import UserService
@@ -8,6 +9,7 @@ from settings import Settings
 
 from fastapi.testclient import TestClient
 import pytest
+import sqlalchemy as sa
 
 
 @pytest.fixture()
@@ -26,6 +28,19 @@ async def db(settings):
     yield db
 
 
+@pytest.fixture()
+async def statements(db):
+    """SQL-запросы, отправленные в бд во время теста."""
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa.event.listen(db.engine.sync_engine, 'before_cursor_execute', count_statement)
+    yield statements
+    sa.event.remove(db.engine.sync_engine, 'before_cursor_execute', count_statement)
+
+
 @pytest.fixture()
 async def user_service(db):
     yield UserService(async_session=db.async_session)
@@ -41,6 +56,11 @@ async def facility_enum_service(db):
     yield FacilityEnumService(async_session=db.async_session)
 
 
+@pytest.fixture()
+async def excel_service(db):
+    yield ExcelService(async_session=db.async_session)
+
+
 @pytest.fixture()
 async def email_service(db, settings):
     yield EmailService(async_session=db.async_session, settings=settings)
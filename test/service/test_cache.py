@@ -0,0 +1,132 @@
+import asyncio
+import gc
+
+from db.model.facility import facility_data_version_sequence
+from service.cache import VersionedCache
+from service.data_version import DataVersion
+from service.single_flight import SingleFlight
+
+
+def test_versioned_cache_lru():
+    cache = VersionedCache(DataVersion(facility_data_version_sequence), max_size=2, ttl=60)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.set('c', b'3')
+    # 'b' использовался раньше всех
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+
+
+async def test_versioned_cache_version(db):
+    version = DataVersion(facility_data_version_sequence)
+    cache = VersionedCache(version, max_size=10, ttl=60)
+    cache.set('a', b'1')
+    stale = version.value
+    await version.bump(db.async_session)
+    assert cache.get('a') is None
+    # результат, посчитанный до записи, не попадает в кеш
+    cache.set('a', b'old', stale)
+    assert cache.get('a') is None
+    cache.set('a', b'2')
+    assert cache.get('a') == b'2'
+
+
+async def test_data_version_shared(db):
+    # версии двух воркеров
+    version, other = DataVersion(facility_data_version_sequence), DataVersion(facility_data_version_sequence)
+    cache = VersionedCache(other, max_size=10, ttl=60)
+    await other.refresh(db.async_session)
+    cache.set('a', b'1')
+    value = await version.bump(db.async_session)
+    assert await other.refresh(db.async_session) == value
+    assert cache.get('a') is None
+
+
+async def test_data_version_poll(db):
+    version, other = DataVersion(facility_data_version_sequence), DataVersion(facility_data_version_sequence)
+    other.start(db.async_session, 0.01)
+    try:
+        value = await version.bump(db.async_session)
+        for _ in range(100):
+            if other.value == value:
+                break
+            await asyncio.sleep(0.01)
+        assert other.value == value
+    finally:
+        other.stop()
+
+
+def test_versioned_cache_ttl():
+    cache = VersionedCache(DataVersion(facility_data_version_sequence), max_size=10, ttl=-1)
+    cache.set('a', b'1')
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+async def test_single_flight():
+    flight = SingleFlight()
+    calls = 0
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return b'result'
+
+    tasks = [asyncio.create_task(flight.do('key', query)) for _ in range(5)]
+    await started.wait()
+    assert flight.in_flight == 1
+    release.set()
+    assert await asyncio.gather(*tasks) == [b'result'] * 5
+    assert calls == 1
+    assert flight.coalesced == 4
+    assert flight.in_flight == 0
+
+    # после завершения запрос выполняется заново
+    await flight.do('key', query)
+    assert calls == 2
+
+
+async def test_single_flight_exception():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0)
+        raise ValueError()
+
+    results = await asyncio.gather(flight.do('key', query), flight.do('key', query), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.coalesced == 1
+
+
+async def test_single_flight_exception_without_waiters():
+    flight = SingleFlight()
+    loop = asyncio.get_running_loop()
+    unhandled = []
+    loop.set_exception_handler(lambda _, context: unhandled.append(context))
+    release = asyncio.Event()
+
+    async def query():
+        await release.wait()
+        raise ValueError()
+
+    try:
+        waiter = asyncio.create_task(flight.do('key', query))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert waiter.cancelled()
+        release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert flight.in_flight == 0
+        del waiter
+        gc.collect()
+        assert unhandled == []
+    finally:
+        loop.set_exception_handler(None)
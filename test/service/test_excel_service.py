@@ -0,0 +1,317 @@
+import asyncio
+import datetime
+import io
+import uuid
+from contextlib import aclosing
+
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+from fastapi import UploadFile
+from pydantic import ValidationError
+
+from db.model.excel import ExcelImportJob
+from db.model.facility import Facility, FacilityType
+from service.exc import ExcelTooLargeServiceException, ExcelTimeoutServiceException, ExcelParseServiceException, \
+    ExcelImportJobNotFoundServiceException, ExcelImportJobStateServiceException, ExcelImportBusyServiceException
+from service.excel_service import ExcelService
+from service.facility_service import FacilityService
+from service.model.excel_model import FacilityExcelItemServiceModel, ExcelImportJobServiceModel
+
+
+def excel_bytes(sheets: dict[str, list[dict]]) -> bytes:
+    content = io.BytesIO()
+    with pd.ExcelWriter(content) as writer:
+        for name, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=name, index=False)
+    return content.getvalue()
+
+
+async def test_excel_read_excel():
+    excel_service = ExcelService(async_session=None)
+    sheets = {
+        'Бассейны': [
+            {'№': 'п/п', 'Наименование': 'наименование', 'Площадь': 'м2', 'ЕПС': 'чел.', 'Лишняя колонка': ''},
+            *({'№': i, 'Наименование': f'Бассейн {i}', 'Площадь': 100.5, 'ЕПС': i if i % 2 else None}
+              for i in range(1, 6)),
+            {},
+            {'№': 6, 'Наименование': 'Бассейн 6', 'Лишняя колонка': 'x'},
+            {},
+        ],
+        'Катки': [{'№': '', 'Наименование': ''}, {'№': 1, 'Наименование': 'Каток 1'}],
+        'Примечания': [{'Примечание к листу': ''}, {'Примечание к листу': 'x'}],
+    }
+    batches = list(excel_service.read_excel(excel_bytes(sheets), 2))
+    assert [len(b) for b in batches] == [2, 2, 2, 2, 1]
+    # как и в pd.read_excel, пустые строки отбрасываются только в конце листа
+    assert [f for b in batches for f in b] == [
+        *({'n': i, 'name': f'Бассейн {i}', 'area': 100.5, **({'eps': i} if i % 2 else {}), 'type': 'Бассейны'}
+          for i in range(1, 6)),
+        {'type': 'Бассейны'},
+        {'n': 6, 'name': 'Бассейн 6', 'type': 'Бассейны'},
+        {'n': 1, 'name': 'Каток 1', 'type': 'Катки'},
+        {'type': 'Примечания'},
+    ]
+
+
+async def test_excel_validate_excel_items():
+    rows = [
+        {'name': 'Бассейн 1', 'address': 'ул. Спортивная', 'owner': 'ГБУ', 'area': 100, 'type': 'Бассейны'},
+        {'name': 'Бассейн 2', 'address': 'ул. Спортивная', 'area': 'много', 'type': 'Бассейны', 'eps': 1.5},
+        {'name': 'Бассейн 3', 'address': 'ул. Спортивная', 'owner': 'ГБУ', 'area': 10.5, 'type': 'Бассейны'},
+    ]
+    items, errors = ExcelService.validate_excel_items(rows)
+    assert [None if item is None else item.name for item in items] == ['Бассейн 1', None, 'Бассейн 3']
+    assert list(errors) == [1]
+    # ошибки строки такие же, как при проверке одной строки
+    with pytest.raises(ValidationError) as err:
+        FacilityExcelItemServiceModel.model_validate(rows[1])
+    assert errors[1].json() == err.value.json()
+    assert errors[1].error_count() == 3
+
+
+async def test_excel_parse_in_pool(excel_service: ExcelService):
+    excel_service = ExcelService(excel_service.async_session, max_size=1024 * 1024, timeout=60)
+    # первая строка данных в шаблоне - пояснения к колонкам, она пропускается
+    content = excel_bytes({'Бассейны': [
+        {'№': 'п/п', 'Наименование': 'наименование', 'Адрес': 'адрес', 'Пользователь': '', 'Площадь': 'м2'},
+        {'№': 1, 'Наименование': 'Бассейн 1', 'Адрес': 'ул. Спортивная', 'Пользователь': 'ГБУ', 'Площадь': 100},
+        {'№': 2, 'Наименование': 'Бассейн 2', 'Адрес': 'ул. Спортивная', 'Пользователь': 'ГБУ', 'Площадь': 'много'},
+    ]})
+    try:
+        count, errors, duplicates = await excel_service.validate_excel(content)
+        assert count == 2
+        assert [e['n'] for e in errors] == [2]
+        assert duplicates == []
+
+        async with aclosing(excel_service.stream_excel(content)) as batches:
+            facilities = [f async for batch in batches for f in batch]
+        assert [f['name'] for f in facilities] == ['Бассейн 1', 'Бассейн 2']
+        assert facilities[0]['type'] == 'Бассейны'
+
+        with pytest.raises(ExcelParseServiceException):
+            await excel_service.validate_excel(b'not an excel file')
+        with pytest.raises(ExcelParseServiceException):
+            async with aclosing(excel_service.stream_excel(b'not an excel file')) as batches:
+                [batch async for batch in batches]
+
+        excel_service.max_size = 10
+        with pytest.raises(ExcelTooLargeServiceException):
+            await excel_service.validate_excel(content)
+
+        # разбор большой книги заведомо дольше таймаута, даже если event loop задержится
+        large = excel_bytes({'Бассейны': [
+            {'№': i, 'Наименование': f'Бассейн {i}', 'Адрес': 'ул. Спортивная', 'Площадь': 100} for i in range(3000)
+        ]})
+        excel_service.max_size, excel_service.timeout = None, 0.001
+        with pytest.raises(ExcelTimeoutServiceException):
+            await excel_service.validate_excel(large)
+        with pytest.raises(ExcelTimeoutServiceException):
+            async with aclosing(excel_service.stream_excel(large)) as batches:
+                [batch async for batch in batches]
+        # после таймаута следующий разбор запускается в новом процессе
+        excel_service.timeout = 60
+        count, _, _ = await excel_service.validate_excel(content)
+        assert count == 2
+    finally:
+        excel_service.close()
+
+
+async def test_excel_read_upload(excel_service: ExcelService):
+    excel_service = ExcelService(excel_service.async_session, max_size=10)
+    assert await excel_service.read_upload(UploadFile(io.BytesIO(b'0123456789'), size=10)) == b'0123456789'
+    # размер из заголовков загрузки проверяется до чтения
+    file = UploadFile(io.BytesIO(b'0123456789'), size=11)
+    with pytest.raises(ExcelTooLargeServiceException):
+        await excel_service.read_upload(file)
+    assert file.file.tell() == 0
+    # без размера читается не больше max_size + 1 байт
+    file = UploadFile(io.BytesIO(b'0' * 100))
+    with pytest.raises(ExcelTooLargeServiceException):
+        await excel_service.read_upload(file)
+    assert file.file.tell() == 11
+
+
+async def test_excel_import_workers(excel_service: ExcelService):
+    excel_service = ExcelService(excel_service.async_session, workers=1)
+    content = excel_bytes({'Бассейны': [
+        {'№': 'п/п', 'Наименование': 'наименование'},
+        *({'№': i, 'Наименование': f'Бассейн {i}'} for i in range(1, 4)),
+    ]})
+
+    async def read():
+        async with aclosing(excel_service.stream_excel(content)) as batches:
+            return [f async for batch in batches for f in batch]
+
+    # второй процесс чтения запускается только после завершения первого
+    async with aclosing(excel_service.stream_excel(content)) as batches:
+        assert len(await anext(batches)) == 3
+        second = asyncio.create_task(read())
+        await asyncio.sleep(0.5)
+        assert not second.done()
+    assert len(await second) == 3
+
+    # пока выполняется импорт, новый импорт отклоняется
+    job = await excel_service.create_import_job('a.xlsx', content)
+    excel_service.start_import_job(job.id)
+    with pytest.raises(ExcelImportBusyServiceException):
+        await excel_service.create_import_job('b.xlsx', content)
+    await asyncio.gather(*excel_service._import_tasks)
+    assert (await excel_service.get_import_job(job.id)).status == 'done'
+    await excel_service.create_import_job('b.xlsx', content)
+
+
+def row(n, name, **kwargs):
+    return {'n': n, 'name': name, 'address': 'ул. Спортивная', 'owner': 'ГБУ', 'area': 100, 'type': 'Бассейны',
+            **kwargs}
+
+
+async def import_rows(excel_service: ExcelService, rows: list[dict]) -> ExcelImportJobServiceModel:
+    # строки листа 'Бассейны' в колонках шаблона, первая строка данных - пояснения к колонкам
+    columns = {field: name for name, field in ExcelService._db_fields.items()}
+    content = excel_bytes({'Бассейны': [
+        {'№': 'п/п'},
+        *({columns[k]: v for k, v in r.items() if k != 'type'} for r in rows),
+    ]})
+    job = await excel_service.create_import_job(None, content)
+    return await excel_service.run_import_job(job.id)
+
+
+async def facility_ids(excel_service: ExcelService) -> dict[str, uuid.UUID]:
+    async with excel_service.async_session() as session:
+        return dict((await session.execute(sa.select(Facility.name, Facility.id))).all())
+
+
+async def test_excel_find_duplicates(excel_service: ExcelService):
+    await import_rows(excel_service, [row(1, 'Бассейн 1')])
+    facility_id = (await facility_ids(excel_service))['Бассейн 1']
+
+    keys = {}
+    errors = excel_service.validate_excel_facilities([
+        row(1, 'Бассейн 1', type='БАССЕЙНЫ'),
+        row(2, 'Бассейн 2'),
+        row(3, 'Бассейн 2'),
+        row(4, 'Бассейн 2', area=100.5),
+        row(5, 'Бассейн 1', area='много'),
+        row(6, 'Бассейн 1'),
+    ], keys)
+    assert [e['n'] for e in errors] == [5]
+    duplicates = await excel_service.find_excel_duplicates(keys)
+    assert sorted(duplicates, key=lambda d: d['n']) == [
+        {'n': 1, 'type': 'БАССЕЙНЫ', 'name': 'Бассейн 1', 'duplicate_of': None, 'facility_id': facility_id},
+        {'n': 3, 'type': 'Бассейны', 'name': 'Бассейн 2', 'duplicate_of': 2, 'facility_id': None},
+        {'n': 6, 'type': 'Бассейны', 'name': 'Бассейн 1', 'duplicate_of': 1, 'facility_id': facility_id},
+    ]
+    assert await excel_service.find_excel_duplicates({}) == []
+
+
+async def test_excel_import_rows(excel_service: ExcelService, facility_service: FacilityService):
+    excel_service.IMPORT_CHUNK_SIZE = 2
+    job = await import_rows(excel_service, [
+        row(1, 'Бассейн 1', covering_type='Вода', document=1234),
+        row(2, 'Бассейн 2'),
+        row(3, 'Бассейн 1', covering_type='Вода'),
+        row(4, 'Бассейн 3', area=None),
+        # не помещается в integer: пачка записывается по одной строке
+        row(5, 'Бассейн 4', eps=2 ** 40),
+        row(6, 'Бассейн 5'),
+    ])
+    assert (job.status, job.processed, job.inserted, job.duplicated, job.failed) == ('done', 6, 3, 1, 2)
+    ids = await facility_ids(excel_service)
+    assert sorted(ids) == ['Бассейн 1', 'Бассейн 2', 'Бассейн 5']
+
+    facility = await facility_service.get_by_id(ids['Бассейн 1'])
+    assert facility.hidden is False
+    assert facility.type.name == 'бассейны'
+    assert facility.covering_type.name == 'вода'
+    assert facility.document == '1234'
+    assert [pt.name for pt in facility.paying_type] == ['бюджетные']
+    assert {a.name for a in facility.age} == {'взрослые', 'дети', 'молодёжь', 'пенсионеры'}
+
+    count, _, _ = await facility_service.search(
+        True, None, None, None, None, None, None, None, None, None, ['бюджетные'], ['дети'], None
+    )
+    assert count == 3
+
+    job = await import_rows(excel_service, [row(1, 'Бассейн 2')])
+    assert (job.inserted, job.duplicated) == (0, 1)
+
+    # тип, закешированный воркером, удален в бд другим воркером: он создается заново
+    async with excel_service.async_session() as session:
+        await session.execute(sa.delete(Facility))
+        await session.execute(sa.delete(FacilityType).where(FacilityType.name == 'бассейны'))
+        await session.commit()
+    job = await import_rows(excel_service, [row(1, 'Бассейн 1'), row(2, 'Бассейн 2')])
+    assert (job.inserted, job.failed) == (2, 0)
+
+
+async def test_excel_import_job(excel_service: ExcelService):
+    def content(names):
+        return excel_bytes({'Бассейны': [
+            {'№': 'п/п', 'Наименование': 'наименование', 'Адрес': 'адрес', 'Пользователь': '', 'Площадь': 'м2'},
+            *({'№': i, 'Наименование': name, 'Адрес': 'ул. Спортивная', 'Пользователь': 'ГБУ', 'Площадь': 100}
+              for i, name in enumerate(names, 1)),
+        ]})
+
+    excel_service.IMPORT_CHUNK_SIZE = 2
+    job = await excel_service.create_import_job('a.xlsx', content(['Бассейн 1', 'Бассейн 2', 'Бассейн 1']))
+    assert job.status == 'running' and job.processed == 0
+
+    # отмененный импорт не выполняется, пока его не продолжат
+    job = await excel_service.cancel_import_job(job.id)
+    assert job.status == 'cancelled'
+    with pytest.raises(ExcelImportJobStateServiceException):
+        await excel_service.cancel_import_job(job.id)
+    job = await excel_service.run_import_job(job.id)
+    assert job.status == 'cancelled' and job.processed == 0
+
+    job = await excel_service.resume_import_job(job.id)
+    assert job.status == 'running'
+    # выполняющийся импорт продолжить нельзя
+    with pytest.raises(ExcelImportJobStateServiceException):
+        await excel_service.resume_import_job(job.id)
+    job = await excel_service.run_import_job(job.id)
+    assert (job.status, job.processed, job.inserted, job.duplicated, job.failed) == ('done', 3, 2, 1, 0)
+    with pytest.raises(ExcelImportJobStateServiceException):
+        await excel_service.resume_import_job(job.id)
+
+    # импорт продолжается с processed строки
+    job = await excel_service.create_import_job(None, content(['Бассейн 3', 'Бассейн 4', 'Бассейн 5', 'Бассейн 6']))
+    async with excel_service.async_session() as session:
+        await session.execute(sa.update(ExcelImportJob).where(ExcelImportJob.id == job.id).values(processed=3))
+        await session.commit()
+    job = await excel_service.run_import_job(job.id)
+    assert (job.status, job.processed, job.inserted) == ('done', 4, 1)
+
+    job = await excel_service.create_import_job(None, b'not an excel file')
+    job = await excel_service.run_import_job(job.id)
+    assert job.status == 'failed' and job.error is not None
+
+    # задачу, занятую другим исполнителем, импорт не трогает, пока тот обновляет heartbeat_at
+    job = await excel_service.create_import_job(None, content(['Бассейн 7']))
+    runner = uuid.uuid4()
+    async with excel_service.async_session() as session:
+        await session.execute(sa.update(ExcelImportJob).where(ExcelImportJob.id == job.id).values(
+            runner=runner, heartbeat_at=sa.func.now() - excel_service.IMPORT_JOB_STALE_AFTER
+        ))
+        await session.commit()
+    job = await excel_service.run_import_job(job.id)
+    assert (job.status, job.processed) == ('running', 0)
+    excel_service.IMPORT_JOB_HEARTBEAT = datetime.timedelta(seconds=0.01)
+    heartbeat = asyncio.create_task(excel_service._import_job_heartbeat(job.id, runner))
+    await asyncio.sleep(0.2)
+    heartbeat.cancel()
+    with pytest.raises(ExcelImportJobStateServiceException):
+        await excel_service.resume_import_job(job.id)
+    # без heartbeat задача считается прерванной и продолжается другим исполнителем
+    async with excel_service.async_session() as session:
+        await session.execute(sa.update(ExcelImportJob).where(ExcelImportJob.id == job.id).values(
+            heartbeat_at=sa.func.now() - excel_service.IMPORT_JOB_STALE_AFTER
+        ))
+        await session.commit()
+    job = await excel_service.resume_import_job(job.id)
+    job = await excel_service.run_import_job(job.id)
+    assert (job.status, job.processed, job.inserted) == ('done', 1, 1)
+
+    with pytest.raises(ExcelImportJobNotFoundServiceException):
+        await excel_service.get_import_job(uuid.uuid4())
@@ -1,9 +1,15 @@
+import json
 import uuid
 
 import pytest
+import sqlalchemy as sa
 
-from service.exc import FacilityAlreadyExistsServiceException, FacilityNotFoundServiceException
+from api.schema.facility import FacilityResponse, FacilitySearchResponse
+from db.model.facility import Facility, FacilityType, FacilityAge, facility_categories
+from service.exc import FacilityAlreadyExistsServiceException, FacilityNotFoundServiceException, \
+    FacilitySearchCursorServiceException, FacilityFieldsServiceException, FacilityVersionMismatchServiceException
 from service.facility_service import FacilityService
+from service.photo_service import PhotoService
 
 
 async def create_facility(facility_service_: FacilityService, facility_create_data_dict_):
@@ -178,3 +184,739 @@ async def test_facility_patch_already_exists(facility_service):
             facility1.id,
             facility_service.to_facility_patch_service_model(facility_patch_data)
         )
+
+
+async def test_facility_versioned_write(facility_service, db, statements):
+    facility = await create_facility(facility_service, {
+        "name": "versioned facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "paying_type": ["бюджетные"],
+    })
+    assert facility.version == 1
+    await PhotoService(db.async_session).create('https://example.com/v.png', 'v.png', facility.id)
+
+    statements.clear()
+    patched = await facility_service.patch(
+        facility.id, facility_service.to_facility_patch_service_model({"note": "изменен"}), version=2
+    )
+    # одно изменение - один UPDATE ... RETURNING и увеличение версии данных
+    assert len(statements) == 2
+    assert 'facility_data_version' in statements[1]
+    assert patched['version'] == 3
+    assert patched['note'] == "изменен"
+    assert patched['paying_type'] == ["бюджетные"]
+    assert [p['filename'] for p in patched['photo']] == ['v.png']
+    assert FacilityResponse.model_validate(patched)
+
+    with pytest.raises(FacilityVersionMismatchServiceException):
+        await facility_service.patch(
+            facility.id, facility_service.to_facility_patch_service_model({"note": "устарел"}), version=2
+        )
+    put = await facility_service.put(facility.id, facility_service.to_facility_put_service_model({
+        "name": "versioned facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "age": ["дети"],
+    }), version=3)
+    assert put['version'] == 4
+    assert put['paying_type'] == [] and put['age'] == ["дети"]
+    f = await facility_service.get_by_id(facility.id)
+    assert [a.name for a in f.age] == ["дети"] and f.paying_type == [] and f.note is None
+
+    # пакетные изменения тоже увеличивают версию
+    _, updated = await facility_service.bulk(
+        [], [(facility.id, facility_service.to_facility_patch_service_model({"note": "пакетом"}))]
+    )
+    assert updated[0].status == 'updated'
+    assert (await facility_service.get_by_id(facility.id)).version == 5
+
+    with pytest.raises(FacilityVersionMismatchServiceException):
+        await facility_service.delete(facility.id, version=4)
+    await facility_service.delete(facility.id, version=5)
+    with pytest.raises(FacilityNotFoundServiceException):
+        await facility_service.delete(facility.id)
+    with pytest.raises(FacilityNotFoundServiceException):
+        await facility_service.patch(facility.id, facility_service.to_facility_patch_service_model({"note": "-"}))
+
+
+async def test_facility_bulk(facility_service):
+    def facility_data(name, **kwargs):
+        return {
+            "name": name,
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "type": "ndfgn",
+            **kwargs
+        }
+
+    existing = await create_facility(facility_service, facility_data("bulk existing"))
+    other = await create_facility(facility_service, facility_data("bulk other"))
+
+    created, updated = await facility_service.bulk(
+        [
+            facility_service.to_facility_create_service_model(facility_data("bulk 1", paying_type=["платные"])),
+            facility_service.to_facility_create_service_model(facility_data("bulk existing")),
+            facility_service.to_facility_create_service_model(facility_data("bulk 2", age=["дети"])),
+            facility_service.to_facility_create_service_model(facility_data("bulk 2")),
+        ],
+        [
+            (existing.id, facility_service.to_facility_patch_service_model({"note": "изменен", "age": ["дети"]})),
+            (other.id, facility_service.to_facility_patch_service_model({"name": "bulk existing"})),
+            (uuid.uuid4(), facility_service.to_facility_patch_service_model({"note": "нет такого"})),
+        ]
+    )
+    assert [r.status for r in created] == ['created', 'error', 'created', 'error']
+    assert [r.status for r in updated] == ['updated', 'error', 'error']
+
+    facility = await facility_service.get_by_id(created[0].id)
+    assert facility.name == "bulk 1"
+    assert [pt.name for pt in facility.paying_type] == ["платные"]
+    facility = await facility_service.get_by_id(existing.id)
+    assert facility.note == "изменен"
+    assert (await facility_service.get_by_id(other.id)).name == "bulk other"
+
+    count, facilities, _ = await facility_service.search(
+        True, None, None, None, 'name', None, None, None, None, None, None, ["дети"], None
+    )
+    assert [f.name for f in facilities] == ["bulk 2", "bulk existing"]
+
+    created, updated = await facility_service.bulk([], [])
+    assert created == [] and updated == []
+
+
+async def test_facility_bulk_update_statements(facility_service, db, statements):
+    facilities = [
+        await create_facility(facility_service, {
+            "name": f"bulk update {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "type": "ndfgn",
+        })
+        for i in range(4)
+    ]
+
+    statements.clear()
+    _, updated = await facility_service.bulk([], [
+        (facilities[0].id, facility_service.to_facility_patch_service_model({"note": "0"})),
+        (facilities[1].id, facility_service.to_facility_patch_service_model({"note": "1"})),
+        (facilities[2].id, facility_service.to_facility_patch_service_model({"note": "2", "age": ["дети"]})),
+        (facilities[3].id, facility_service.to_facility_patch_service_model({"note": "3", "age": ["дети"]})),
+    ])
+    assert [r.status for r in updated] == ['updated'] * 4
+    # одинаковые наборы полей изменяются одним UPDATE
+    assert len([s for s in statements if s.startswith('UPDATE facility')]) == 2
+    for i, facility in enumerate(facilities):
+        f = await facility_service.get_by_id(facility.id)
+        assert (f.note, f.version) == (str(i), 2)
+        assert [a.name for a in f.age] == (["дети"] if i >= 2 else [a.name for a in facility.age])
+
+    # объект изменен после того, как его версия была прочитана
+    async with db.async_session() as session:
+        with pytest.raises(FacilityVersionMismatchServiceException):
+            await FacilityService._update_many(session, [(facilities[0].id, 1, {"note": "старая версия"})])
+    assert (await facility_service.get_by_id(facilities[0].id)).note == "0"
+
+
+async def test_facility_search_count_with_limit(facility_service):
+    for i in range(5):
+        await create_facility(facility_service, {
+            "name": f"search facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10 + i,
+            "type": "ndfgn" if i % 2 == 0 else "other",
+        })
+
+    count, facilities, _ = await facility_service.search(
+        False, None, 2, 0, 'area', True, None, None, None, None, None, None, None
+    )
+    assert count == 5
+    assert [f.area for f in facilities] == [14, 13]
+
+    count, facilities, _ = await facility_service.search(
+        False, None, 2, 0, 'area', None, None, ['ndfgn'], None, None, None, None, None
+    )
+    assert count == 3
+    assert [f.area for f in facilities] == [10, 12]
+
+    count, facilities, _ = await facility_service.search(
+        False, None, 2, 10, None, None, None, None, None, None, None, None, None
+    )
+    assert count == 5
+    assert facilities == []
+
+
+async def test_facility_search_as_dict(facility_service, db):
+    for i in range(3):
+        await create_facility(facility_service, {
+            "name": f"dict facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10 + i,
+            "eps": i,
+            "x": 59.9,
+            "y": 30.3,
+            "document": "1234",
+            "type": "ndfgn",
+            "covering_type": "гравийное" if i else None,
+            "paying_type": ["бюджетные", "платные"],
+            "age": ["дети"],
+        })
+    facility = (await facility_service.search(True, None, None, None, None, None, None, None, None, None, None,
+                                              None, None))[1][0]
+    await PhotoService(db.async_session).create('https://example.com/1.png', '1.png', facility.id)
+
+    count, facilities, _ = await facility_service.search(
+        True, None, None, None, 'area', None, None, None, None, None, None, None, None
+    )
+    dict_count, dict_facilities, _ = await facility_service.search(
+        True, None, None, None, 'area', None, None, None, None, None, None, None, None, as_dict=True
+    )
+    expected = FacilitySearchResponse(
+        count=count,
+        facilities=[FacilityResponse.from_service_model(f) for f in facilities]
+    ).model_dump_json()
+    assert json.loads(FacilitySearchResponse.dump_json(dict_count, dict_facilities, None)) == json.loads(expected)
+
+
+async def test_facility_search_fields(facility_service, statements):
+    facility = await create_facility(facility_service, {
+        "name": "fields facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "x": 59.9,
+        "y": 30.3,
+        "type": "ndfgn",
+        "paying_type": ["бюджетные"],
+    })
+
+    statements.clear()
+    _, facilities, _ = await facility_service.search(
+        True, None, None, None, None, None, None, None, None, None, None, None, None,
+        as_dict=True, fields=['name', 'x', 'y', 'type']
+    )
+    assert facilities == [{'name': 'fields facility', 'x': 59.9, 'y': 30.3, 'type': 'ndfgn'}]
+    # без связей - один запрос, в котором нет лишних колонок
+    assert len(statements) == 1
+    assert 'facility.owner' not in statements[0]
+
+    f = await facility_service.get_by_id(facility.id, as_dict=True, fields=['id', 'paying_type'])
+    assert f == {'id': facility.id, 'paying_type': ['бюджетные']}
+
+    with pytest.raises(FacilityFieldsServiceException):
+        await facility_service.get_by_id(facility.id, as_dict=True, fields=['name', 'password'])
+
+
+async def test_facility_search_single_flight(app, facility_service):
+    import asyncio
+
+    import httpx
+
+    from api.dependencies import get_app_context
+
+    await create_facility(facility_service, {
+        "name": "flight facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+    })
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = (await get_app_context()).db.engine.sync_engine
+    sa.event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        async with httpx.AsyncClient(app=app, base_url='http://test') as client:
+            response = await client.post('/v1/facility/search', json={"q": "facility", "limit": 10})
+            assert response.status_code == 200
+            single = len(statements)
+            assert single > 0
+
+            statements.clear()
+            responses = await asyncio.gather(*(
+                client.post('/v1/facility/search', json={"q": "flight", "limit": 10}) for _ in range(5)
+            ))
+            assert all(r.status_code == 200 and r.json()["count"] == 1 for r in responses)
+            # одинаковые параллельные поиски выполняются одним набором запросов
+            assert len(statements) == single
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', count_statement)
+
+
+async def test_facility_search_category_names_sync(facility_service):
+    facility = await create_facility(facility_service, {
+        "name": "names facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "paying_type": ["бюджетные"],
+        "age": ["дети"],
+    })
+
+    async def search(paying_type, age):
+        return (await facility_service.search(
+            True, None, None, None, None, None, None, None, None, None, paying_type, age, None
+        ))[0]
+
+    assert await search(['бюджетные', 'платные'], ['дети']) == 1
+    assert await search(['платные'], None) == 0
+
+    await facility_service.patch(facility.id, facility_service.to_facility_patch_service_model({
+        "paying_type": ["платные"]
+    }))
+    assert await search(['платные'], ['дети']) == 1
+    assert await search(['бюджетные'], None) == 0
+
+
+async def test_facility_search_open_at(facility_service):
+    closed = {"open": False}
+    day = {
+        "monday": {"open": True, "since": "09:00", "to": "18:00"},
+        "tuesday": closed, "wednesday": closed, "thursday": closed, "friday": closed, "saturday": closed,
+        "sunday": closed,
+    }
+    night = {**day, "monday": closed, "sunday": {"open": True, "since": "22:00", "to": "02:00"}}
+    day_facility = await create_facility(facility_service, {
+        "name": "day facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "working_hours": day,
+    })
+    await create_facility(facility_service, {
+        "name": "night facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "working_hours": night,
+    })
+
+    async def search(day_index, hours, minutes=0):
+        _, facilities, _ = await facility_service.search(
+            True, None, None, None, 'name', None, None, None, None, None, None, None, None,
+            open_at=(day_index * 24 + hours) * 60 + minutes
+        )
+        return [f.name for f in facilities]
+
+    assert await search(0, 10) == ['day facility']
+    assert await search(0, 18) == []
+    assert await search(6, 23) == ['night facility']
+    # ночь с воскресенья на понедельник
+    assert await search(0, 1, 59) == ['night facility']
+    assert await search(0, 2) == []
+
+    await facility_service.patch(day_facility.id, facility_service.to_facility_patch_service_model({
+        "working_hours": {**day, "monday": closed, "tuesday": {"open": True, "all_day": True}}
+    }))
+    assert await search(0, 10) == []
+    assert await search(1, 3) == ['day facility']
+
+
+async def test_facility_search_stream(facility_service):
+    for i in range(5):
+        await create_facility(facility_service, {
+            "name": f"stream facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10 + i,
+            "type": "ndfgn",
+            "paying_type": ["бюджетные"],
+        })
+
+    chunks = [
+        chunk async for chunk in facility_service.search_stream(
+            True, None, None, None, 'area', None, None, None, None, None, None, None, None, chunk_size=2
+        )
+    ]
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    _, facilities, _ = await facility_service.search(
+        True, None, None, None, 'area', None, None, None, None, None, None, None, None, as_dict=True
+    )
+    assert [f for chunk in chunks for f in chunk] == facilities
+
+    with pytest.raises(FacilitySearchCursorServiceException):
+        facility_service.search_stream(
+            False, None, 2, None, 'area', None, None, None, None, None, None, None, None, cursor='wrong'
+        )
+
+
+@pytest.mark.parametrize('order_by', ['name', 'eps', 'created_at', 'type'])
+@pytest.mark.parametrize('order_desc', [False, True])
+async def test_facility_search_cursor_pagination(facility_service, order_by, order_desc):
+    for i in range(7):
+        await create_facility(facility_service, {
+            "name": f"cursor facility {i % 3}",
+            "address": f"address {i}",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "eps": None if i % 3 == 0 else i % 2,
+            "type": "ndfgn" if i % 2 == 0 else "other",
+        })
+
+    count, expected, _ = await facility_service.search(
+        True, None, None, None, order_by, order_desc, None, None, None, None, None, None, None
+    )
+    assert count == 7
+
+    pages = []
+    cursor = None
+    while True:
+        count, facilities, cursor = await facility_service.search(
+            False, None, 3, None, order_by, order_desc, None, None, None, None, None, None, None, cursor=cursor
+        )
+        pages.append(facilities)
+        if cursor is None:
+            break
+    assert [f.id for page in pages for f in page] == [f.id for f in expected]
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+
+async def test_facility_search_cursor_wrong_order(facility_service):
+    for i in range(2):
+        await create_facility(facility_service, {
+            "name": f"cursor facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "type": "ndfgn",
+        })
+    _, _, cursor = await facility_service.search(
+        False, None, 1, None, 'name', None, None, None, None, None, None, None, None
+    )
+    with pytest.raises(FacilitySearchCursorServiceException):
+        await facility_service.search(
+            False, None, 1, None, 'area', None, None, None, None, None, None, None, None, cursor=cursor
+        )
+    with pytest.raises(FacilitySearchCursorServiceException):
+        await facility_service.search(
+            False, None, 1, None, 'name', None, None, None, None, None, None, None, None, cursor='garbage'
+        )
+
+
+async def test_facility_search_full_text(facility_service):
+    await create_facility(facility_service, {
+        "name": "Футбольное поле",
+        "address": "Невский проспект, 1",
+        "owner": "ГБОУ школа 1",
+        "area": 10,
+        "type": "плоскостные",
+    })
+    await create_facility(facility_service, {
+        "name": "Спортивный зал",
+        "address": "улица Футбольная, 5",
+        "owner": "ГБОУ школа 2",
+        "area": 10,
+        "type": "спортивные залы",
+    })
+    await create_facility(facility_service, {
+        "name": "Бассейн",
+        "address": "Садовая улица, 3",
+        "owner": "ООО Вода",
+        "area": 10,
+        "type": "бассейны",
+    })
+
+    count, facilities, _ = await facility_service.search(
+        True, 'футбольный', None, None, 'relevance', None, None, None, None, None, None, None, None
+    )
+    assert count == 2
+    # совпадение в названии ранжируется выше совпадения в адресе
+    assert [f.name for f in facilities] == ["Футбольное поле", "Спортивный зал"]
+
+    count, facilities, _ = await facility_service.search(
+        True, 'школа нев', None, None, None, None, None, None, None, None, None, None, None
+    )
+    assert [f.name for f in facilities] == ["Футбольное поле"]
+
+    count, facilities, _ = await facility_service.search(
+        True, 'бассейн', None, None, None, None, None, None, None, None, None, None, None
+    )
+    assert [f.name for f in facilities] == ["Бассейн"]
+
+    # только стоп-слова: поиск подстроки
+    count, facilities, _ = await facility_service.search(
+        True, 'на', None, None, 'name', None, None, None, None, None, None, None, None
+    )
+    assert [f.name for f in facilities] == ["Спортивный зал"]
+
+    # нет слов: тоже поиск подстроки, а не все объекты
+    count, facilities, _ = await facility_service.search(
+        True, '!!!', None, None, 'name', None, None, None, None, None, None, None, None
+    )
+    assert count == 0
+
+
+async def test_facility_search_relevance_cursor(facility_service):
+    for i in range(5):
+        await create_facility(facility_service, {
+            "name": "Каток" if i % 2 == 0 else f"Площадка {i}",
+            "address": f"возле катка, каток {i}",
+            "owner": "ООО Лед",
+            "area": 10,
+            "type": "крытые катки",
+        })
+    _, expected, _ = await facility_service.search(
+        True, 'каток', None, None, 'relevance', None, None, None, None, None, None, None, None
+    )
+    ids = []
+    cursor = None
+    while True:
+        _, facilities, cursor = await facility_service.search(
+            False, 'каток', 2, None, 'relevance', None, None, None, None, None, None, None, None, cursor=cursor
+        )
+        ids += [f.id for f in facilities]
+        if cursor is None:
+            break
+    assert ids == [f.id for f in expected]
+    assert len(ids) == 5
+
+
+async def test_facility_search_geo(facility_service):
+    # точки к северу от (59.94, 30.31) на 0, ~111, ~556, ~1113 и ~5566 метров
+    for i, dx in enumerate([0, 0.001, 0.005, 0.01, 0.05]):
+        await create_facility(facility_service, {
+            "name": f"geo facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "x": 59.94 + dx,
+            "y": 30.31,
+            "type": "ndfgn" if i % 2 == 0 else "other",
+        })
+    await create_facility(facility_service, {
+        "name": "geo facility without coords",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+    })
+
+    count, facilities, _ = await facility_service.search(
+        True, None, None, None, 'distance', None, None, None, None, None, None, None, None, 59.94, 30.31, radius=600
+    )
+    assert count == 3
+    assert [f.name for f in facilities] == ["geo facility 0", "geo facility 1", "geo facility 2"]
+
+    count, facilities, _ = await facility_service.search(
+        False, None, None, None, None, None, None, ['ndfgn'], None, None, None, None, None, 59.95, 30.31, nearest=2
+    )
+    assert count == 2
+    assert [f.name for f in facilities] == ["geo facility 2", "geo facility 0"]
+
+    count, facilities, _ = await facility_service.search(
+        True, None, None, None, None, None, None, None, None, None, None, None, None, 59.9405, 30.31
+    )
+    assert [f.name for f in facilities] == ["geo facility 0", "geo facility 1"]
+
+    ids = []
+    cursor = None
+    while True:
+        _, facilities, cursor = await facility_service.search(
+            False, None, 2, None, 'distance', True, None, None, None, None, None, None, None, 59.94, 30.31,
+            cursor=cursor, radius=10000
+        )
+        ids += [f.name for f in facilities]
+        if cursor is None:
+            break
+    assert ids == [f"geo facility {i}" for i in range(4, -1, -1)]
+
+
+async def test_facility_clusters(facility_service):
+    # две группы объектов на расстоянии ~5 км и один объект вне области
+    points = [(59.940, 30.310), (59.9401, 30.3101), (59.9402, 30.3102), (59.985, 30.310), (60.5, 30.31)]
+    for i, (x, y) in enumerate(points):
+        await create_facility(facility_service, {
+            "name": f"cluster facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "x": x,
+            "y": y,
+            "hidden": False,
+            "type": "ndfgn",
+        })
+    # скрытый объект в кластер не попадает, если фильтр hidden не передан явно
+    await create_facility(facility_service, {
+        "name": "hidden cluster facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "x": 59.940,
+        "y": 30.310,
+        "type": "ndfgn",
+    })
+
+    clusters = await facility_service.clusters(
+        59.9, 30.2, 60.0, 30.4, 11, None, None, None, None, None, None
+    )
+    clusters = sorted(clusters, key=lambda c: c.count)
+    assert [c.count for c in clusters] == [1, 3]
+    assert clusters[0].id is not None
+    assert clusters[1].id is None
+    assert abs(clusters[1].x - 59.9401) < 1e-6
+
+    clusters = await facility_service.clusters(
+        59.9, 30.2, 60.0, 30.4, 3, None, None, None, None, None, None
+    )
+    assert [c.count for c in clusters] == [4]
+
+    clusters = await facility_service.clusters(
+        59.9, 30.2, 60.0, 30.4, 3, True, None, None, None, None, None
+    )
+    assert [c.count for c in clusters] == [1]
+
+    clusters = await facility_service.clusters(
+        59.9, 30.2, 60.0, 30.4, 11, None, ['other'], None, None, None, None
+    )
+    assert clusters == []
+
+
+async def test_facility_markers(facility_service, statements):
+    facility = await create_facility(facility_service, {
+        "name": "marker facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "x": 59.94,
+        "y": 30.31,
+        "hidden": False,
+        "type": "ndfgn",
+    })
+    await create_facility(facility_service, {
+        "name": "hidden marker facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "x": 59.94,
+        "y": 30.31,
+        "type": "ndfgn",
+    })
+
+    etag, data = await facility_service.markers()
+    assert json.loads(data) == {"types": ["ndfgn"], "markers": [[str(facility.id), 59.94, 30.31, 0]]}
+    statements.clear()
+    assert (await facility_service.markers()) == (etag, data)
+    # закешированный ответ отдается без запросов в бд
+    assert statements == []
+
+    await facility_service.patch(facility.id, facility_service.to_facility_patch_service_model({"x": 60.0}))
+    new_etag, data = await facility_service.markers()
+    assert new_etag != etag
+    assert json.loads(data)["markers"] == [[str(facility.id), 60.0, 30.31, 0]]
+
+
+async def test_facility_facets(facility_service):
+    for i in range(4):
+        await create_facility(facility_service, {
+            "name": f"facet facility {i}",
+            "address": "wrhtjydsh jdgs z",
+            "owner": "OOO lol kek corp",
+            "area": 10,
+            "type": "ndfgn" if i < 3 else "other",
+            "covering_type": "гравийное" if i % 2 == 0 else None,
+            "paying_type": ["бюджетные", "платные"] if i == 0 else ["бюджетные"],
+            "age": ["дети"],
+        })
+
+    facets = await facility_service.facets(None, None, ['ndfgn'], None, None, ['платные'], None, None)
+    # фильтр по type не влияет на счетчики type, но влияет на остальные
+    assert facets['type'] == {'ndfgn': 1}
+    assert facets['paying_type'] == {'бюджетные': 3, 'платные': 1}
+    assert facets['covering_type'] == {'гравийное': 1}
+    assert facets['owning_type'] == {'другая': 1}
+    assert facets['age'] == {'дети': 1}
+
+    facets = await facility_service.facets(None, None, None, None, None, None, None, None)
+    assert facets['type'] == {'ndfgn': 3, 'other': 1}
+    assert facets['paying_type'] == {'бюджетные': 4, 'платные': 1}
+
+
+async def test_facility_relationships_not_lazy_loaded(facility_service, db):
+    facility = await create_facility(facility_service, {
+        "name": "lazy facility",
+        "address": "wrhtjydsh jdgs z",
+        "owner": "OOO lol kek corp",
+        "area": 10,
+        "type": "ndfgn",
+        "paying_type": ["бюджетные"],
+    })
+    async with db.async_session() as session:
+        facility_type = (
+            await session.execute(sa.select(FacilityType).where(FacilityType.name == 'ndfgn'))
+        ).scalar()
+        assert 'facilities' not in sa.inspect(facility_type).dict
+        with pytest.raises(sa.exc.InvalidRequestError):
+            _ = facility_type.facilities
+
+        f = await Facility.get_by_id(session, facility.id)
+        with pytest.raises(sa.exc.InvalidRequestError):
+            _ = f.paying_type
+
+    # удаление объекта удаляет и его связи с типами
+    await facility_service.delete(facility.id)
+
+
+async def test_facility_categories_resolve(db, statements):
+    async with db.async_session() as session:
+        categories = await facility_categories.resolve(session, {FacilityType: ['new type'], FacilityAge: ['дети']})
+        assert categories[FacilityType]['new type'].name == 'new type'
+        await session.rollback()
+    # откаченное название не считается известным
+    assert len(statements) == 1
+
+    async with db.async_session() as session:
+        await facility_categories.resolve(session, {FacilityType: ['new type']})
+        await session.commit()
+    assert len(statements) == 2
+
+    async with db.async_session() as session:
+        categories = await facility_categories.resolve(session, {FacilityType: ['new type'], FacilityAge: ['дети']})
+        assert categories[FacilityAge]['дети'].name == 'дети'
+        assert (await session.get(FacilityType, 'new type')) is categories[FacilityType]['new type']
+    assert len(statements) == 2
+
+
+async def test_facility_categories_deleted_elsewhere(facility_service, db):
+    def facility_data(name, **kwargs):
+        return {"name": name, "address": "wrhtjydsh jdgs z", "owner": "OOO lol kek corp", "area": 10, **kwargs}
+
+    async def delete_type(name):
+        # тип удаляется в бд другим воркером, кеш этого воркера о нем не знает
+        async with db.async_session() as session:
+            await session.execute(sa.delete(FacilityType).where(FacilityType.name == name))
+            await session.commit()
+
+    facility = await create_facility(facility_service, facility_data("stale 1", type="удаленный тип"))
+    await facility_service.delete(facility.id)
+    await delete_type("удаленный тип")
+    facility = await create_facility(facility_service, facility_data("stale 1", type="удаленный тип"))
+    assert facility.type.name == "удаленный тип"
+
+    other = await create_facility(facility_service, facility_data("stale 2", type="ndfgn"))
+    await facility_service.delete(facility.id)
+    await delete_type("удаленный тип")
+    patched = await facility_service.patch(
+        other.id, facility_service.to_facility_patch_service_model({"type": "удаленный тип"})
+    )
+    assert patched['type'] == "удаленный тип"
+
+    await facility_service.delete(other.id)
+    await delete_type("удаленный тип")
+    created, _ = await facility_service.bulk(
+        [facility_service.to_facility_create_service_model(facility_data("stale 3", type="удаленный тип"))], []
+    )
+    assert [r.status for r in created] == ['created']